@@ -1,6 +1,54 @@
 from django.contrib import admin
-from .models import Empleado, RegistroAsistencia, Configuracion
+from .models import Empleado, RegistroAsistencia, Configuracion, Ausencia, Sucursal, PeriodoCerrado, DispositivoKiosko
+from .periodos import rangos_cerrados, fecha_cerrada
+from .kiosko import revocar_dispositivo
+from django.utils import timezone
+
+
+class RegistroAsistenciaAdmin(admin.ModelAdmin):
+    # Los registros de un periodo cerrado quedan de solo lectura
+    def bloqueado(self, obj):
+        return obj is not None and fecha_cerrada(timezone.localtime(obj.fecha_hora_entrada).date(), rangos_cerrados(obj.sucursal_id))
+
+    def has_change_permission(self, request, obj=None):
+        return super().has_change_permission(request, obj) and not self.bloqueado(obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and not self.bloqueado(obj)
+
+
+class PeriodoCerradoAdmin(admin.ModelAdmin):
+    # Solo consulta; eliminar un periodo lo reabre
+    list_display = ('sucursal', 'fecha_inicio', 'fecha_fin', 'cerrado', 'cerrado_por')
+    list_filter = ('sucursal',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class DispositivoKioskoAdmin(admin.ModelAdmin):
+    # Los tokens se emiten desde Configuración; aquí solo se consultan y se revocan
+    list_display = ('nombre', 'sucursal', 'creado', 'creado_por', 'revocado')
+    list_filter = ('sucursal',)
+    readonly_fields = ('id', 'sucursal', 'nombre', 'creado', 'creado_por', 'revocado')
+    actions = ['revocar']
+
+    @admin.action(description='Revocar los dispositivos seleccionados')
+    def revocar(self, request, queryset):
+        for dispositivo in queryset.filter(revocado__isnull=True):
+            revocar_dispositivo(dispositivo)
+
+    def has_add_permission(self, request):
+        return False
+
 
 admin.site.register(Empleado)
-admin.site.register(RegistroAsistencia)
-admin.site.register(Configuracion)
\ No newline at end of file
+admin.site.register(RegistroAsistencia, RegistroAsistenciaAdmin)
+admin.site.register(Configuracion)
+admin.site.register(Ausencia)
+admin.site.register(Sucursal)
+admin.site.register(PeriodoCerrado, PeriodoCerradoAdmin)
+admin.site.register(DispositivoKiosko, DispositivoKioskoAdmin)
@@ -0,0 +1,167 @@
+from django.db.models import Avg, Case, Count, DurationField, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, TimeField, When
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, ExtractMinute, TruncDate, TruncMonth, TruncWeek
+from .models import HorarioDia
+from .cache import clave_cache, obtener_o_calcular
+
+NOMBRES_DIAS = dict(HorarioDia.DIAS_SEMANA)
+
+# Agrupaciones de las series de tiempo: día, semana (lunes) o mes de la fecha local de entrada
+PERIODOS_SERIE = {
+    'dia': lambda campo: TruncDate(campo),
+    'semana': lambda campo: TruncWeek(TruncDate(campo)),
+    'mes': lambda campo: TruncMonth(TruncDate(campo)),
+}
+
+
+def anotar_hora_esperada(registros):
+    """
+    Agrega a cada registro (en SQL) el día de la semana, la hora de entrada esperada
+    y los minutos de diferencia entre la entrada real y la esperada.
+    Replica la lógica de obtener_hora_entrada_esperada: horario fijo, horario del día,
+    día libre (sin hora esperada) o el horario general como respaldo.
+    """
+    horario_del_dia = HorarioDia.objects.filter(
+        empleado_id=OuterRef('empleado_id'),
+        dia_semana=OuterRef('dia_semana_idx'),
+    )
+    hora_esperada = Case(
+        When(empleado__usa_horario_variable=False, then=F('empleado__hora_entrada_supuesta')),
+        When(
+            Exists(horario_del_dia),
+            then=Subquery(horario_del_dia.filter(es_dia_libre=False).values('hora_entrada')[:1]),
+        ),
+        default=F('empleado__hora_entrada_supuesta'),
+        output_field=TimeField(),
+    )
+    return registros.annotate(
+        # ExtractIsoWeekDay: 1=Lunes ... 7=Domingo; HorarioDia usa 0=Lunes
+        dia_semana_idx=ExtractIsoWeekDay('fecha_hora_entrada') - 1,
+        hora_esperada=hora_esperada,
+    ).annotate(
+        minutos_diferencia=(
+            ExtractHour('fecha_hora_entrada') * 60 + ExtractMinute('fecha_hora_entrada')
+            - (ExtractHour('hora_esperada') * 60 + ExtractMinute('hora_esperada'))
+        ),
+    )
+
+
+def _agregados_puntualidad():
+    return {
+        'total': Count('id'),
+        'tardes': Count('id', filter=Q(llego_tarde=True)),
+        'promedio_minutos_tarde': Avg(
+            Case(When(llego_tarde=True, hora_esperada__isnull=False, then=F('minutos_diferencia')),
+                 output_field=IntegerField())
+        ),
+    }
+
+
+def _formatear_fila(fila):
+    total = fila['total']
+    fila['porcentaje_tarde'] = round(fila['tardes'] * 100 / total, 1) if total else 0
+    promedio = fila['promedio_minutos_tarde']
+    fila['promedio_minutos_tarde'] = round(promedio, 1) if promedio is not None else None
+    return fila
+
+
+def calcular_puntualidad(registros):
+    """
+    Calcula el porcentaje de retardos y los minutos promedio de retraso agrupando en SQL
+    por empleado, por día de la semana y por semana. `registros` ya viene filtrado.
+    """
+    base = anotar_hora_esperada(registros.order_by())
+    agregados = _agregados_puntualidad()
+
+    por_empleado = [
+        _formatear_fila(fila) for fila in
+        base.values('empleado_id', 'empleado__nombre', 'empleado__apellido')
+            .annotate(**agregados)
+            .order_by('empleado__nombre', 'empleado__apellido')
+    ]
+
+    por_dia = []
+    for fila in base.values('dia_semana_idx').annotate(**agregados).order_by('dia_semana_idx'):
+        fila['dia'] = NOMBRES_DIAS.get(fila['dia_semana_idx'], '')
+        por_dia.append(_formatear_fila(fila))
+
+    por_semana = [
+        _formatear_fila(fila) for fila in
+        base.values(semana=TruncWeek(TruncDate('fecha_hora_entrada')))
+            .annotate(**agregados)
+            .order_by('semana')
+    ]
+
+    total = sum(fila['total'] for fila in por_empleado)
+    tardes = sum(fila['tardes'] for fila in por_empleado)
+    return {
+        'por_empleado': por_empleado,
+        'por_dia': por_dia,
+        'por_semana': por_semana,
+        'total': total,
+        'tardes': tardes,
+        'porcentaje_tarde': round(tardes * 100 / total, 1) if total else 0,
+    }
+
+
+def obtener_puntualidad(registros, filtros):
+    """
+    Devuelve el reporte de puntualidad desde cache; lo recalcula si cambió la versión de los datos.
+    """
+    return obtener_o_calcular(
+        'puntualidad',
+        (filtros['empleado_id'], filtros['fecha_inicio'], filtros['fecha_fin']),
+        lambda: calcular_puntualidad(registros),
+        sucursal_id=filtros['sucursal_id'],
+    )
+
+
+def calcular_series(registros, periodo):
+    """
+    Series de tiempo para gráficas, en una sola consulta agrupada por periodo:
+    entradas, retardos, horas trabajadas (turnos cerrados) y empleados presentes.
+    Devuelve listas paralelas, listas para pasarse a una librería de gráficas.
+    """
+    filas = (
+        registros.order_by()
+        .values(periodo=PERIODOS_SERIE[periodo]('fecha_hora_entrada'))
+        .annotate(
+            entradas=Count('id'),
+            tardes=Count('id', filter=Q(llego_tarde=True)),
+            presentes=Count('empleado_id', distinct=True),
+            duracion=Sum(
+                F('fecha_hora_salida') - F('fecha_hora_entrada'),
+                filter=Q(fecha_hora_salida__isnull=False),
+                output_field=DurationField(),
+            ),
+        )
+        .order_by('periodo')
+    )
+
+    series = {'periodos': [], 'entradas': [], 'tardes': [], 'horas': [], 'presentes': []}
+    for fila in filas:
+        series['periodos'].append(fila['periodo'].isoformat())
+        series['entradas'].append(fila['entradas'])
+        series['tardes'].append(fila['tardes'])
+        series['horas'].append(round(fila['duracion'].total_seconds() / 3600, 2) if fila['duracion'] else 0)
+        series['presentes'].append(fila['presentes'])
+    return series
+
+
+def partes_series(filtros, periodo):
+    return (periodo, filtros['empleado_id'], filtros['fecha_inicio'], filtros['fecha_fin'])
+
+
+def etiqueta_series(filtros, periodo):
+    """
+    ETag de las series: la clave de cache (versión de los datos + filtros), sin tocar la BD.
+    """
+    return clave_cache('series', *partes_series(filtros, periodo), sucursal_id=filtros['sucursal_id'])
+
+
+def obtener_series(registros, filtros, periodo):
+    return obtener_o_calcular(
+        'series',
+        partes_series(filtros, periodo),
+        lambda: {'periodo': periodo, **calcular_series(registros, periodo)},
+        sucursal_id=filtros['sucursal_id'],
+    )
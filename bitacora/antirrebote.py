@@ -0,0 +1,125 @@
+import asyncio
+import math
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+# Antirrebote y límite de escaneos por dispositivo, antes de llegar a la base de datos.
+# Las cámaras del kiosko suelen leer el mismo gafete varias veces en un segundo: la primera
+# lectura se procesa y las repetidas (mismo gafete, acción y cliente) dentro de la ventana
+# reciben el resultado guardado. Además, cada dispositivo tiene un límite de escaneos por
+# ventana de tiempo para no saturar al único escritor de SQLite.
+# La cache 'escaneos' vive en el proceso; con REDIS_URL se comparte entre workers. Todo se hace
+# con operaciones atómicas de la cache (add, incr), así que el límite es por dispositivo en
+# todos los workers, no por proceso: ninguna lectura y reescritura puede perder un conteo.
+
+cache_escaneos = caches['escaneos']
+
+EN_CURSO = 'en_curso'
+ESPERA_RESULTADO_SEGUNDOS = 2
+PAUSA_SONDEO_SEGUNDOS = 0.05
+
+
+def identificar_cliente(request):
+    """
+    Identifica al dispositivo: su token de kiosko, la sesión o, si no hay ninguno, la IP.
+    """
+    kiosko = getattr(request, 'kiosko', None)
+    if kiosko:
+        return f"kiosko:{kiosko['dispositivo_id']}"
+    return request.session.session_key or request.META.get('REMOTE_ADDR', 'desconocido')
+
+
+def clave_escaneo(codigo, accion, cliente):
+    return f"bitacora:escaneo:{codigo}:{accion}:{cliente}"
+
+
+def reclamar_escaneo(codigo, accion, cliente):
+    """
+    Devuelve el resultado de un escaneo idéntico reciente, o None si este escaneo debe procesarse
+    (en cuyo caso queda reservado hasta llamar a recordar_resultado o liberar_escaneo).
+    Si otra lectura del mismo gafete se está procesando, espera brevemente su resultado.
+    """
+    clave = clave_escaneo(codigo, accion, cliente)
+    ventana = settings.ESCANEOS_VENTANA_SEGUNDOS
+    if cache_escaneos.add(clave, EN_CURSO, timeout=ventana):
+        return None
+
+    limite = time.monotonic() + ESPERA_RESULTADO_SEGUNDOS
+    while True:
+        resultado = cache_escaneos.get(clave)
+        if resultado is None:
+            # La reserva expiró o se liberó por un error: intentamos procesar nosotros
+            if cache_escaneos.add(clave, EN_CURSO, timeout=ventana):
+                return None
+        elif resultado != EN_CURSO:
+            return resultado
+        if time.monotonic() >= limite:
+            return None
+        time.sleep(PAUSA_SONDEO_SEGUNDOS)
+
+
+async def areclamar_escaneo(codigo, accion, cliente):
+    """
+    Versión async de reclamar_escaneo: la espera del resultado ajeno no ocupa un hilo.
+    """
+    clave = clave_escaneo(codigo, accion, cliente)
+    ventana = settings.ESCANEOS_VENTANA_SEGUNDOS
+    if await cache_escaneos.aadd(clave, EN_CURSO, timeout=ventana):
+        return None
+
+    limite = time.monotonic() + ESPERA_RESULTADO_SEGUNDOS
+    while True:
+        resultado = await cache_escaneos.aget(clave)
+        if resultado is None:
+            if await cache_escaneos.aadd(clave, EN_CURSO, timeout=ventana):
+                return None
+        elif resultado != EN_CURSO:
+            return resultado
+        if time.monotonic() >= limite:
+            return None
+        await asyncio.sleep(PAUSA_SONDEO_SEGUNDOS)
+
+
+def recordar_resultado(codigo, accion, cliente, resultado):
+    cache_escaneos.set(clave_escaneo(codigo, accion, cliente), resultado, timeout=settings.ESCANEOS_VENTANA_SEGUNDOS)
+
+
+async def arecordar_resultado(codigo, accion, cliente, resultado):
+    await cache_escaneos.aset(clave_escaneo(codigo, accion, cliente), resultado, timeout=settings.ESCANEOS_VENTANA_SEGUNDOS)
+
+
+def liberar_escaneo(codigo, accion, cliente):
+    cache_escaneos.delete(clave_escaneo(codigo, accion, cliente))
+
+
+async def aliberar_escaneo(codigo, accion, cliente):
+    await cache_escaneos.adelete(clave_escaneo(codigo, accion, cliente))
+
+
+def consumir_ficha(cliente):
+    """
+    Límite por dispositivo en ventanas fijas: ESCANEOS_RAFAGA escaneos por ventana, y la ventana
+    dura lo que tardaría en recargarse esa ráfaga a ESCANEOS_POR_MINUTO (10 escaneos a 30 por minuto:
+    ventanas de 20 s). En el cambio de ventana se pueden juntar hasta dos ráfagas.
+    Devuelve (permitido, segundos_para_reintentar).
+    """
+    capacidad = settings.ESCANEOS_RAFAGA
+    ventana = capacidad * 60 / settings.ESCANEOS_POR_MINUTO
+    ahora = time.time()
+    numero = int(ahora // ventana)
+    clave = f"bitacora:escaneo:fichas:{cliente}:{numero}"
+
+    duracion = math.ceil(ventana) + 1
+    if cache_escaneos.add(clave, 1, timeout=duracion):
+        usados = 1
+    else:
+        try:
+            usados = cache_escaneos.incr(clave)
+        except ValueError:
+            # La clave expiró (o la sacó la cache) entre add() e incr(): empieza de nuevo
+            usados = 1 if cache_escaneos.add(clave, 1, timeout=duracion) else cache_escaneos.incr(clave)
+
+    if usados <= capacidad:
+        return True, 0
+    return False, max(1, math.ceil((numero + 1) * ventana - ahora))
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class BitacoraConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bitacora'
+
+    def ready(self):
+        # Registra los receptores de señales (invalidación de cache de reportes)
+        from . import signals  # noqa: F401
+
+        # Índice de texto completo de empleados (SQLite/FTS5); se revisa tras cada migrate
+        from django.db.models.signals import post_migrate
+        from .busqueda import asegurar_indice_fts
+        post_migrate.connect(asegurar_indice_fts, sender=self)
@@ -0,0 +1,125 @@
+import re
+import unicodedata
+from django.core.paginator import Paginator
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Empleado
+
+# Búsqueda de empleados por nombre, apellido, puesto y email, sin distinguir acentos.
+# En SQLite con FTS5 se usa un índice de texto completo (tabla virtual + triggers);
+# en cualquier otro caso se busca sobre la columna normalizada Empleado.busqueda.
+# Las dos rutas cortan las palabras igual que el tokenizador unicode61 de FTS5: cualquier
+# caracter que no sea letra o número separa ('ana.lopez@x.mx' -> 'ana lopez x mx'), así que
+# una búsqueda da lo mismo en SQLite que en PostgreSQL.
+# La columna se filtra con LIKE '%...%' (un término puede empezar a media columna). En PostgreSQL
+# lo resuelve un índice de trigramas (migración 0015, si el servidor tiene pg_trgm); en SQLite
+# sin FTS5 es un recorrido de la tabla de empleados, que es pequeña.
+
+TABLA_FTS = 'bitacora_empleado_fts'
+RESULTADOS_POR_PAGINA = 20
+
+_SQL_FTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+        nombre, apellido, puesto, email,
+        content='bitacora_empleado', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON bitacora_empleado BEGIN
+        INSERT INTO {TABLA_FTS}(rowid, nombre, apellido, puesto, email)
+        VALUES (new.id, new.nombre, new.apellido, new.puesto, new.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON bitacora_empleado BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, apellido, puesto, email)
+        VALUES ('delete', old.id, old.nombre, old.apellido, old.puesto, old.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE ON bitacora_empleado BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, apellido, puesto, email)
+        VALUES ('delete', old.id, old.nombre, old.apellido, old.puesto, old.email);
+        INSERT INTO {TABLA_FTS}(rowid, nombre, apellido, puesto, email)
+        VALUES (new.id, new.nombre, new.apellido, new.puesto, new.email);
+    END""",
+    f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')",
+]
+
+_fts_disponible = None
+
+
+def normalizar(texto):
+    """
+    Minúsculas y sin acentos: 'José Núñez' -> 'jose nunez'.
+    """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+
+def palabras(texto):
+    """
+    Palabras normalizadas del texto, cortadas como las corta FTS5: 'Ana.López' -> ['ana', 'lopez'].
+    """
+    return [palabra for palabra in re.split(r'[\W_]+', normalizar(texto)) if palabra]
+
+
+def texto_busqueda(empleado):
+    """
+    Contenido de la columna normalizada Empleado.busqueda.
+    """
+    partes = [empleado.nombre, empleado.apellido, empleado.puesto, empleado.email]
+    return ' '.join(palabras(' '.join(parte for parte in partes if parte)))
+
+
+def asegurar_indice_fts(using='default', **kwargs):
+    """
+    Crea (si falta) el índice FTS5 y sus triggers, y lo reconstruye.
+    Se llama después de cada migrate: en SQLite las migraciones que rehacen la tabla
+    de empleados eliminan los triggers, así que no basta con crearlos una vez.
+    """
+    global _fts_disponible
+    conexion = connections[using]
+    if conexion.vendor != 'sqlite':
+        return
+    try:
+        with conexion.cursor() as cursor:
+            for sql in _SQL_FTS:
+                cursor.execute(sql)
+        _fts_disponible = True
+    except Exception:
+        # SQLite compilado sin FTS5: se usa la columna normalizada
+        _fts_disponible = False
+
+
+def fts_disponible():
+    global _fts_disponible
+    if _fts_disponible is None:
+        _fts_disponible = connection.vendor == 'sqlite' and TABLA_FTS in connection.introspection.table_names()
+    return _fts_disponible
+
+
+def _consulta_fts(terminos):
+    # Cada término se busca como prefijo y entre comillas para que no se interprete como sintaxis FTS
+    return ' '.join(f'"{termino}"*' for termino in terminos)
+
+
+def buscar_empleados(texto, empleados=None):
+    """
+    Filtra `empleados` (por defecto todos) por el texto de búsqueda. Todos los términos
+    deben coincidir con el inicio de alguna palabra de nombre, apellido, puesto o email.
+    """
+    empleados = Empleado.objects.all() if empleados is None else empleados
+    terminos = palabras(texto)
+    if not terminos:
+        return empleados
+
+    if fts_disponible():
+        return empleados.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s",
+            [_consulta_fts(terminos)],
+        ))
+
+    for termino in terminos:
+        empleados = empleados.filter(Q(busqueda__startswith=termino) | Q(busqueda__contains=' ' + termino))
+    return empleados
+
+
+def paginar(empleados, pagina, por_pagina=RESULTADOS_POR_PAGINA):
+    return Paginator(empleados, por_pagina).get_page(pagina)
@@ -0,0 +1,78 @@
+import pickle
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+
+# --- Versión de los datos de asistencia ---
+# Cada resultado cacheado incluye esta versión en su clave. Cuando cambia un registro
+# (o un horario/empleado) se incrementa la versión y las claves viejas dejan de usarse solas.
+# Hay una versión global y una por sucursal: un escaneo en una tienda solo invalida
+# los reportes de esa tienda.
+CLAVE_VERSION_ASISTENCIA = 'bitacora:version_asistencia'
+
+# Cache dedicada a resultados de reportes (con límite de entradas, ver CACHES en settings)
+cache_reportes = caches['reportes']
+
+
+def clave_version(sucursal_id=None):
+    return CLAVE_VERSION_ASISTENCIA if sucursal_id is None else f"{CLAVE_VERSION_ASISTENCIA}:{sucursal_id}"
+
+
+def obtener_version_asistencia(sucursal_id=None):
+    """
+    Devuelve la versión actual de los datos de asistencia (combinada con la de la sucursal, si se indica).
+    Si la clave se perdió (reinicio o desalojo) arranca en un valor basado en la hora,
+    para no volver nunca a una versión que ya se usó.
+    """
+    version = cache.get_or_set(CLAVE_VERSION_ASISTENCIA, time.time_ns, timeout=None)
+    if sucursal_id is None:
+        return version
+    return f"{version}.{cache.get_or_set(clave_version(sucursal_id), time.time_ns, timeout=None)}"
+
+
+def invalidar_cache_asistencia(sucursal_id=None):
+    """
+    Incrementa la versión de los datos para que los reportes cacheados se recalculen.
+    Sin sucursal se invalidan los reportes de todas. Dentro de una transacción se hace al
+    confirmarla: antes del commit, un reporte calculado con los datos viejos quedaría
+    guardado bajo la versión nueva (y las series con un ETag que ya no cambia).
+    """
+    transaction.on_commit(lambda: _incrementar_version(sucursal_id))
+
+
+def _incrementar_version(sucursal_id):
+    clave = clave_version(sucursal_id)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        # La clave no existía (cache reiniciada): empezamos una versión nueva
+        cache.set(clave, time.time_ns(), timeout=None)
+
+
+def clave_cache(prefijo, *partes, sucursal_id=None):
+    """
+    Construye una clave de cache con la versión actual y las partes normalizadas del filtro.
+    """
+    partes_str = ':'.join('' if parte is None else str(parte) for parte in partes)
+    return f"bitacora:{prefijo}:s{sucursal_id}:v{obtener_version_asistencia(sucursal_id)}:{partes_str}"
+
+
+def obtener_o_calcular(prefijo, partes, calcular, sucursal_id=None):
+    """
+    Devuelve el resultado cacheado para (prefijo, partes) con la versión actual de los datos,
+    o lo calcula con `calcular()` y lo guarda. Los resultados más grandes que
+    REPORTES_CACHE_MAX_BYTES no se guardan para no desplazar a todos los demás.
+    """
+    clave = clave_cache(prefijo, *partes, sucursal_id=sucursal_id)
+    serializado = cache_reportes.get(clave)
+    if serializado is not None:
+        return pickle.loads(serializado)
+
+    valor = calcular()
+    # Se serializa una sola vez: los mismos bytes sirven para medir el tamaño y para guardarlo
+    # (el backend, al volver a serializarlos, solo copia los bytes)
+    serializado = pickle.dumps(valor, pickle.HIGHEST_PROTOCOL)
+    if len(serializado) <= settings.REPORTES_CACHE_MAX_BYTES:
+        cache_reportes.set(clave, serializado)
+    return valor
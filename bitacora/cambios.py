@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from openpyxl import Workbook
+from .models import RegistroAsistencia, RegistroEliminado
+
+# Exportación incremental ("desde la última exportación").
+# El cliente manda la marca de agua que recibió la vez anterior (cabecera X-Marca-Agua)
+# y solo se leen los registros modificados y las lápidas posteriores a ella, más un solape de
+# CAMBIOS_SOLAPE_SEGUNDOS hacia atrás para las filas que se confirmaron tarde.
+# Dentro del solape pueden repetirse cambios ya enviados: son idénticos (mismo 'id' y
+# 'modificado'), así que quien consume la exportación los descarta por esa pareja, o
+# simplemente los vuelve a aplicar (upsert y delete son idempotentes).
+
+FORMATOS = ('jsonl', 'csv', 'xlsx')
+COLUMNAS = [
+    'operacion', 'id', 'empleado_id', 'empleado',
+    'fecha_hora_entrada', 'fecha_hora_salida', 'llego_tarde',
+    'requiere_revision', 'notas', 'modificado',
+]
+
+
+def leer_marca_agua(valor):
+    """
+    Convierte la marca de agua recibida (ISO 8601) a datetime con zona horaria.
+    Lanza ValueError si no es válida.
+    """
+    marca = parse_datetime(valor)
+    if marca is None:
+        raise ValueError(f"Marca de agua inválida: {valor}")
+    if timezone.is_naive(marca):
+        marca = marca.replace(tzinfo=dt_timezone.utc)
+    return marca
+
+
+def calcular_ventana(desde):
+    """
+    Devuelve (inicio, hasta, siguiente_marca). El límite superior se deja unos segundos
+    atrás del reloj; el inferior es la marca recibida menos el solape, porque 'modificado'
+    es la hora del save() y una transacción larga lo confirma después de la marca.
+    """
+    hasta = timezone.now() - timedelta(seconds=settings.CAMBIOS_MARGEN_SEGUNDOS)
+    if not desde:
+        return None, hasta, hasta
+    inicio = desde - timedelta(seconds=settings.CAMBIOS_SOLAPE_SEGUNDOS)
+    return inicio, hasta, max(desde, hasta)
+
+
+def iterar_cambios(sucursal_id, inicio, hasta):
+    """
+    Genera un diccionario por cambio de la sucursal: primero altas/modificaciones ('upsert'),
+    después eliminaciones ('delete'). Ambas consultas usan los índices (sucursal, fecha).
+    """
+    registros = RegistroAsistencia.objects.filter(sucursal_id=sucursal_id, modificado__lte=hasta)
+    lapidas = RegistroEliminado.objects.filter(sucursal_id=sucursal_id, eliminado__lte=hasta)
+    if inicio:
+        registros = registros.filter(modificado__gt=inicio)
+        lapidas = lapidas.filter(eliminado__gt=inicio)
+
+    for registro in registros.select_related('empleado').order_by('modificado', 'id').iterator(chunk_size=2000):
+        yield {
+            'operacion': 'upsert',
+            'id': registro.id,
+            'empleado_id': registro.empleado_id,
+            'empleado': str(registro.empleado),
+            'fecha_hora_entrada': registro.fecha_hora_entrada.isoformat(),
+            'fecha_hora_salida': registro.fecha_hora_salida.isoformat() if registro.fecha_hora_salida else None,
+            'llego_tarde': registro.llego_tarde,
+            'requiere_revision': registro.requiere_revision,
+            'notas': registro.notas,
+            'modificado': registro.modificado.isoformat(),
+        }
+
+    for lapida in lapidas.order_by('eliminado', 'id').iterator(chunk_size=2000):
+        yield {
+            'operacion': 'delete',
+            'id': lapida.registro_id,
+            'empleado_id': lapida.empleado_id,
+            'empleado': None,
+            'fecha_hora_entrada': None,
+            'fecha_hora_salida': None,
+            'llego_tarde': None,
+            'requiere_revision': None,
+            'notas': None,
+            'modificado': lapida.eliminado.isoformat(),
+        }
+
+
+def lineas_jsonl(cambios):
+    for cambio in cambios:
+        yield json.dumps(cambio, ensure_ascii=False) + '\n'
+
+
+def lineas_csv(cambios):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def vaciar():
+        contenido = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return contenido
+
+    writer.writerow(COLUMNAS)
+    yield vaciar()
+    for cambio in cambios:
+        writer.writerow(['' if cambio[columna] is None else cambio[columna] for columna in COLUMNAS])
+        yield vaciar()
+
+
+def excel_cambios(cambios):
+    """
+    Libro de solo escritura con una fila por cambio; devuelve los bytes.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Cambios")
+    ws.append(COLUMNAS)
+    for cambio in cambios:
+        ws.append([cambio[columna] for columna in COLUMNAS])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,320 @@
+import glob
+import heapq
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from operator import itemgetter
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from .models import AvanceDiario, Empleado
+from .escaneos import aplicar_escaneo
+
+try:
+    import fcntl
+except ImportError:  # Windows (runserver): un solo proceso, basta el candado del hilo
+    fcntl = None
+
+# Diario de escaneos (write-ahead log).
+# Con ESCANEOS_DIARIO activo, el kiosko no espera al candado de escritura de SQLite: cada escaneo
+# se agrega a un archivo local, se hace fsync y se confirma de inmediato. Un hilo por proceso
+# aplica después los escaneos en lotes, cada lote en una transacción junto con su avance
+# (AvanceDiario), así que un lote nunca se aplica dos veces aunque el proceso muera a la mitad.
+#
+# Archivos: diario-<pid>-<id>.jsonl es el que el proceso está escribiendo; al rotarlo pasa a
+# diario-<pid>-<id>.pendiente. Cada worker escribe el suyo, pero un solo proceso a la vez
+# (candado flock) aplica los de todos, mezclados en orden de hora; los archivos de procesos
+# que ya no existen (reinicio, worker caído) se aplican igual y después se borran.
+# Los escaneos que no se pueden aplicar van a rechazados.jsonl en lugar de detener el diario.
+
+logger = logging.getLogger(__name__)
+
+_candado = threading.Lock()
+_candado_vaciado = threading.Lock()  # Un solo vaciado a la vez por proceso (hilo aplicador o comando)
+_archivo = None          # Archivo activo del proceso (abierto en modo append)
+_ruta_activa = None
+_pid_archivo = None      # Proceso dueño del archivo activo (un hijo de fork abre el suyo)
+_hilo = None
+_pid = None
+_hay_escaneos = threading.Event()
+
+ARCHIVO_CANDADO = 'aplicador.lock'
+ARCHIVO_RECHAZADOS = 'rechazados.jsonl'
+# Las líneas que no se pueden leer van primero (directo a rechazados)
+MOMENTO_INVALIDO = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+def ruta_diario(nombre):
+    return os.path.join(settings.ESCANEOS_DIARIO_DIR, nombre)
+
+
+def _abrir_archivo_activo():
+    global _archivo, _ruta_activa, _pid_archivo
+    _pid_archivo = os.getpid()
+    os.makedirs(settings.ESCANEOS_DIARIO_DIR, exist_ok=True)
+    _ruta_activa = ruta_diario(f"diario-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+    _archivo = open(_ruta_activa, 'a', encoding='utf-8')
+    # fsync del directorio para que el archivo nuevo sobreviva a un corte de luz
+    descriptor = os.open(settings.ESCANEOS_DIARIO_DIR, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def anotar_escaneo(codigo, accion, sucursal_id, momento):
+    """
+    Agrega el escaneo al diario y regresa cuando ya está en disco (fsync).
+    """
+    linea = json.dumps({
+        'codigo': str(codigo),
+        'accion': accion,
+        'sucursal_id': sucursal_id,
+        'momento': momento.isoformat(),
+    }) + '\n'
+    with _candado:
+        if _archivo is None or _pid_archivo != os.getpid():
+            _abrir_archivo_activo()
+        _archivo.write(linea)
+        _archivo.flush()
+        os.fsync(_archivo.fileno())
+    iniciar()
+    _hay_escaneos.set()
+
+
+def rotar():
+    """
+    Cierra el archivo activo (si tiene escaneos) y lo deja como pendiente de aplicar.
+    """
+    global _archivo, _ruta_activa
+    with _candado:
+        if _archivo is None or _pid_archivo != os.getpid() or _archivo.tell() == 0:
+            return
+        _archivo.close()
+        os.rename(_ruta_activa, _ruta_activa[:-len('.jsonl')] + '.pendiente')
+        _archivo, _ruta_activa = None, None
+
+
+def _pid_vivo(pid):
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _candado_aplicador():
+    """
+    Candado entre procesos (flock sobre un archivo del directorio): un solo proceso aplica el
+    diario a la vez. Entrega False si otro proceso lo tiene; el sistema lo suelta si el proceso muere.
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(settings.ESCANEOS_DIARIO_DIR, exist_ok=True)
+    with open(ruta_diario(ARCHIVO_CANDADO), 'a') as archivo:
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def leer_archivos():
+    """
+    Lee todos los archivos del diario, de todos los procesos. Un archivo está terminado si ya
+    nadie le escribe: rotado (.pendiente) o de un proceso que ya no existe. De los que siguen
+    activos solo cuentan las líneas completas; en uno terminado, una última línea incompleta
+    es un escaneo que el proceso no alcanzó a confirmar al kiosko y se descarta.
+    """
+    archivos = []
+    for ruta in glob.glob(ruta_diario('diario-*-*.*')):
+        _, pid, resto = os.path.basename(ruta).split('-', 2)
+        identificador, extension = resto.split('.', 1)
+        terminado = extension == 'pendiente' or (ruta != _ruta_activa and not _pid_vivo(int(pid)))
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                lineas = archivo.read().split('\n')
+        except FileNotFoundError:
+            continue  # Su proceso lo acaba de rotar: se lee en el siguiente ciclo
+        incompleta = lineas.pop()
+        if incompleta and terminado:
+            logger.warning("Línea incompleta al final del diario %s: %r", ruta, incompleta)
+        archivos.append({'ruta': ruta, 'identificador': identificador, 'terminado': terminado, 'lineas': lineas})
+
+    avances = dict(
+        AvanceDiario.objects.filter(archivo__in=[archivo['identificador'] for archivo in archivos])
+        .values_list('archivo', 'lineas_aplicadas')
+    )
+    for archivo in archivos:
+        archivo['avance'] = avances.get(archivo['identificador'], 0)
+    return archivos
+
+
+def _escaneos_de(archivo):
+    """
+    (momento, identificador, número de línea, escaneo o None si la línea no es válida) de las
+    líneas todavía sin aplicar del archivo, en el orden en que se escribieron.
+    """
+    for numero in range(archivo['avance'], len(archivo['lineas'])):
+        linea = archivo['lineas'][numero]
+        try:
+            escaneo = json.loads(linea)
+            momento = datetime.fromisoformat(escaneo['momento'])
+            uuid.UUID(escaneo['codigo'])
+        except (ValueError, TypeError, KeyError):
+            escaneo, momento = {'linea': linea}, MOMENTO_INVALIDO
+        yield momento, archivo['identificador'], numero, escaneo
+
+
+def aplicar_pendientes(margen):
+    """
+    Junta los escaneos pendientes de todos los archivos y los aplica en orden de hora, en lotes
+    de ESCANEOS_DIARIO_LOTE: así la salida que anotó un worker no se aplica antes que la entrada
+    que anotó otro. Los escaneos de los últimos `margen` segundos esperan al siguiente ciclo
+    (su entrada puede ir todavía camino al archivo de otro proceso). Devuelve cuántos se aplicaron.
+    """
+    archivos = leer_archivos()
+    avances = {archivo['identificador']: archivo['avance'] for archivo in archivos}
+    corte = timezone.now() - timedelta(seconds=margen)
+    # Cada archivo se consume en su orden, así el avance de cada uno sigue siendo un número de líneas
+    en_orden = heapq.merge(*(_escaneos_de(archivo) for archivo in archivos), key=itemgetter(0))
+
+    aplicados = 0
+    lote = []
+    for pendiente in en_orden:
+        if pendiente[0] > corte:
+            break
+        lote.append(pendiente)
+        if len(lote) == settings.ESCANEOS_DIARIO_LOTE:
+            aplicados += aplicar_lote(lote, avances)
+            lote = []
+    if lote:
+        aplicados += aplicar_lote(lote, avances)
+
+    for archivo in archivos:
+        if archivo['terminado'] and avances[archivo['identificador']] >= len(archivo['lineas']):
+            # Primero el archivo y después el avance: si morimos entre los dos, el avance huérfano no hace daño
+            os.remove(archivo['ruta'])
+            AvanceDiario.objects.filter(archivo=archivo['identificador']).delete()
+    return aplicados
+
+
+def aplicar_lote(lote, avances):
+    """
+    Aplica un lote en una transacción junto con el avance de cada archivo. Un escaneo que falla
+    (o que las reglas rechazan, cuando el kiosko ya lo había confirmado) va al archivo de
+    rechazados y el lote sigue. Si la BD no está disponible se deshace el lote completo y se
+    reintenta en el siguiente ciclo.
+    """
+    codigos = {escaneo['codigo'] for _, _, _, escaneo in lote if 'codigo' in escaneo}
+    rechazados = []
+    nuevos_avances = {}
+    with transaction.atomic():
+        empleados = Empleado.objects.select_related('sucursal').in_bulk(codigos, field_name='codigo_qr_unico')
+        for momento, identificador, numero, escaneo in lote:
+            nuevos_avances[identificador] = numero + 1
+            if 'codigo' not in escaneo:
+                rechazados.append(rechazo(identificador, numero, escaneo, "Línea inválida"))
+                continue
+            empleado = empleados.get(uuid.UUID(escaneo['codigo']))
+            if empleado is None:
+                rechazados.append(rechazo(identificador, numero, escaneo, "Empleado inexistente"))
+                continue
+            try:
+                with transaction.atomic():
+                    mensaje, es_error = aplicar_escaneo(
+                        empleado, escaneo['accion'], timezone.localtime(momento), empleado.sucursal.minutos_tolerancia_entrada
+                    )
+            except (OperationalError, InterfaceError):
+                raise  # BD caída o bloqueada: no es culpa del escaneo
+            except Exception as e:
+                logger.exception("Error aplicando un escaneo del diario")
+                mensaje, es_error = f"Error: {e}", True
+            if es_error:
+                rechazados.append(rechazo(identificador, numero, escaneo, mensaje))
+
+        for identificador, lineas_aplicadas in nuevos_avances.items():
+            AvanceDiario.objects.update_or_create(archivo=identificador, defaults={'lineas_aplicadas': lineas_aplicadas})
+
+    avances.update(nuevos_avances)
+    if rechazados:
+        guardar_rechazados(rechazados)
+    return len(lote)
+
+
+def rechazo(identificador, numero, escaneo, motivo):
+    logger.warning("Escaneo del diario rechazado (%s:%s): %s", identificador, numero + 1, motivo)
+    return {'archivo': identificador, 'linea': numero + 1, 'escaneo': escaneo, 'motivo': motivo,
+            'rechazado': timezone.now().isoformat()}
+
+
+def guardar_rechazados(rechazados):
+    """
+    Agrega los escaneos rechazados al archivo de rechazados (fsync), para revisarlos a mano.
+    """
+    with open(ruta_diario(ARCHIVO_RECHAZADOS), 'a', encoding='utf-8') as archivo:
+        for rechazado in rechazados:
+            archivo.write(json.dumps(rechazado, ensure_ascii=False) + '\n')
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+
+def vaciar(margen=None):
+    """
+    Rota el archivo activo y, si ningún otro proceso lo está haciendo, aplica lo pendiente de
+    todos los archivos del diario. `margen` (por defecto ESCANEOS_DIARIO_MARGEN_SEGUNDOS):
+    segundos más recientes que se dejan para el siguiente ciclo; 0 aplica todo.
+    """
+    if margen is None:
+        margen = settings.ESCANEOS_DIARIO_MARGEN_SEGUNDOS
+    with _candado_vaciado:
+        rotar()
+        with _candado_aplicador() as propio:
+            if not propio:
+                return 0
+            return aplicar_pendientes(margen)
+
+
+def _ciclo():
+    while True:
+        _hay_escaneos.wait(timeout=settings.ESCANEOS_DIARIO_INTERVALO)
+        _hay_escaneos.clear()
+        close_old_connections()
+        try:
+            vaciar()
+        except Exception:
+            # BD no disponible: se reintenta en el siguiente ciclo; los escaneos siguen a salvo en disco
+            logger.exception("Error aplicando el diario de escaneos")
+        finally:
+            close_old_connections()
+
+
+def iniciar():
+    """
+    Arranca el hilo aplicador del proceso (una vez por proceso, también después de un fork).
+    Al arrancar, lo primero que hace es reaplicar lo que haya quedado de ejecuciones anteriores.
+    """
+    global _hilo, _pid
+    if not settings.ESCANEOS_DIARIO:
+        return
+    with _candado:
+        if _hilo is not None and _pid == os.getpid() and _hilo.is_alive():
+            return
+        _pid = os.getpid()
+        _hilo = threading.Thread(target=_ciclo, name='diario-escaneos', daemon=True)
+        _hilo.start()
+    _hay_escaneos.set()
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import HorarioDia, RegistroAsistencia
+from .periodos import RegistroBloqueado
+
+# Reglas de entrada/salida de los escaneos del kiosko. Las usa la vista de registro y también
+# el diario de escaneos (diario.py) cuando aplica en lote lo que ya se confirmó al kiosko.
+# Las funciones con prefijo 'a' son las versiones async que usan las vistas del kiosko bajo ASGI.
+
+
+def obtener_hora_entrada_esperada(empleado, fecha_dt):
+    """
+    Devuelve la hora de entrada supuesta para un empleado en una fecha dada.
+    Considera si tiene horario variable o fijo.
+    Retorna None si es día libre o no hay horario definido.
+    """
+    if not empleado.usa_horario_variable:
+        return entrada_general(empleado, fecha_dt)
+    
+    # 0=Lunes, 6=Domingo
+    dia_semana = fecha_dt.weekday()
+    try:
+        horario_dia = empleado.horarios_dias.get(dia_semana=dia_semana)
+        if horario_dia.es_dia_libre:
+            return None
+        return horario_dia.hora_entrada
+    except HorarioDia.DoesNotExist:
+        # Si no existe configuración específica para ese día, usamos la general como fallback
+        return entrada_general(empleado, fecha_dt)
+
+
+def entrada_general(empleado, fecha_dt):
+    """
+    Hora de entrada del horario general, o None en sus días de descanso.
+    """
+    if fecha_dt.weekday() in settings.HORARIO_GENERAL_DIAS_DESCANSO:
+        return None
+    return empleado.hora_entrada_supuesta
+
+
+async def aobtener_hora_entrada_esperada(empleado, fecha_dt):
+    """
+    Versión async de obtener_hora_entrada_esperada.
+    """
+    if not empleado.usa_horario_variable:
+        return entrada_general(empleado, fecha_dt)
+    try:
+        horario_dia = await empleado.horarios_dias.aget(dia_semana=fecha_dt.weekday())
+    except HorarioDia.DoesNotExist:
+        return entrada_general(empleado, fecha_dt)
+    return None if horario_dia.es_dia_libre else horario_dia.hora_entrada
+
+
+def calcular_llego_tarde(hora_entrada_meta, momento, minutos_tolerancia):
+    """
+    True si `momento` pasa de la hora de entrada más la tolerancia (sin horario nunca es tarde).
+    """
+    if not hora_entrada_meta:
+        return False
+    hora_limite = (datetime.combine(momento.date(), hora_entrada_meta) + timedelta(minutes=minutos_tolerancia)).time()
+    return momento.time() > hora_limite
+
+
+def registrar_entrada(empleado, momento, llego_tarde):
+    """
+    Crea la entrada del día de `empleado`. Devuelve el registro, o None si ya tenía entrada ese día.
+    Lo decide la restricción (empleado, fecha_jornada), igual en SQLite y en PostgreSQL: el INSERT
+    va por save() (con sus señales) dentro de un savepoint, y si choca solo se deshace ese savepoint.
+    """
+    registro = RegistroAsistencia(empleado=empleado, sucursal_id=empleado.sucursal_id, fecha_hora_entrada=momento, llego_tarde=llego_tarde)
+    try:
+        with transaction.atomic():
+            registro.save()
+    except IntegrityError:
+        # Solo el choque con la entrada del mismo día significa "ya tenía entrada"
+        if not RegistroAsistencia.objects.filter(empleado=empleado, fecha_jornada=registro.fecha_jornada).exists():
+            raise
+        return None
+    return registro
+
+
+async def aregistrar_entrada(empleado, momento, llego_tarde):
+    """
+    registrar_entrada desde una vista async. El ORM async todavía no tiene transacciones,
+    así que el INSERT (con su savepoint) corre entero en el hilo de la petición.
+    """
+    return await sync_to_async(registrar_entrada)(empleado, momento, llego_tarde)
+
+
+def aplicar_escaneo(empleado, accion, momento, minutos_tolerancia):
+    """
+    Registra la entrada o la salida de `empleado` con la hora local `momento`.
+    Devuelve (mensaje, es_error).
+    """
+    if accion == 'entrada':
+        # --- Lógica de Horario Variable ---
+        hora_entrada_meta = obtener_hora_entrada_esperada(empleado, momento)
+        llego_tarde = calcular_llego_tarde(hora_entrada_meta, momento, minutos_tolerancia)
+
+        try:
+            registro = registrar_entrada(empleado, momento, llego_tarde)
+        except RegistroBloqueado as e:
+            return f"Error: {e}", True
+        return _resultado_entrada(empleado, momento, llego_tarde, registro)
+
+    if accion == 'salida':
+        ultimo_registro = RegistroAsistencia.objects.filter(empleado=empleado, fecha_hora_salida__isnull=True).order_by('-fecha_hora_entrada').first()
+        if ultimo_registro:
+            ultimo_registro.fecha_hora_salida = momento
+            try:
+                ultimo_registro.save()
+            except RegistroBloqueado as e:
+                return f"Error: {e}", True
+            return _resultado_salida(empleado, momento)
+        return _resultado_salida(empleado, momento, sin_entrada=True)
+
+    return "Error: Acción no válida.", True
+
+
+async def aaplicar_escaneo(empleado, accion, momento, minutos_tolerancia):
+    """
+    Versión async de aplicar_escaneo (mismas reglas y mensajes) para la vista del kiosko.
+    """
+    if accion == 'entrada':
+        hora_entrada_meta = await aobtener_hora_entrada_esperada(empleado, momento)
+        llego_tarde = calcular_llego_tarde(hora_entrada_meta, momento, minutos_tolerancia)
+        try:
+            registro = await aregistrar_entrada(empleado, momento, llego_tarde)
+        except RegistroBloqueado as e:
+            return f"Error: {e}", True
+        return _resultado_entrada(empleado, momento, llego_tarde, registro)
+
+    if accion == 'salida':
+        ultimo_registro = await RegistroAsistencia.objects.filter(empleado=empleado, fecha_hora_salida__isnull=True).order_by('-fecha_hora_entrada').afirst()
+        if ultimo_registro:
+            ultimo_registro.fecha_hora_salida = momento
+            try:
+                await ultimo_registro.asave()
+            except RegistroBloqueado as e:
+                return f"Error: {e}", True
+            return _resultado_salida(empleado, momento)
+        return _resultado_salida(empleado, momento, sin_entrada=True)
+
+    return "Error: Acción no válida.", True
+
+
+def _resultado_entrada(empleado, momento, llego_tarde, registro):
+    if registro is None:
+        return f"Error: {empleado.nombre} ya tiene una entrada registrada hoy.", True
+    mensaje = f"Entrada registrada para {empleado.nombre} a las {momento.strftime('%H:%M:%S')}."
+    if llego_tarde:
+        mensaje += " (Llegó tarde)"
+    return mensaje, False
+
+
+def _resultado_salida(empleado, momento, sin_entrada=False):
+    if sin_entrada:
+        return f"Error: No se encontró un registro de entrada abierto para {empleado.nombre}.", True
+    return f"Salida registrada para {empleado.nombre} a las {momento.strftime('%H:%M:%S')}.", False
@@ -0,0 +1,193 @@
+import io
+import re
+from django.conf import settings
+from django.utils import timezone
+from openpyxl import Workbook
+from .models import RegistroAsistencia
+from .filtros import filtrar_registros, empleados_para_resumen
+from .cache import obtener_o_calcular
+from .horarios import calcular_horas, formatear_duracion
+from .nomina import ENCABEZADOS_HOJA, procesar_particiones
+from .periodos import periodo_de_filtros
+
+ENCABEZADOS_ASISTENCIA = ["ID Registro", "Empleado", "Fecha Entrada", "Hora Entrada", "Fecha Salida", "Hora Salida", "Horas Trabajadas", "Llegó Tarde"]
+ENCABEZADOS_TOTALES = ["Empleado", "Días Trabajados", "Retardos", "Horas Programadas", "Horas Trabajadas", "Horas Extra", "Horas Faltantes"]
+ENCABEZADOS_HORAS = ["Empleado", "Días Trabajados", "Horas Programadas", "Horas Trabajadas", "Horas Extra", "Horas Faltantes", "Promedio (hrs/día)"]
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Modos de exportación: reporte plano de asistencia o libro de nómina por empleado
+MODO_ASISTENCIA = 'asistencia'
+MODO_NOMINA = 'nomina'
+
+
+def fila_asistencia(registro):
+    """
+    Convierte un RegistroAsistencia en la fila del reporte de Excel.
+    """
+    local_entrada = timezone.localtime(registro.fecha_hora_entrada)
+    fecha_salida, hora_salida, horas_trabajadas = '', '', ''
+
+    if registro.fecha_hora_salida:
+        local_salida = timezone.localtime(registro.fecha_hora_salida)
+        fecha_salida = local_salida.strftime('%d/%m/%Y')
+        hora_salida = local_salida.strftime('%H:%M:%S')
+
+        duracion = registro.fecha_hora_salida - registro.fecha_hora_entrada
+        segundos = duracion.total_seconds()
+        h = int(segundos // 3600)
+        m = int((segundos % 3600) // 60)
+        horas_trabajadas = f"{h}h {m}m"
+
+    return [
+        registro.id, str(registro.empleado),
+        local_entrada.strftime('%d/%m/%Y'), local_entrada.strftime('%H:%M:%S'),
+        fecha_salida, hora_salida,
+        horas_trabajadas,
+        "Sí" if registro.llego_tarde else "No"
+    ]
+
+
+def construir_excel_asistencia(registros, empleados, filtros, progreso=None):
+    """
+    Genera el libro de Excel del reporte (registros + resumen de horas) y devuelve sus bytes.
+    Si se pasa `progreso`, se llama con el porcentaje de avance (0-100) cada vez que cambia.
+    """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Reporte de Asistencia"
+    ws.append(ENCABEZADOS_ASISTENCIA)
+
+    total = registros.count() if progreso else 0
+    ultimo_porcentaje = 0
+    for numero, registro in enumerate(registros.iterator(chunk_size=2000), start=1):
+        ws.append(fila_asistencia(registro))
+        if progreso and total:
+            # Las filas son el 90% del trabajo; el resumen y el guardado, el resto.
+            # Se avisa en pasos de 5% para no escribir el progreso en cada fila.
+            porcentaje = numero * 90 // total // 5 * 5
+            if porcentaje != ultimo_porcentaje:
+                ultimo_porcentaje = porcentaje
+                progreso(porcentaje)
+
+    # Segunda hoja: horas programadas vs. reales por empleado
+    ws_horas = wb.create_sheet("Resumen de Horas")
+    ws_horas.append(ENCABEZADOS_HORAS)
+    for item in calcular_horas(empleados, registros, filtros['fecha_inicio'], filtros['fecha_fin']):
+        ws_horas.append([
+            item['nombre'], item['dias'],
+            item['horas_programadas_str'], item['horas_str'],
+            item['extra_str'], item['faltante_str'],
+            item['promedio'],
+        ])
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def titulo_hoja(nombre, usados):
+    """
+    Título válido y único para una hoja de Excel (máx. 31 caracteres, sin []:*?/\\).
+    """
+    limpio = re.sub(r'[\[\]:*?/\\]', '', nombre).strip()[:31] or 'Empleado'
+    titulo, numero = limpio, 2
+    while titulo.lower() in usados:
+        sufijo = f" ({numero})"
+        titulo = limpio[:31 - len(sufijo)] + sufijo
+        numero += 1
+    usados.add(titulo.lower())
+    return titulo
+
+
+def construir_excel_nomina(registros, empleados, filtros, progreso=None):
+    """
+    Libro de nómina: una hoja de totales más una hoja por empleado.
+
+    Los registros del periodo se leen en una sola consulta y se parten por empleado;
+    cada partición se convierte en filas (en el pool de procesos si el periodo es muy grande,
+    ver nomina.py) y al final todo se escribe en un Workbook de solo escritura.
+    """
+    zona = timezone.get_current_timezone_name()
+    particiones = {}
+    consulta = registros.order_by('empleado__nombre', 'empleado__apellido', 'empleado_id', 'fecha_hora_entrada').values_list(
+        'empleado_id', 'empleado__nombre', 'empleado__apellido',
+        'id', 'fecha_hora_entrada', 'fecha_hora_salida', 'llego_tarde',
+    )
+    for empleado_id, nombre, apellido, registro_id, entrada, salida, llego_tarde in consulta.iterator(chunk_size=2000):
+        if empleado_id not in particiones:
+            particiones[empleado_id] = (empleado_id, f"{nombre} {apellido}", zona, [])
+        particiones[empleado_id][3].append((registro_id, entrada, salida, llego_tarde))
+
+    total_hojas = len(particiones) or 1
+    avance = (lambda hechas: progreso(10 + hechas * 80 // total_hojas)) if progreso else None
+    hojas = procesar_particiones(
+        list(particiones.values()),
+        settings.NOMINA_PROCESOS,
+        settings.NOMINA_MIN_REGISTROS_PARALELO,
+        progreso=avance,
+    )
+    hojas_por_empleado = {hoja['empleado_id']: hoja for hoja in hojas}
+    horas = calcular_horas(empleados, registros, filtros['fecha_inicio'], filtros['fecha_fin'])
+
+    wb = Workbook(write_only=True)
+    ws_totales = wb.create_sheet("Totales")
+    ws_totales.append(ENCABEZADOS_TOTALES)
+    suma = {'dias': 0, 'tardes': 0, 'programados': 0, 'reales': 0, 'extra': 0, 'faltantes': 0}
+    for item in horas:
+        hoja = hojas_por_empleado.get(item['empleado_id'])
+        tardes = hoja['tardes'] if hoja else 0
+        ws_totales.append([
+            item['nombre'], item['dias'], tardes,
+            item['horas_programadas_str'], item['horas_str'],
+            item['extra_str'], item['faltante_str'],
+        ])
+        suma['dias'] += item['dias']
+        suma['tardes'] += tardes
+        suma['programados'] += item['segundos_programados']
+        suma['reales'] += item['segundos_reales']
+        suma['extra'] += item['segundos_extra']
+        suma['faltantes'] += item['segundos_faltantes']
+    ws_totales.append([])
+    ws_totales.append([
+        "TOTAL", suma['dias'], suma['tardes'],
+        formatear_duracion(suma['programados']), formatear_duracion(suma['reales']),
+        formatear_duracion(suma['extra']), formatear_duracion(suma['faltantes']),
+    ])
+
+    usados = {'totales'}
+    for hoja in hojas:
+        ws = wb.create_sheet(titulo_hoja(hoja['nombre'], usados))
+        ws.append(ENCABEZADOS_HOJA)
+        for fila in hoja['filas']:
+            ws.append(fila)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def obtener_excel(filtros, modo=MODO_ASISTENCIA, progreso=None):
+    """
+    Devuelve los bytes del Excel para los filtros y el modo dados: el generado al cerrar
+    el periodo si el rango es un periodo cerrado, o desde la cache de reportes si los datos
+    no han cambiado.
+    """
+    if not filtros['empleado_id']:
+        campo = 'excel_nomina' if modo == MODO_NOMINA else 'excel_asistencia'
+        periodo = periodo_de_filtros(filtros, campo)
+        if periodo:
+            return bytes(getattr(periodo, campo))
+
+    def generar():
+        registros = RegistroAsistencia.objects.select_related('empleado').order_by('-fecha_hora_entrada')
+        registros = filtrar_registros(registros, filtros)
+        construir = construir_excel_nomina if modo == MODO_NOMINA else construir_excel_asistencia
+        return construir(registros, empleados_para_resumen(registros, filtros), filtros, progreso=progreso)
+
+    return obtener_o_calcular(
+        'excel',
+        (modo, filtros['empleado_id'], filtros['fecha_inicio'], filtros['fecha_fin']),
+        generar,
+        sucursal_id=filtros['sucursal_id'],
+    )
@@ -0,0 +1,60 @@
+from datetime import datetime
+from django.db.models import Q
+from .models import Empleado
+
+
+def obtener_filtros_reporte(request):
+    """
+    Lee los filtros de reportes del GET (empleado y rango de fechas) y los normaliza.
+    Los valores inválidos se ignoran, igual que antes. La sucursal sale de la sesión.
+    """
+    filtros = {'sucursal_id': request.sucursal.id, 'empleado_id': None, 'fecha_inicio': None, 'fecha_fin': None}
+
+    empleado_id = request.GET.get('empleado_id')
+    if empleado_id and empleado_id.isdigit():
+        filtros['empleado_id'] = int(empleado_id)
+
+    for campo in ('fecha_inicio', 'fecha_fin'):
+        valor = request.GET.get(campo)
+        if valor:
+            try:
+                filtros[campo] = datetime.strptime(valor, '%Y-%m-%d').date()
+            except ValueError:
+                pass
+    return filtros
+
+
+def filtrar_registros(registros, filtros):
+    """
+    Aplica los filtros normalizados a un queryset de RegistroAsistencia.
+    La sucursal va primero: los índices de registros empiezan por ella.
+    """
+    registros = registros.filter(sucursal_id=filtros['sucursal_id'])
+    if filtros['empleado_id']:
+        registros = registros.filter(empleado_id=filtros['empleado_id'])
+    if filtros['fecha_inicio']:
+        registros = registros.filter(fecha_hora_entrada__date__gte=filtros['fecha_inicio'])
+    if filtros['fecha_fin']:
+        registros = registros.filter(fecha_hora_entrada__date__lte=filtros['fecha_fin'])
+    return registros
+
+
+def empleados_para_resumen(registros, filtros):
+    """
+    Empleados que entran al resumen de horas: el filtrado (si es de la sucursal), o todos
+    los activos de la sucursal más los que tengan registros en el periodo (inactivos o
+    cambiados de sucursal).
+    """
+    if filtros['empleado_id']:
+        return empleado_filtrado(filtros)
+    return Empleado.objects.filter(
+        Q(sucursal_id=filtros['sucursal_id'], is_active=True)
+        | Q(id__in=registros.order_by().values('empleado_id'))
+    )
+
+
+def empleado_filtrado(filtros):
+    """
+    Queryset con el empleado del filtro, solo si pertenece a la sucursal (si no, vacío).
+    """
+    return Empleado.objects.filter(sucursal_id=filtros['sucursal_id'], id=filtros['empleado_id'])
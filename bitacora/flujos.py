@@ -0,0 +1,69 @@
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse
+
+# Respuestas en streaming cuando el servidor corre con ASGI (gunicorn + uvicorn).
+# Con ASGI, Django solo puede enviar un iterador asíncrono: si recibe uno síncrono lo lee
+# completo en memoria (sync_to_async(list)) antes de mandar el primer byte y avisa
+# "StreamingHttpResponse must consume synchronous iterators in order to serve them
+# asynchronously". Aquí el iterador síncrono (consultas con .iterator(), lecturas de un
+# archivo) se consume por lotes en el hilo de sync_to_async, así que en memoria solo hay un
+# lote a la vez. Con WSGI (runserver, el cliente de pruebas) se devuelve el iterador tal cual.
+
+LOTE = 500
+TAMANO_BLOQUE_ARCHIVO = 64 * 1024
+
+
+def es_asgi(request):
+    return isinstance(request, ASGIRequest)
+
+
+def _siguiente_lote(iterador, tamano):
+    return list(islice(iterador, tamano))
+
+
+async def iterar_async(iterable, tamano=LOTE):
+    """
+    Iterador asíncrono sobre un iterable síncrono, leído de `tamano` en `tamano` elementos.
+    Todo corre en el mismo hilo (thread_sensitive), que es el dueño de la conexión y del
+    cursor del servidor que abre .iterator().
+    """
+    iterador = iter(iterable)
+    siguiente_lote = sync_to_async(_siguiente_lote)
+    try:
+        while lote := await siguiente_lote(iterador, tamano):
+            for elemento in lote:
+                yield elemento
+    finally:
+        # Si el cliente se desconecta a medio camino, se cierra el generador (y su cursor) en ese hilo
+        cerrar = getattr(iterador, 'close', None)
+        if cerrar is not None:
+            await sync_to_async(cerrar)()
+
+
+async def leer_archivo_async(archivo, tamano=TAMANO_BLOQUE_ARCHIVO):
+    """
+    Lee el archivo por bloques sin bloquear el event loop. Quien lo abrió lo cierra.
+    """
+    leer = sync_to_async(archivo.read, thread_sensitive=False)
+    while bloque := await leer(tamano):
+        yield bloque
+
+
+def contenido_streaming(request, iterable):
+    """
+    El contenido para un StreamingHttpResponse: asíncrono con ASGI, síncrono con WSGI.
+    """
+    return iterar_async(iterable) if es_asgi(request) else iterable
+
+
+def respuesta_archivo(request, archivo, **kwargs):
+    """
+    FileResponse que con ASGI lee el archivo por bloques de forma asíncrona.
+    Las cabeceras (Content-Length, Content-Disposition) y el cierre del archivo quedan igual.
+    """
+    response = FileResponse(archivo, **kwargs)
+    if es_asgi(request):
+        response.streaming_content = leer_archivo_async(archivo)
+    return response
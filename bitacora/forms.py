@@ -1,5 +1,5 @@
 from django import forms
-from .models import Empleado, Configuracion, HorarioDia
+from .models import Empleado, Sucursal, HorarioDia
 from django.contrib.auth.models import User
 
 class EmpleadoForm(forms.ModelForm):
@@ -74,7 +74,13 @@ class EmpleadoForm(forms.ModelForm):
         return empleado
 
 class ConfiguracionForm(forms.ModelForm):
-    # Formulario para la configuración general y AÑADIR nuevos administradores
+    # Formulario para la configuración de la sucursal actual, AÑADIR sucursales y nuevos administradores
+    nueva_sucursal = forms.CharField(
+        label="Nueva sucursal",
+        max_length=100,
+        required=False,
+        help_text="Deja en blanco si no quieres añadir una sucursal."
+    )
     nuevo_admin_usuario = forms.CharField(
         label="Nuevo administrador (usuario)",
         max_length=100, 
@@ -88,8 +94,8 @@ class ConfiguracionForm(forms.ModelForm):
     )
 
     class Meta:
-        model = Configuracion
-        fields = ['minutos_tolerancia_entrada']
+        model = Sucursal
+        fields = ['nombre', 'minutos_tolerancia_entrada']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -110,8 +116,18 @@ class ConfiguracionForm(forms.ModelForm):
         if usuario and User.objects.filter(username=usuario).exists():
             self.add_error('nuevo_admin_usuario', "Este nombre de usuario ya existe.")
 
+        nueva_sucursal = cleaned_data.get("nueva_sucursal")
+        if nueva_sucursal and Sucursal.objects.filter(nombre__iexact=nueva_sucursal).exists():
+            self.add_error('nueva_sucursal', "Ya existe una sucursal con este nombre.")
+
         return cleaned_data
 
+class CerrarPeriodoForm(forms.Form):
+    # Rango del periodo de pago a cerrar (lo manda el botón del reporte)
+    fecha_inicio = forms.DateField(input_formats=['%Y-%m-%d'], error_messages={'required': "Indica la fecha inicial del periodo."})
+    fecha_fin = forms.DateField(input_formats=['%Y-%m-%d'], error_messages={'required': "Indica la fecha final del periodo."})
+
+
 class AdminUpdateForm(forms.ModelForm):
     # Formulario para EDITAR administradores existentes
     password = forms.CharField(
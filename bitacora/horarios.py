@@ -0,0 +1,178 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from .models import RegistroAsistencia
+
+SEGUNDOS_DIA = 24 * 3600
+
+
+def formatear_duracion(segundos):
+    """
+    Convierte segundos a texto tipo '8h 30m'.
+    """
+    segundos = int(segundos)
+    return f"{segundos // 3600}h {(segundos % 3600) // 60}m"
+
+
+def _segundos_turno(hora_entrada, hora_salida):
+    """
+    Duración de un turno programado. Si la salida es menor o igual que la entrada
+    se toma como un turno que cruza la medianoche.
+    """
+    if hora_entrada is None or hora_salida is None:
+        return 0
+    inicio = hora_entrada.hour * 3600 + hora_entrada.minute * 60 + hora_entrada.second
+    fin = hora_salida.hour * 3600 + hora_salida.minute * 60 + hora_salida.second
+    if fin <= inicio:
+        fin += SEGUNDOS_DIA
+    return fin - inicio
+
+
+def turno_programado(empleado, fecha):
+    """
+    Devuelve (hora_entrada, hora_salida) programadas para una fecha, o None si es día libre.
+    Los días sin horario específico usan el general, que descansa los HORARIO_GENERAL_DIAS_DESCANSO.
+    Usa `empleado.horarios_dias` (conviene precargarlo con prefetch_related).
+    """
+    if empleado.usa_horario_variable:
+        for horario in empleado.horarios_dias.all():
+            if horario.dia_semana == fecha.weekday():
+                if horario.es_dia_libre:
+                    return None
+                return horario.hora_entrada, horario.hora_salida
+    if fecha.weekday() in settings.HORARIO_GENERAL_DIAS_DESCANSO:
+        return None
+    return empleado.hora_entrada_supuesta, empleado.hora_salida_supuesta
+
+
+def semana_programada(empleado):
+    """
+    Segundos programados para cada día de la semana (0=Lunes ... 6=Domingo).
+    Usa los horarios precargados en `empleado.horarios_dias`, con el horario general
+    como respaldo, igual que obtener_hora_entrada_esperada.
+    """
+    general = _segundos_turno(empleado.hora_entrada_supuesta, empleado.hora_salida_supuesta)
+    semana = [general] * 7
+    for dia in settings.HORARIO_GENERAL_DIAS_DESCANSO:
+        semana[dia] = 0
+    if empleado.usa_horario_variable:
+        for horario in empleado.horarios_dias.all():
+            semana[horario.dia_semana] = 0 if horario.es_dia_libre else _segundos_turno(horario.hora_entrada, horario.hora_salida)
+    return semana
+
+
+def rango_de_registros(registros, fecha_inicio, fecha_fin):
+    """
+    Completa el rango de fechas con la primera/última entrada de los registros filtrados
+    cuando el usuario no lo especificó. Nunca se extiende más allá de hoy.
+    """
+    if fecha_inicio is None or fecha_fin is None:
+        limites = registros.aggregate(primera=Min('fecha_hora_entrada'), ultima=Max('fecha_hora_entrada'))
+        if fecha_inicio is None and limites['primera']:
+            fecha_inicio = timezone.localtime(limites['primera']).date()
+        if fecha_fin is None and limites['ultima']:
+            fecha_fin = timezone.localtime(limites['ultima']).date()
+    hoy = timezone.localdate()
+    if fecha_fin is None or fecha_fin > hoy:
+        fecha_fin = hoy
+    return fecha_inicio, fecha_fin
+
+
+def calcular_horas(empleados, registros, fecha_inicio, fecha_fin):
+    """
+    Motor por lotes de horas programadas vs. reales.
+
+    Carga empleados con sus horarios y los registros del rango en un número fijo de
+    consultas, arma la rejilla (empleado x día) de segundos programados y la compara
+    contra las horas reales de cada día para obtener horas extra y faltantes.
+    Solo se suman como reales los registros con entrada y salida. A cada empleado se le
+    programan horas desde su primera entrada (no desde el inicio del rango), para no cobrarle
+    los días antes de que empezara a trabajar. El día de hoy solo
+    cuenta para el empleado que ya cerró su turno: mientras no haya registrado la salida
+    (o todavía no llegue) su jornada no está terminada y no se toma como faltante.
+    """
+    fecha_inicio, fecha_fin = rango_de_registros(registros, fecha_inicio, fecha_fin)
+    if fecha_inicio is None or fecha_fin < fecha_inicio:
+        return []
+
+    empleados = list(
+        empleados.prefetch_related('horarios_dias').order_by('nombre', 'apellido')
+    )
+    indice = {empleado.id: fila for fila, empleado in enumerate(empleados)}
+    num_dias = (fecha_fin - fecha_inicio).days + 1
+    dias_semana = [(fecha_inicio + timedelta(days=d)).weekday() for d in range(num_dias)]
+
+    # Primera entrada de cada empleado (en cualquier fecha): antes de ella no se le programan horas
+    primeras = dict(
+        RegistroAsistencia.objects.filter(empleado_id__in=indice.keys())
+        .values('empleado_id').annotate(primera=Min('fecha_hora_entrada'))
+        .values_list('empleado_id', 'primera').order_by()
+    )
+
+    # Rejilla de segundos programados: una fila por empleado, una columna por día
+    programado = []
+    for empleado in empleados:
+        semana = semana_programada(empleado)
+        fila = [semana[dia] for dia in dias_semana]
+        primera = primeras.get(empleado.id)
+        antes = (timezone.localtime(primera).date() - fecha_inicio).days if primera else num_dias
+        antes = min(max(antes, 0), num_dias)
+        fila[:antes] = [0] * antes
+        programado.append(fila)
+
+    # Rejilla de segundos reales, llenada con una sola consulta de registros
+    real = [[0] * num_dias for _ in empleados]
+    dias_trabajados = [set() for _ in empleados]
+    for empleado_id, entrada, salida in registros.filter(
+        fecha_hora_salida__isnull=False,
+        empleado_id__in=indice.keys(),
+    ).values_list('empleado_id', 'fecha_hora_entrada', 'fecha_hora_salida').order_by().iterator(chunk_size=2000):
+        columna = (timezone.localtime(entrada).date() - fecha_inicio).days
+        if 0 <= columna < num_dias:
+            fila = indice[empleado_id]
+            real[fila][columna] += (salida - entrada).total_seconds()
+            dias_trabajados[fila].add(columna)
+
+    hoy = (timezone.localdate() - fecha_inicio).days
+    if 0 <= hoy < num_dias:
+        abiertos_hoy = set(registros.filter(
+            fecha_hora_salida__isnull=True,
+            fecha_hora_entrada__date=timezone.localdate(),
+            empleado_id__in=indice.keys(),
+        ).values_list('empleado_id', flat=True).order_by())
+        for fila, empleado in enumerate(empleados):
+            if hoy not in dias_trabajados[fila] or empleado.id in abiertos_hoy:
+                programado[fila][hoy] = 0
+                real[fila][hoy] = 0
+                dias_trabajados[fila].discard(hoy)
+
+    resultados = []
+    for fila, empleado in enumerate(empleados):
+        seg_programados = seg_reales = seg_extra = seg_faltantes = 0
+        for prog, trabajado in zip(programado[fila], real[fila]):
+            seg_programados += prog
+            seg_reales += trabajado
+            if trabajado > prog:
+                seg_extra += trabajado - prog
+            else:
+                seg_faltantes += prog - trabajado
+
+        dias = len(dias_trabajados[fila])
+        if not dias and not seg_programados:
+            continue
+        resultados.append({
+            'empleado_id': empleado.id,
+            'nombre': f"{empleado.nombre} {empleado.apellido}",
+            'dias': dias,
+            'segundos_programados': int(seg_programados),
+            'segundos_reales': int(seg_reales),
+            'segundos_extra': int(seg_extra),
+            'segundos_faltantes': int(seg_faltantes),
+            'horas_programadas_str': formatear_duracion(seg_programados),
+            'horas_str': formatear_duracion(seg_reales),
+            'extra_str': formatear_duracion(seg_extra),
+            'faltante_str': formatear_duracion(seg_faltantes),
+            'promedio': round(seg_reales / 3600 / dias, 1) if dias else 0,
+        })
+    return resultados
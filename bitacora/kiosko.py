@@ -0,0 +1,181 @@
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core import signing
+from django.db import transaction
+from django.utils import timezone
+from .antirrebote import cache_escaneos
+from .models import DispositivoKiosko, Sucursal
+from .sucursales import asignar_sucursal
+
+# Tokens de dispositivo para los kioskos de escaneo.
+# Un token es un valor firmado con HMAC (django.core.signing, con SECRET_KEY) con el id del
+# DispositivoKiosko y la sucursal a la que pertenece. Solo abre las vistas de escaneo
+# (decorador acceso_kiosko); el panel sigue pidiendo login.
+# Cada dispositivo se revoca por separado (DispositivoKiosko.revocado). Para no leer la BD en
+# cada escaneo, si está activo se guarda unos minutos en la cache de escaneos; al revocarlo se
+# sobrescribe esa entrada, así que con la cache compartida (REDIS_URL) el token deja de servir
+# de inmediato en todos los workers. Cambiar KIOSKO_TOKEN_SALT (o SECRET_KEY) invalida todos.
+
+COOKIE_KIOSKO = 'kiosko'
+SEGUNDOS_CACHE_SUCURSAL = 5 * 60
+SEGUNDOS_CACHE_DISPOSITIVO = 5 * 60
+
+
+def emitir_token(dispositivo):
+    """
+    Genera el token de un DispositivoKiosko.
+    """
+    return signing.dumps(
+        {'s': dispositivo.sucursal_id, 'd': dispositivo.nombre, 'k': str(dispositivo.id)},
+        salt=settings.KIOSKO_TOKEN_SALT, compress=True,
+    )
+
+
+def leer_token(token):
+    """
+    Devuelve {'sucursal_id', 'dispositivo', 'dispositivo_id'} si la firma es válida y no ha
+    expirado; si no, None. No revisa si el dispositivo fue revocado (ver dispositivo_activo).
+    """
+    try:
+        datos = signing.loads(token, salt=settings.KIOSKO_TOKEN_SALT, max_age=settings.KIOSKO_TOKEN_DIAS * 24 * 60 * 60)
+    except signing.BadSignature:
+        return None
+    if 'k' not in datos:
+        # Token de antes de los dispositivos revocables: hay que volver a activar el kiosko
+        return None
+    return {'sucursal_id': datos['s'], 'dispositivo': datos['d'], 'dispositivo_id': datos['k']}
+
+
+def clave_dispositivo(dispositivo_id):
+    return f"bitacora:kiosko:dispositivo:{dispositivo_id}"
+
+
+def _consultar_dispositivo(dispositivo_id):
+    return DispositivoKiosko.objects.filter(id=dispositivo_id, revocado__isnull=True).exists()
+
+
+def dispositivo_activo(dispositivo_id):
+    return cache_escaneos.get_or_set(
+        clave_dispositivo(dispositivo_id),
+        lambda: _consultar_dispositivo(dispositivo_id),
+        timeout=SEGUNDOS_CACHE_DISPOSITIVO,
+    )
+
+
+async def adispositivo_activo(dispositivo_id):
+    """
+    Versión async de dispositivo_activo.
+    """
+    activo = await cache_escaneos.aget(clave_dispositivo(dispositivo_id))
+    if activo is None:
+        activo = await DispositivoKiosko.objects.filter(id=dispositivo_id, revocado__isnull=True).aexists()
+        await cache_escaneos.aset(clave_dispositivo(dispositivo_id), activo, timeout=SEGUNDOS_CACHE_DISPOSITIVO)
+    return activo
+
+
+def revocar_dispositivo(dispositivo):
+    """
+    Revoca el token del dispositivo. Los demás dispositivos de la sucursal siguen funcionando.
+    """
+    dispositivo.revocado = timezone.now()
+    dispositivo.save(update_fields=['revocado'])
+    transaction.on_commit(lambda: cache_escaneos.set(
+        clave_dispositivo(dispositivo.id), False, timeout=SEGUNDOS_CACHE_DISPOSITIVO,
+    ))
+
+
+def token_de_peticion(request):
+    """
+    El token viaja en la cabecera 'Authorization: Bearer <token>' o en la cookie del kiosko.
+    """
+    autorizacion = request.META.get('HTTP_AUTHORIZATION', '')
+    if autorizacion.startswith('Bearer '):
+        return autorizacion[len('Bearer '):].strip()
+    return request.COOKIES.get(COOKIE_KIOSKO)
+
+
+def clave_sucursal(sucursal_id):
+    return f"bitacora:kiosko:sucursal:{sucursal_id}"
+
+
+def sucursal_kiosko(sucursal_id):
+    """
+    Sucursal del dispositivo. Se guarda unos minutos en la cache de escaneos para que cada
+    escaneo no tenga que leerla de la BD (un cambio de tolerancia tarda ese tiempo en llegar al kiosko).
+    """
+    return cache_escaneos.get_or_set(
+        clave_sucursal(sucursal_id),
+        lambda: Sucursal.objects.get(id=sucursal_id),
+        timeout=SEGUNDOS_CACHE_SUCURSAL,
+    )
+
+
+async def asucursal_kiosko(sucursal_id):
+    """
+    Versión async de sucursal_kiosko.
+    """
+    sucursal = await cache_escaneos.aget(clave_sucursal(sucursal_id))
+    if sucursal is None:
+        sucursal = await Sucursal.objects.aget(id=sucursal_id)
+        await cache_escaneos.aset(clave_sucursal(sucursal_id), sucursal, timeout=SEGUNDOS_CACHE_SUCURSAL)
+    return sucursal
+
+
+def preparar_kiosko(request, datos):
+    """
+    Deja la petición como kiosko: request.kiosko y la sucursal del dispositivo.
+    """
+    request.kiosko = datos
+    asignar_sucursal(
+        request,
+        lambda: sucursal_kiosko(datos['sucursal_id']),
+        lambda: asucursal_kiosko(datos['sucursal_id']),
+    )
+
+
+def datos_kiosko(request):
+    """
+    Si la petición trae el token de un dispositivo activo, la prepara como kiosko y devuelve
+    sus datos; si no, None.
+    """
+    token = token_de_peticion(request)
+    datos = leer_token(token) if token else None
+    if datos is None or not dispositivo_activo(datos['dispositivo_id']):
+        return None
+    preparar_kiosko(request, datos)
+    return datos
+
+
+async def adatos_kiosko(request):
+    """
+    Versión async de datos_kiosko.
+    """
+    token = token_de_peticion(request)
+    datos = leer_token(token) if token else None
+    if datos is None or not await adispositivo_activo(datos['dispositivo_id']):
+        return None
+    preparar_kiosko(request, datos)
+    return datos
+
+
+def acceso_kiosko(vista):
+    """
+    Permite la vista a un dispositivo con token de kiosko válido (sin sesión) o, si no hay token,
+    a un usuario con sesión iniciada, igual que @login_required. Sirve para vistas sync y async.
+    """
+    vista_con_login = login_required(vista)
+
+    if iscoroutinefunction(vista):
+        async def envoltura(request, *args, **kwargs):
+            if await adatos_kiosko(request) is None:
+                return await vista_con_login(request, *args, **kwargs)
+            return await vista(request, *args, **kwargs)
+    else:
+        def envoltura(request, *args, **kwargs):
+            if datos_kiosko(request) is None:
+                return vista_con_login(request, *args, **kwargs)
+            return vista(request, *args, **kwargs)
+
+    return wraps(vista)(envoltura)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from bitacora import diario
+
+
+class Command(BaseCommand):
+    help = (
+        "Aplica a la base de datos los escaneos que quedaron en el diario de escaneos "
+        "(por ejemplo tras un apagado). Se ejecuta al arrancar el contenedor."
+    )
+
+    def handle(self, *args, **options):
+        # Al arrancar nadie más está escribiendo: se aplica todo, sin margen
+        aplicados = diario.vaciar(margen=0)
+        self.stdout.write(self.style.SUCCESS(f"Escaneos del diario aplicados: {aplicados}."))
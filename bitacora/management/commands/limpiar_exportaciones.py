@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from bitacora.trabajos import limpiar_exportaciones_vencidas
+
+
+class Command(BaseCommand):
+    help = "Elimina los archivos y trabajos de exportación que ya expiraron."
+
+    def handle(self, *args, **options):
+        eliminados = limpiar_exportaciones_vencidas()
+        self.stdout.write(self.style.SUCCESS(f"Exportaciones vencidas eliminadas: {eliminados}."))
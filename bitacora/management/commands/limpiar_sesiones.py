@@ -0,0 +1,29 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra de la tabla de sesiones las que ya expiraron, por lotes para no bloquear "
+        "la base de datos mucho tiempo. Pensado para ejecutarse a diario desde cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help="Sesiones a borrar por transacción (por defecto: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        ahora = timezone.now()
+        eliminadas = 0
+        while True:
+            claves = list(
+                Session.objects.filter(expire_date__lt=ahora).values_list('session_key', flat=True)[:options['lote']]
+            )
+            if not claves:
+                break
+            eliminadas += Session.objects.filter(session_key__in=claves).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Sesiones vencidas eliminadas: {eliminadas}."))
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from bitacora.models import Empleado, RegistroAsistencia, Ausencia
+from bitacora.horarios import turno_programado
+from bitacora.cache import invalidar_cache_asistencia
+from bitacora.periodos import filtro_registros_cerrados
+
+
+class Command(BaseCommand):
+    help = (
+        "Proceso nocturno de asistencia: cierra (o señala) los turnos que quedaron abiertos "
+        "y registra las ausencias de los días laborables sin entrada. "
+        "Pensado para ejecutarse una vez por noche desde cron o el programador de tareas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fecha',
+            help="Día a revisar para ausencias en formato AAAA-MM-DD (por defecto: ayer).",
+        )
+        parser.add_argument(
+            '--horas-maximas', type=int, default=16,
+            help="Horas que puede estar abierto un turno antes de considerarse olvidado (por defecto: 16).",
+        )
+        parser.add_argument(
+            '--solo-marcar', action='store_true',
+            help="No cierra los turnos olvidados, solo los marca para revisión.",
+        )
+
+    def handle(self, *args, **options):
+        ahora = timezone.localtime(timezone.now())
+        if options['fecha']:
+            try:
+                fecha = datetime.strptime(options['fecha'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("La fecha debe tener el formato AAAA-MM-DD.")
+        else:
+            fecha = ahora.date() - timedelta(days=1)
+
+        with transaction.atomic():
+            cerrados = self.cerrar_turnos_abiertos(ahora, options['horas_maximas'], options['solo_marcar'])
+            ausencias = self.registrar_ausencias(fecha)
+
+        if cerrados or ausencias:
+            invalidar_cache_asistencia()
+
+        accion = "marcados" if options['solo_marcar'] else "cerrados"
+        self.stdout.write(self.style.SUCCESS(
+            f"Turnos olvidados {accion}: {cerrados}. Ausencias registradas para {fecha}: {ausencias}."
+        ))
+
+    def cerrar_turnos_abiertos(self, ahora, horas_maximas, solo_marcar):
+        """
+        Busca los turnos sin salida con más de `horas_maximas` horas (usa el índice parcial
+        de turnos abiertos) y los cierra a su hora de salida programada con UPDATEs masivos por lotes.
+        Los turnos que caen en un periodo cerrado no se tocan: update() y bulk_update() no
+        pasan por la señal que protege esos registros.
+        """
+        limite = ahora - timedelta(hours=horas_maximas)
+        abiertos = RegistroAsistencia.objects.filter(
+            fecha_hora_salida__isnull=True,
+            fecha_hora_entrada__lt=limite,
+        )
+        bloqueados = filtro_registros_cerrados()
+        if bloqueados is not None:
+            abiertos = abiertos.exclude(bloqueados)
+
+        if solo_marcar:
+            # update() no toca auto_now: actualizamos 'modificado' a mano para las exportaciones incrementales
+            return abiertos.filter(requiere_revision=False).update(requiere_revision=True, modificado=timezone.now())
+
+        registros = list(abiertos.select_related('empleado').prefetch_related('empleado__horarios_dias'))
+        for registro in registros:
+            entrada = timezone.localtime(registro.fecha_hora_entrada)
+            turno = turno_programado(registro.empleado, entrada.date())
+            salida = entrada
+            if turno and turno[1]:
+                salida = datetime.combine(entrada.date(), turno[1], tzinfo=entrada.tzinfo)
+                if turno[0] and turno[1] <= turno[0]:
+                    salida += timedelta(days=1)  # Turno que cruza la medianoche
+                # Si llegó después de su hora de salida no inventamos horas
+                salida = max(salida, entrada)
+
+            registro.fecha_hora_salida = salida
+            registro.requiere_revision = True
+            registro.modificado = ahora
+            nota = "Salida cerrada automáticamente (no se registró salida)."
+            registro.notas = f"{registro.notas}\n{nota}" if registro.notas else nota
+
+        RegistroAsistencia.objects.bulk_update(
+            registros, ['fecha_hora_salida', 'requiere_revision', 'notas', 'modificado'], batch_size=500
+        )
+        return len(registros)
+
+    def registrar_ausencias(self, fecha):
+        """
+        Crea una marca de Ausencia por cada empleado activo con día laborable programado
+        en `fecha` que no tenga entrada ese día. Todo en un número fijo de consultas.
+        """
+        con_entrada = set(
+            RegistroAsistencia.objects.filter(fecha_hora_entrada__date=fecha)
+            .values_list('empleado_id', flat=True)
+        )
+        empleados = (
+            Empleado.objects.filter(is_active=True)
+            .exclude(id__in=con_entrada)
+            .exclude(ausencias__fecha=fecha)
+            .prefetch_related('horarios_dias')
+        )
+
+        nuevas = []
+        for empleado in empleados:
+            turno = turno_programado(empleado, fecha)
+            if turno and turno[0]:
+                nuevas.append(Ausencia(empleado=empleado, fecha=fecha))
+
+        # ignore_conflicts hace que volver a correr el proceso para el mismo día no duplique marcas
+        Ausencia.objects.bulk_create(nuevas, ignore_conflicts=True, batch_size=500)
+        return len(nuevas)
@@ -0,0 +1,220 @@
+import json
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, F, Q, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Empleado, RegistroAsistencia, Sucursal
+from .cache import invalidar_cache_asistencia
+from .escaneos import calcular_llego_tarde
+from .horarios import turno_programado
+from .periodos import rangos_cerrados
+
+# Acciones masivas del panel (varios registros o empleados en una sola petición).
+# Los cambios son un solo UPDATE por conjunto dentro de una transacción (al desplazar
+# entradas hay además un UPDATE previo de fecha_jornada y el recálculo de retardos). Como no pasan
+# por save() tampoco disparan las señales, así que aquí mismo se hace lo que ellas harían:
+# respetar los periodos cerrados, actualizar 'modificado' e invalidar la cache de reportes
+# (una sola vez por acción). Eliminar sí usa QuerySet.delete(), que manda las señales de
+# cada registro (lápidas incluidas).
+
+MAX_IDS = 5000
+MAX_MINUTOS_DESPLAZAMIENTO = 12 * 60
+
+ACCIONES_REGISTROS = ('eliminar', 'desplazar', 'marcar_tarde')
+ACCIONES_EMPLEADOS = ('activar', 'desactivar')
+CAMPOS_DESPLAZAMIENTO = ('entrada', 'salida', 'ambas')
+INVERTIR = 'invertir'
+
+
+class AccionInvalida(ValueError):
+    """
+    La petición de la acción masiva no es válida (acción, ids o parámetros).
+    """
+
+
+def leer_ids(valores):
+    """
+    Normaliza la lista de ids recibida (enteros positivos, sin repetir, a lo más MAX_IDS).
+    """
+    if not isinstance(valores, list) or not valores:
+        raise AccionInvalida("Selecciona al menos un elemento.")
+    if len(valores) > MAX_IDS:
+        raise AccionInvalida(f"Se pueden procesar como máximo {MAX_IDS} elementos por petición.")
+    try:
+        ids = {int(valor) for valor in valores}
+    except (TypeError, ValueError):
+        raise AccionInvalida("Los ids deben ser números.")
+    if any(id_ <= 0 for id_ in ids):
+        raise AccionInvalida("Los ids deben ser números positivos.")
+    return ids
+
+
+def filtro_periodos_cerrados(sucursal_id, campo='fecha_hora_entrada'):
+    """
+    Q que encuentra los registros cuyo `campo` (fecha y hora) cae en un periodo cerrado, o None.
+    """
+    rangos = rangos_cerrados(sucursal_id)
+    if not rangos:
+        return None
+    filtro = Q()
+    for inicio, fin in rangos:
+        filtro |= Q(**{f'{campo}__date__range': (inicio, fin)})
+    return filtro
+
+
+def resumen(accion, solicitados, procesados):
+    return {
+        'status': 'success',
+        'accion': accion,
+        'solicitados': solicitados,
+        'procesados': procesados,
+        'omitidos': solicitados - procesados,
+    }
+
+
+def _registros_editables(sucursal_id, ids):
+    registros = RegistroAsistencia.objects.filter(sucursal_id=sucursal_id, id__in=ids)
+    bloqueados = filtro_periodos_cerrados(sucursal_id)
+    if bloqueados is not None:
+        registros = registros.exclude(bloqueados)
+    return registros
+
+
+def eliminar_registros(sucursal_id, ids):
+    """
+    Elimina los registros de la sucursal que están fuera de periodos cerrados. Las señales de
+    delete() dejan sus lápidas para las exportaciones incrementales e invalidan los reportes.
+    """
+    with transaction.atomic():
+        _, borrados = _registros_editables(sucursal_id, ids).delete()
+    return resumen('eliminar', len(ids), borrados.get(RegistroAsistencia._meta.label, 0))
+
+
+def desplazar_registros(sucursal_id, ids, minutos, campo):
+    """
+    Recorre `minutos` (positivos o negativos) la entrada, la salida o ambas, con un solo UPDATE.
+    Se omiten los registros que quedarían con la salida antes de la entrada o que entrarían
+    o saldrían de un periodo cerrado. Lanza AccionInvalida si el cambio deja a un empleado
+    con dos entradas el mismo día (no se aplica nada). Si se movió la entrada, 'llego_tarde'
+    se vuelve a calcular con la nueva hora (la respuesta dice cuántos cambiaron).
+    """
+    if campo not in CAMPOS_DESPLAZAMIENTO:
+        raise AccionInvalida(f"Campo no válido. Usa: {', '.join(CAMPOS_DESPLAZAMIENTO)}.")
+    try:
+        minutos = int(minutos)
+    except (TypeError, ValueError):
+        raise AccionInvalida("Los minutos deben ser un número entero.")
+    if not minutos or abs(minutos) > MAX_MINUTOS_DESPLAZAMIENTO:
+        raise AccionInvalida(f"Los minutos deben estar entre -{MAX_MINUTOS_DESPLAZAMIENTO} y {MAX_MINUTOS_DESPLAZAMIENTO}, sin ser 0.")
+    desplazamiento = timedelta(minutes=minutos)
+
+    cambios = {'modificado': timezone.now()}
+    if campo in ('entrada', 'ambas'):
+        cambios['fecha_hora_entrada'] = F('fecha_hora_entrada') + desplazamiento
+        cambios['fecha_jornada'] = TruncDate(F('fecha_hora_entrada') + desplazamiento)
+    if campo in ('salida', 'ambas'):
+        cambios['fecha_hora_salida'] = F('fecha_hora_salida') + desplazamiento
+
+    with transaction.atomic():
+        registros = _registros_editables(sucursal_id, ids)
+        if campo == 'entrada':
+            registros = registros.exclude(fecha_hora_salida__lt=F('fecha_hora_entrada') + desplazamiento)
+        elif campo == 'salida':
+            registros = registros.filter(fecha_hora_salida__isnull=False).exclude(
+                fecha_hora_salida__lt=F('fecha_hora_entrada') - desplazamiento
+            )
+        if campo != 'salida' and rangos_cerrados(sucursal_id):
+            # Tampoco se puede mover una entrada hacia dentro de un periodo cerrado
+            nuevas = registros.alias(nueva_entrada=F('fecha_hora_entrada') + desplazamiento)
+            registros = registros.exclude(id__in=nuevas.filter(filtro_periodos_cerrados(sucursal_id, 'nueva_entrada')).values('id'))
+
+        ids_editables = list(registros.values_list('id', flat=True))
+        por_mover = RegistroAsistencia.objects.filter(id__in=ids_editables)
+        try:
+            with transaction.atomic():
+                procesados = 0
+                if 'fecha_jornada' in cambios:
+                    # Los duplicados anteriores a la restricción se mueven sin darles fecha (ver RegistroAsistencia.save)
+                    legados = list(por_mover.filter(fecha_jornada__isnull=True).values_list('id', flat=True))
+                    if legados:
+                        sin_fecha = {nombre: valor for nombre, valor in cambios.items() if nombre != 'fecha_jornada'}
+                        procesados = RegistroAsistencia.objects.filter(id__in=legados).update(**sin_fecha)
+                        por_mover = por_mover.exclude(id__in=legados)
+                    # La restricción (empleado, fecha_jornada) se revisa fila por fila durante el UPDATE:
+                    # al recorrer días seguidos, el primero chocaría con el siguiente antes de que este
+                    # se mueva. Con la fecha en nulo primero solo fallan los choques del resultado final.
+                    por_mover.update(fecha_jornada=None)
+                procesados += por_mover.update(**cambios)
+        except IntegrityError:
+            raise AccionInvalida("El cambio dejaría a un empleado con dos entradas el mismo día; no se aplicó nada.")
+        tardes_recalculados = recalcular_tardes(sucursal_id, ids_editables) if 'fecha_hora_entrada' in cambios else 0
+    if procesados:
+        invalidar_cache_asistencia(sucursal_id)
+    return {**resumen('desplazar', len(ids), procesados), 'tardes_recalculados': tardes_recalculados}
+
+
+def recalcular_tardes(sucursal_id, ids):
+    """
+    Vuelve a calcular 'llego_tarde' de los registros con su hora de entrada actual, con la misma
+    regla que el kiosko (horario del día y tolerancia de la sucursal). Devuelve cuántos cambiaron.
+    """
+    tolerancia = Sucursal.objects.values_list('minutos_tolerancia_entrada', flat=True).get(pk=sucursal_id)
+    registros = RegistroAsistencia.objects.filter(id__in=ids).select_related('empleado').prefetch_related('empleado__horarios_dias')
+    cambiados = []
+    for registro in registros:
+        entrada = timezone.localtime(registro.fecha_hora_entrada)
+        turno = turno_programado(registro.empleado, entrada.date())
+        llego_tarde = calcular_llego_tarde(turno[0] if turno else None, entrada, tolerancia)
+        if llego_tarde != registro.llego_tarde:
+            registro.llego_tarde = llego_tarde
+            cambiados.append(registro)
+    RegistroAsistencia.objects.bulk_update(cambiados, ['llego_tarde'], batch_size=1000)
+    return len(cambiados)
+
+
+def marcar_tarde(sucursal_id, ids, valor):
+    """
+    Marca (True), desmarca (False) o invierte (INVERTIR) 'llego_tarde' con un solo UPDATE.
+    """
+    # Se pide el valor explícito: 1/0 o un campo faltante no deben terminar en una inversión
+    if not isinstance(valor, bool) and valor != INVERTIR:
+        raise AccionInvalida(f'llego_tarde debe ser true, false o "{INVERTIR}".')
+    if valor == INVERTIR:
+        nuevo = Case(When(llego_tarde=True, then=Value(False)), default=Value(True), output_field=BooleanField())
+    else:
+        nuevo = Value(valor)
+    with transaction.atomic():
+        procesados = _registros_editables(sucursal_id, ids).update(llego_tarde=nuevo, modificado=timezone.now())
+    if procesados:
+        invalidar_cache_asistencia(sucursal_id)
+    return resumen('marcar_tarde', len(ids), procesados)
+
+
+def cambiar_estado_empleados(sucursal_id, ids, activo):
+    """
+    Activa o desactiva a los empleados de la sucursal con un solo UPDATE.
+    Los que ya estaban en ese estado cuentan como omitidos.
+    """
+    with transaction.atomic():
+        procesados = Empleado.objects.filter(sucursal_id=sucursal_id, id__in=ids).exclude(is_active=activo).update(is_active=activo)
+    if procesados:
+        # Igual que la señal de Empleado: los cambios de empleados invalidan todas las sucursales
+        invalidar_cache_asistencia()
+    return resumen('activar' if activo else 'desactivar', len(ids), procesados)
+
+
+def leer_peticion(cuerpo, acciones):
+    """
+    Lee el JSON de la petición: {"accion": ..., "ids": [...], ...}. Devuelve (accion, ids, datos).
+    """
+    try:
+        datos = json.loads(cuerpo or b'{}')
+    except ValueError:
+        raise AccionInvalida("El cuerpo de la petición debe ser JSON.")
+    if not isinstance(datos, dict):
+        raise AccionInvalida("El cuerpo de la petición debe ser un objeto JSON.")
+    accion = datos.get('accion')
+    if accion not in acciones:
+        raise AccionInvalida(f"Acción no válida. Usa: {', '.join(acciones)}.")
+    return accion, leer_ids(datos.get('ids')), datos
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0003_empleado_usa_horario_variable_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ausencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(help_text='Día programado en que no hubo entrada')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AddField(
+            model_name='registroasistencia',
+            name='requiere_revision',
+            field=models.BooleanField(default=False, help_text='Se marca cuando el turno quedó abierto y lo cerró (o señaló) el proceso nocturno'),
+        ),
+        migrations.AddIndex(
+            model_name='registroasistencia',
+            index=models.Index(condition=models.Q(('fecha_hora_salida__isnull', True)), fields=['empleado', 'fecha_hora_entrada'], name='asistencia_abierta_idx'),
+        ),
+        migrations.AddField(
+            model_name='ausencia',
+            name='empleado',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ausencias', to='bitacora.empleado'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ausencia',
+            unique_together={('empleado', 'fecha')},
+        ),
+    ]
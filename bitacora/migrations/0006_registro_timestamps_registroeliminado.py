@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0005_trabajoexportacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroEliminado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('registro_id', models.BigIntegerField(help_text='ID del RegistroAsistencia eliminado')),
+                ('empleado_id', models.BigIntegerField(help_text='ID del empleado al que pertenecía')),
+                ('eliminado', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['eliminado'],
+            },
+        ),
+        migrations.AddField(
+            model_name='registroasistencia',
+            name='creado',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, help_text='Momento en que se creó el registro'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='registroasistencia',
+            name='modificado',
+            field=models.DateTimeField(auto_now=True, db_index=True, help_text='Última modificación; sirve de marca de agua para las exportaciones incrementales'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:20
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar(texto):
+    # Copia de bitacora.busqueda.normalizar al momento de esta migración: la migración no
+    # debe cambiar si el código de la app cambia después.
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+
+def llenar_busqueda(apps, schema_editor):
+    Empleado = apps.get_model('bitacora', 'Empleado')
+    empleados = list(Empleado.objects.all())
+    for empleado in empleados:
+        partes = [empleado.nombre, empleado.apellido, empleado.puesto, empleado.email]
+        empleado.busqueda = normalizar(' '.join(parte for parte in partes if parte))
+    Empleado.objects.bulk_update(empleados, ['busqueda'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0006_registro_timestamps_registroeliminado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empleado',
+            name='busqueda',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=600),
+        ),
+        migrations.RunPython(llenar_busqueda, migrations.RunPython.noop),
+    ]
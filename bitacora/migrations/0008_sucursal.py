@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 03:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0007_empleado_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sucursal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(help_text='Nombre de la sucursal', max_length=100, unique=True)),
+                ('minutos_tolerancia_entrada', models.PositiveIntegerField(default=10, help_text='Número de minutos de tolerancia para considerar una llegada como puntual.')),
+            ],
+            options={
+                'verbose_name_plural': 'Sucursales',
+                'ordering': ['nombre'],
+            },
+        ),
+        migrations.AddField(
+            model_name='empleado',
+            name='sucursal',
+            field=models.ForeignKey(db_index=False, help_text='Sucursal donde trabaja el empleado', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='empleados', to='bitacora.sucursal'),
+        ),
+        migrations.AddField(
+            model_name='registroasistencia',
+            name='sucursal',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='asistencias', to='bitacora.sucursal'),
+        ),
+        migrations.AddField(
+            model_name='registroeliminado',
+            name='sucursal_id',
+            field=models.BigIntegerField(help_text='ID de la sucursal del registro eliminado', null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def crear_sucursal_principal(apps, schema_editor):
+    """
+    Todo lo que ya existía pasa a una sucursal "Principal" con la tolerancia de la configuración global.
+    """
+    Sucursal = apps.get_model('bitacora', 'Sucursal')
+    Configuracion = apps.get_model('bitacora', 'Configuracion')
+    Empleado = apps.get_model('bitacora', 'Empleado')
+    RegistroAsistencia = apps.get_model('bitacora', 'RegistroAsistencia')
+    RegistroEliminado = apps.get_model('bitacora', 'RegistroEliminado')
+
+    config = Configuracion.objects.first()
+    principal, _ = Sucursal.objects.get_or_create(
+        nombre='Principal',
+        defaults={'minutos_tolerancia_entrada': config.minutos_tolerancia_entrada if config else 10},
+    )
+    Empleado.objects.filter(sucursal__isnull=True).update(sucursal=principal)
+    RegistroAsistencia.objects.filter(sucursal__isnull=True).update(sucursal=principal)
+    RegistroEliminado.objects.filter(sucursal_id__isnull=True).update(sucursal_id=principal.id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0008_sucursal'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_sucursal_principal, migrations.RunPython.noop),
+    ]
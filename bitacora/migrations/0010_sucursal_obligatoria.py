@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 03:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0009_sucursal_principal'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='empleado',
+            name='sucursal',
+            field=models.ForeignKey(db_index=False, help_text='Sucursal donde trabaja el empleado', on_delete=django.db.models.deletion.PROTECT, related_name='empleados', to='bitacora.sucursal'),
+        ),
+        migrations.AlterField(
+            model_name='registroasistencia',
+            name='sucursal',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='asistencias', to='bitacora.sucursal'),
+        ),
+        migrations.AddIndex(
+            model_name='empleado',
+            index=models.Index(fields=['sucursal', 'is_active', 'nombre', 'apellido'], name='empleado_sucursal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroasistencia',
+            index=models.Index(fields=['sucursal', 'fecha_hora_entrada'], name='asistencia_sucursal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroasistencia',
+            index=models.Index(fields=['sucursal', 'modificado'], name='asistencia_sucursal_mod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroeliminado',
+            index=models.Index(fields=['sucursal_id', 'eliminado'], name='eliminado_sucursal_idx'),
+        ),
+    ]
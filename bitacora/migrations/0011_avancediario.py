@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0010_sucursal_obligatoria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvanceDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(help_text='Identificador del archivo del diario', max_length=64, unique=True)),
+                ('lineas_aplicadas', models.PositiveIntegerField(default=0)),
+                ('modificado', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
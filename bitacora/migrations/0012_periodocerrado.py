@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0011_avancediario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodoCerrado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_inicio', models.DateField(help_text='Primer día del periodo')),
+                ('fecha_fin', models.DateField(help_text='Último día del periodo')),
+                ('totales', models.JSONField(default=list, help_text='Resumen de horas y retardos por empleado al momento del cierre')),
+                ('excel_asistencia', models.BinaryField(help_text='Reporte de asistencia del periodo, ya generado')),
+                ('excel_nomina', models.BinaryField(help_text='Libro de nómina del periodo, ya generado')),
+                ('cerrado', models.DateTimeField(auto_now_add=True)),
+                ('cerrado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='periodos_cerrados', to=settings.AUTH_USER_MODEL)),
+                ('sucursal', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='periodos_cerrados', to='bitacora.sucursal')),
+            ],
+            options={
+                'verbose_name_plural': 'Periodos cerrados',
+                'ordering': ['-fecha_inicio'],
+                'indexes': [models.Index(fields=['sucursal', 'fecha_inicio', 'fecha_fin'], name='periodo_sucursal_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-19 02:35
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def llenar_fecha_jornada(apps, schema_editor):
+    """
+    Copia el día local de la entrada. Si un empleado ya tenía dos entradas el mismo día,
+    solo la primera lleva la fecha (las demás quedan en nulo) para poder crear la restricción.
+    """
+    RegistroAsistencia = apps.get_model('bitacora', 'RegistroAsistencia')
+    vistos = set()
+    lote = []
+    registros = RegistroAsistencia.objects.order_by('empleado_id', 'fecha_hora_entrada', 'id').only('id', 'empleado_id', 'fecha_hora_entrada')
+    for registro in registros.iterator(chunk_size=2000):
+        fecha = timezone.localtime(registro.fecha_hora_entrada).date()
+        if (registro.empleado_id, fecha) in vistos:
+            continue
+        vistos.add((registro.empleado_id, fecha))
+        registro.fecha_jornada = fecha
+        lote.append(registro)
+        if len(lote) >= 1000:
+            RegistroAsistencia.objects.bulk_update(lote, ['fecha_jornada'])
+            lote = []
+    RegistroAsistencia.objects.bulk_update(lote, ['fecha_jornada'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0012_periodocerrado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registroasistencia',
+            name='fecha_jornada',
+            field=models.DateField(blank=True, editable=False, help_text='Día (hora local) de la entrada', null=True),
+        ),
+        migrations.RunPython(llenar_fecha_jornada, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='registroasistencia',
+            constraint=models.UniqueConstraint(fields=('empleado', 'fecha_jornada'), name='asistencia_una_entrada_dia'),
+        ),
+    ]
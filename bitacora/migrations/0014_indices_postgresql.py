@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# Índices que solo existen en PostgreSQL. En SQLite esta migración no hace nada.
+INDICES = [
+    # BRIN: los registros se insertan en orden de llegada, así que un índice por rangos de
+    # bloques sobre la fecha de entrada ocupa unos KB y basta para los barridos por periodo.
+    ('asistencia_entrada_brin',
+     "CREATE INDEX IF NOT EXISTS asistencia_entrada_brin ON bitacora_registroasistencia USING brin (fecha_hora_entrada)"),
+    # Parcial: solo los retardos, para el reporte de puntualidad y los totales del cierre de periodo
+    ('asistencia_tarde_idx',
+     "CREATE INDEX IF NOT EXISTS asistencia_tarde_idx ON bitacora_registroasistencia (sucursal_id, fecha_hora_entrada) WHERE llego_tarde"),
+]
+
+
+def crear_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, sql in INDICES:
+        schema_editor.execute(sql)
+
+
+def eliminar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre, _ in INDICES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {nombre}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0013_fecha_jornada'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,61 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# Copias de bitacora.busqueda.normalizar y palabras al momento de esta migración: la migración
+# no debe cambiar si el código de la app cambia después.
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+
+def palabras(texto):
+    return [palabra for palabra in re.split(r'[\W_]+', normalizar(texto)) if palabra]
+
+
+def llenar_busqueda(apps, schema_editor):
+    Empleado = apps.get_model('bitacora', 'Empleado')
+    empleados = list(Empleado.objects.only('id', 'nombre', 'apellido', 'puesto', 'email'))
+    for empleado in empleados:
+        partes = [empleado.nombre, empleado.apellido, empleado.puesto, empleado.email]
+        empleado.busqueda = ' '.join(palabras(' '.join(parte for parte in partes if parte)))
+    Empleado.objects.bulk_update(empleados, ['busqueda'], batch_size=500)
+
+
+# Índice de trigramas sobre la columna normalizada: en PostgreSQL resuelve los LIKE '%...%'
+# de la búsqueda sin recorrer la tabla. pg_trgm es una extensión "trusted" (PostgreSQL 13+),
+# así que la puede crear el dueño de la base de datos. Si el servidor no trae las extensiones
+# de contrib, la búsqueda funciona igual, solo que sin índice. En SQLite no se hace nada.
+
+def crear_indice_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS empleado_busqueda_trgm ON bitacora_empleado USING gin (busqueda gin_trgm_ops)"
+    )
+
+
+def eliminar_indice_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS empleado_busqueda_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0014_indices_postgresql'),
+    ]
+
+    operations = [
+        migrations.RunPython(llenar_busqueda, migrations.RunPython.noop),
+        migrations.RunPython(crear_indice_trigramas, eliminar_indice_trigramas),
+    ]
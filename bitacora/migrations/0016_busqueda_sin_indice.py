@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-19 03:27
+
+from django.db import migrations, models
+
+# La búsqueda filtra la columna con LIKE '%...%' y un B-tree no resuelve esos filtros: solo
+# ocupaba espacio y hacía más lentas las escrituras de empleados. En PostgreSQL la resuelve el
+# índice de trigramas (0015); en SQLite el índice FTS5 o un recorrido de la tabla.
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0015_busqueda_palabras'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='empleado',
+            name='busqueda',
+            field=models.CharField(blank=True, default='', editable=False, max_length=600),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-19 03:30
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitacora', '0016_busqueda_sin_indice'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispositivoKiosko',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('nombre', models.CharField(help_text='Nombre para identificar el dispositivo (ej. Tablet entrada)', max_length=50)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('revocado', models.DateTimeField(blank=True, help_text='Desde cuándo su token ya no abre el kiosko', null=True)),
+                ('creado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dispositivos_kiosko', to=settings.AUTH_USER_MODEL)),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispositivos_kiosko', to='bitacora.sucursal')),
+            ],
+            options={
+                'verbose_name_plural': 'Dispositivos kiosko',
+                'ordering': ['-creado'],
+            },
+        ),
+    ]
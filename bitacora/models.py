@@ -1,10 +1,12 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
 # --- Modelo Configuración ---
 class Configuracion(models.Model):
     """
     Modelo para guardar configuraciones globales de la app.
+    La tolerancia ahora vive en cada Sucursal; este valor solo sirvió para inicializar la sucursal principal.
     """
     minutos_tolerancia_entrada = models.PositiveIntegerField(
         default=10,
@@ -18,6 +20,26 @@ class Configuracion(models.Model):
         verbose_name_plural = "Configuraciones"
 
 
+# --- Modelo Sucursal ---
+class Sucursal(models.Model):
+    """
+    Tienda o local. Empleados y registros pertenecen a una sucursal, y cada sesión del
+    panel (o del kiosko de escaneo) trabaja sobre una sola.
+    """
+    nombre = models.CharField(max_length=100, unique=True, help_text="Nombre de la sucursal")
+    minutos_tolerancia_entrada = models.PositiveIntegerField(
+        default=10,
+        help_text="Número de minutos de tolerancia para considerar una llegada como puntual."
+    )
+
+    class Meta:
+        verbose_name_plural = "Sucursales"
+        ordering = ['nombre']
+
+    def __str__(self):
+        return self.nombre
+
+
 # --- Modelo Empleado ---
 class Empleado(models.Model):
     """
@@ -45,6 +67,25 @@ class Empleado(models.Model):
         help_text="Código único para el QR del empleado. Se genera automáticamente."
     )
     is_active = models.BooleanField(default=True, help_text="Indica si el empleado está activo en la empresa")
+    # Sin índice propio: lo cubre empleado_sucursal_idx, que empieza por la sucursal
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.PROTECT, related_name='empleados', db_index=False, help_text="Sucursal donde trabaja el empleado")
+
+    # Nombre, apellido, puesto y email en minúsculas y sin acentos, para la búsqueda
+    busqueda = models.CharField(max_length=600, blank=True, default='', editable=False)
+
+    def save(self, *args, **kwargs):
+        from .busqueda import texto_busqueda
+        self.busqueda = texto_busqueda(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'busqueda' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'busqueda']
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # El panel lista los empleados de una sucursal por estado y nombre
+            models.Index(fields=['sucursal', 'is_active', 'nombre', 'apellido'], name='empleado_sucursal_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} {self.apellido}"
@@ -81,11 +122,181 @@ class RegistroAsistencia(models.Model):
     Representa un registro de asistencia (una jornada laboral) para un empleado.
     """
     empleado = models.ForeignKey(Empleado, on_delete=models.CASCADE, related_name='asistencias')
+    # Sucursal donde se registró la jornada (se copia del empleado al crear el registro).
+    # Sin índice propio: la cubren los índices compuestos de Meta.
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.PROTECT, related_name='asistencias', db_index=False)
     fecha_hora_entrada = models.DateTimeField(help_text="Fecha y hora exactas de la entrada")
     fecha_hora_salida = models.DateTimeField(blank=True, null=True, help_text="Fecha y hora exactas de la salida (puede estar vacío)")
+    # Día local de la entrada. La restricción (empleado, fecha_jornada) garantiza una sola entrada
+    # por día aunque lleguen dos escaneos a la vez; es nulo en los duplicados que ya existían.
+    fecha_jornada = models.DateField(null=True, blank=True, editable=False, help_text="Día (hora local) de la entrada")
     llego_tarde = models.BooleanField(default=False, help_text="Se marca si el empleado llegó después de su hora supuesta (con tolerancia)")
     notas = models.TextField(blank=True, null=True, help_text="Notas u observaciones sobre este registro")
+    requiere_revision = models.BooleanField(default=False, help_text="Se marca cuando el turno quedó abierto y lo cerró (o señaló) el proceso nocturno")
+    creado = models.DateTimeField(auto_now_add=True, help_text="Momento en que se creó el registro")
+    modificado = models.DateTimeField(auto_now=True, db_index=True, help_text="Última modificación; sirve de marca de agua para las exportaciones incrementales")
+
+    class Meta:
+        indexes = [
+            # Índice parcial: solo contiene los turnos abiertos, así buscar la salida pendiente
+            # o los olvidos del día cuesta lo mismo sin importar el historial acumulado.
+            models.Index(
+                fields=['empleado', 'fecha_hora_entrada'],
+                condition=models.Q(fecha_hora_salida__isnull=True),
+                name='asistencia_abierta_idx',
+            ),
+            # Reportes y exportaciones filtran primero por sucursal y luego por fecha
+            models.Index(fields=['sucursal', 'fecha_hora_entrada'], name='asistencia_sucursal_idx'),
+            models.Index(fields=['sucursal', 'modificado'], name='asistencia_sucursal_mod_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['empleado', 'fecha_jornada'], name='asistencia_una_entrada_dia'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.sucursal_id is None:
+            self.sucursal_id = self.empleado.sucursal_id
+        # Los duplicados que ya existían antes de la restricción se quedaron sin fecha (migración 0013):
+        # volver a llenarla al editarlos chocaría con la entrada de ese día que sí la tiene
+        if self._state.adding or self.fecha_jornada is not None:
+            self.fecha_jornada = timezone.localtime(self.fecha_hora_entrada).date()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'fecha_jornada' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'fecha_jornada']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         fecha = self.fecha_hora_entrada.strftime('%Y-%m-%d')
-        return f"Asistencia de {self.empleado} - {fecha}"
\ No newline at end of file
+        return f"Asistencia de {self.empleado} - {fecha}"
+
+
+# --- Modelo Ausencia ---
+class Ausencia(models.Model):
+    """
+    Marca de falta: el empleado tenía un día laborable programado y no registró entrada.
+    La genera el proceso nocturno (comando procesar_jornadas).
+    """
+    empleado = models.ForeignKey(Empleado, on_delete=models.CASCADE, related_name='ausencias')
+    fecha = models.DateField(help_text="Día programado en que no hubo entrada")
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('empleado', 'fecha')
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"Ausencia de {self.empleado} - {self.fecha}"
+
+
+# --- Modelo RegistroEliminado ---
+class RegistroEliminado(models.Model):
+    """
+    Lápida de un RegistroAsistencia borrado, para que las exportaciones incrementales
+    puedan avisar de las eliminaciones. No es FK: el registro (o el empleado) ya no existe.
+    """
+    registro_id = models.BigIntegerField(help_text="ID del RegistroAsistencia eliminado")
+    empleado_id = models.BigIntegerField(help_text="ID del empleado al que pertenecía")
+    sucursal_id = models.BigIntegerField(null=True, help_text="ID de la sucursal del registro eliminado")
+    eliminado = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['eliminado']
+        indexes = [
+            models.Index(fields=['sucursal_id', 'eliminado'], name='eliminado_sucursal_idx'),
+        ]
+
+    def __str__(self):
+        return f"Registro {self.registro_id} eliminado el {self.eliminado:%Y-%m-%d %H:%M}"
+
+# --- Modelo PeriodoCerrado ---
+class PeriodoCerrado(models.Model):
+    """
+    Periodo de pago ya cerrado de una sucursal. Guarda una foto de sus números (totales por
+    empleado con retardos y los Excel ya generados) para que los reportes del periodo no se
+    recalculen; los registros de asistencia que caen dentro ya no se pueden modificar ni eliminar.
+    """
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.PROTECT, related_name='periodos_cerrados', db_index=False)
+    fecha_inicio = models.DateField(help_text="Primer día del periodo")
+    fecha_fin = models.DateField(help_text="Último día del periodo")
+    totales = models.JSONField(default=list, help_text="Resumen de horas y retardos por empleado al momento del cierre")
+    excel_asistencia = models.BinaryField(help_text="Reporte de asistencia del periodo, ya generado")
+    excel_nomina = models.BinaryField(help_text="Libro de nómina del periodo, ya generado")
+    cerrado_por = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='periodos_cerrados')
+    cerrado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Periodos cerrados"
+        ordering = ['-fecha_inicio']
+        indexes = [
+            models.Index(fields=['sucursal', 'fecha_inicio', 'fecha_fin'], name='periodo_sucursal_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sucursal}: {self.fecha_inicio:%d/%m/%Y} - {self.fecha_fin:%d/%m/%Y}"
+
+# --- Modelo DispositivoKiosko ---
+class DispositivoKiosko(models.Model):
+    """
+    Dispositivo activado como kiosko de escaneo de una sucursal. Su id va dentro del token
+    firmado, así que cada dispositivo se puede revocar sin invalidar los tokens de los demás.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='dispositivos_kiosko')
+    nombre = models.CharField(max_length=50, help_text="Nombre para identificar el dispositivo (ej. Tablet entrada)")
+    creado = models.DateTimeField(auto_now_add=True)
+    creado_por = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='dispositivos_kiosko')
+    revocado = models.DateTimeField(blank=True, null=True, help_text="Desde cuándo su token ya no abre el kiosko")
+
+    class Meta:
+        verbose_name_plural = "Dispositivos kiosko"
+        ordering = ['-creado']
+
+    def __str__(self):
+        return f"{self.nombre} ({self.sucursal})"
+
+# --- Modelo AvanceDiario ---
+class AvanceDiario(models.Model):
+    """
+    Cuántas líneas de un archivo del diario de escaneos ya se aplicaron. Se actualiza en la
+    misma transacción que cada lote, para que reaplicar el archivo nunca duplique escaneos.
+    """
+    archivo = models.CharField(max_length=64, unique=True, help_text="Identificador del archivo del diario")
+    lineas_aplicadas = models.PositiveIntegerField(default=0)
+    modificado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Diario {self.archivo}: {self.lineas_aplicadas} líneas aplicadas"
+
+# --- Modelo TrabajoExportacion ---
+class TrabajoExportacion(models.Model):
+    """
+    Exportación a Excel que se genera en segundo plano. La petición solo crea el trabajo;
+    un proceso del pool de exportaciones construye el archivo y va actualizando el progreso.
+    """
+    PENDIENTE = 'pendiente'
+    PROCESANDO = 'procesando'
+    TERMINADO = 'terminado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (PROCESANDO, 'Procesando'),
+        (TERMINADO, 'Terminado'),
+        (ERROR, 'Error'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='exportaciones')
+    parametros = models.JSONField(default=dict, help_text="Filtros del reporte usados para generar el archivo")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje de avance (0-100)")
+    archivo = models.CharField(max_length=255, blank=True, help_text="Nombre del archivo generado dentro de EXPORTACIONES_DIR")
+    mensaje_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    terminado = models.DateTimeField(blank=True, null=True)
+    expira = models.DateTimeField(blank=True, null=True, db_index=True, help_text="Después de esta fecha el archivo se elimina")
+
+    class Meta:
+        ordering = ['-creado']
+
+    def __str__(self):
+        return f"Exportación {self.id} ({self.get_estado_display()})"
@@ -0,0 +1,120 @@
+"""
+Cálculo de las hojas de nómina por empleado.
+
+Este módulo no importa nada de Django a propósito: sus funciones corren en procesos
+hijos (pool con 'spawn') que solo reciben datos simples y devuelven filas ya listas.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from zoneinfo import ZoneInfo
+
+ENCABEZADOS_HOJA = ["ID Registro", "Fecha", "Hora Entrada", "Hora Salida", "Horas Trabajadas", "Llegó Tarde"]
+
+_pool = None
+_pool_procesos = 0
+# Las exportaciones corren en varios hilos: el candado evita que dos creen (o descarten) el pool a la vez
+_candado_pool = threading.Lock()
+
+
+def _duracion(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600}h {(segundos % 3600) // 60}m"
+
+
+def construir_hoja_empleado(particion):
+    """
+    Recibe (empleado_id, nombre, zona_horaria, registros) donde cada registro es
+    (id, entrada, salida, llego_tarde) con datetimes en UTC, y devuelve las filas de
+    la hoja del empleado con sus totales.
+    """
+    empleado_id, nombre, zona, registros = particion
+    tz = ZoneInfo(zona)
+    filas = []
+    total_segundos = 0
+    dias = set()
+    tardes = 0
+
+    for registro_id, entrada, salida, llego_tarde in registros:
+        local_entrada = entrada.astimezone(tz)
+        hora_salida, horas = '', ''
+        if salida:
+            segundos = (salida - entrada).total_seconds()
+            total_segundos += segundos
+            dias.add(local_entrada.date())
+            hora_salida = salida.astimezone(tz).strftime('%H:%M:%S')
+            horas = _duracion(segundos)
+        if llego_tarde:
+            tardes += 1
+        filas.append([
+            registro_id,
+            local_entrada.strftime('%d/%m/%Y'), local_entrada.strftime('%H:%M:%S'),
+            hora_salida, horas,
+            "Sí" if llego_tarde else "No",
+        ])
+
+    filas.append([])
+    filas.append(["TOTAL", f"{len(dias)} días", "", "", _duracion(total_segundos), f"{tardes} retardos"])
+    return {
+        'empleado_id': empleado_id,
+        'nombre': nombre,
+        'filas': filas,
+        'segundos': int(total_segundos),
+        'dias': len(dias),
+        'tardes': tardes,
+    }
+
+
+def _obtener_pool(procesos):
+    global _pool, _pool_procesos
+    with _candado_pool:
+        if _pool is None or _pool_procesos != procesos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 'spawn' evita heredar hilos y conexiones abiertas del proceso de gunicorn
+            _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'))
+            _pool_procesos = procesos
+        return _pool
+
+
+def _descartar_pool(pool):
+    """
+    Apaga un pool roto (murió un proceso hijo) para que la siguiente exportación cree otro.
+    """
+    global _pool
+    with _candado_pool:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def procesar_particiones(particiones, procesos, minimo_registros_paralelo, progreso=None):
+    """
+    Construye las hojas de todas las particiones. Armar las filas es una parte chica del libro
+    (lo que más tarda es guardar el Workbook, que es secuencial) y arrancar el pool cuesta más
+    que eso en los periodos normales, así que solo se reparte en el pool de procesos cuando el
+    periodo tiene al menos `minimo_registros_paralelo` registros; si no, se hace en línea.
+    `progreso` se llama con el número de hojas terminadas.
+    """
+    total_registros = sum(len(particion[3]) for particion in particiones)
+    if procesos <= 1 or total_registros < minimo_registros_paralelo:
+        resultados = []
+        for particion in particiones:
+            resultados.append(construir_hoja_empleado(particion))
+            if progreso:
+                progreso(len(resultados))
+        return resultados
+
+    chunksize = max(1, len(particiones) // (procesos * 4))
+    pool = _obtener_pool(procesos)
+    try:
+        resultados = []
+        for resultado in pool.map(construir_hoja_empleado, particiones, chunksize=chunksize):
+            resultados.append(resultado)
+            if progreso:
+                progreso(len(resultados))
+        return resultados
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        raise
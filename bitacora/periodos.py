@@ -0,0 +1,169 @@
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import PeriodoCerrado, RegistroAsistencia, Sucursal
+from .filtros import filtrar_registros, empleados_para_resumen
+from .horarios import calcular_horas
+
+# Cierre de periodos de pago.
+# Cerrar un periodo toma una foto de sus números (PeriodoCerrado) y bloquea sus registros:
+# los reportes y exportaciones de ese mismo rango se sirven de la foto, sin recalcular nada,
+# y cualquier save()/delete() de un registro dentro del periodo lanza RegistroBloqueado.
+# Los rangos cerrados se leen de la BD en cada verificación (una consulta pequeña por el
+# índice de sucursal): con varios workers, un rango en cache seguiría permitiendo editar
+# un periodo recién cerrado hasta que expirara.
+
+
+class RegistroBloqueado(Exception):
+    """
+    El registro pertenece a un periodo cerrado y ya no se puede modificar ni eliminar.
+    """
+
+
+def rangos_cerrados(sucursal_id):
+    """
+    Lista de (fecha_inicio, fecha_fin) de los periodos cerrados de la sucursal.
+    """
+    return list(PeriodoCerrado.objects.filter(sucursal_id=sucursal_id).values_list('fecha_inicio', 'fecha_fin'))
+
+
+def filtro_registros_cerrados(campo='fecha_hora_entrada'):
+    """
+    Q que encuentra los registros de cualquier sucursal cuyo `campo` cae en un periodo
+    cerrado de su sucursal, o None. Para los procesos que recorren todas las sucursales.
+    """
+    filtro = Q()
+    for sucursal_id, inicio, fin in PeriodoCerrado.objects.values_list('sucursal_id', 'fecha_inicio', 'fecha_fin'):
+        filtro |= Q(sucursal_id=sucursal_id, **{f'{campo}__date__range': (inicio, fin)})
+    return filtro or None
+
+
+def fecha_cerrada(fecha, rangos):
+    return any(inicio <= fecha <= fin for inicio, fin in rangos)
+
+
+def verificar_registro_editable(registro):
+    """
+    Lanza RegistroBloqueado si el registro (con su fecha actual o la que tenía guardada)
+    cae en un periodo cerrado. Sin periodos cerrados en la sucursal no consulta el registro guardado.
+    """
+    rangos = rangos_cerrados(registro.sucursal_id)
+    if not rangos:
+        return
+    fechas = [timezone.localtime(registro.fecha_hora_entrada).date()]
+    if registro.pk:
+        anterior = RegistroAsistencia.objects.filter(pk=registro.pk).values_list('fecha_hora_entrada', flat=True).first()
+        if anterior:
+            fechas.append(timezone.localtime(anterior).date())
+    for fecha in fechas:
+        if fecha_cerrada(fecha, rangos):
+            raise RegistroBloqueado(
+                f"El registro de {registro.empleado} del {fecha:%d/%m/%Y} pertenece a un periodo cerrado y no se puede modificar."
+            )
+
+
+def ids_bloqueados(registros, sucursal_id):
+    """
+    IDs de los registros (ya cargados) que caen en un periodo cerrado, para el reporte.
+    """
+    rangos = rangos_cerrados(sucursal_id)
+    if not rangos:
+        return set()
+    return {
+        registro.id for registro in registros
+        if fecha_cerrada(timezone.localtime(registro.fecha_hora_entrada).date(), rangos)
+    }
+
+
+def periodo_de_filtros(filtros, *campos):
+    """
+    El periodo cerrado cuyo rango coincide exactamente con el de los filtros, o None.
+    Solo se cargan los campos pedidos (los Excel pesan; el reporte no los necesita).
+    """
+    if not filtros['fecha_inicio'] or not filtros['fecha_fin']:
+        return None
+    periodos = PeriodoCerrado.objects.filter(
+        sucursal_id=filtros['sucursal_id'],
+        fecha_inicio=filtros['fecha_inicio'],
+        fecha_fin=filtros['fecha_fin'],
+    )
+    if campos:
+        periodos = periodos.only('id', 'sucursal_id', 'fecha_inicio', 'fecha_fin', 'cerrado', *campos)
+    return periodos.first()
+
+
+def totales_de(periodo, empleado_id=None):
+    if empleado_id:
+        return [item for item in periodo.totales if item['empleado_id'] == empleado_id]
+    return periodo.totales
+
+
+def cerrar_periodo(sucursal, fecha_inicio, fecha_fin, usuario=None):
+    """
+    Cierra el periodo de la sucursal: calcula los totales y genera los dos Excel una sola vez.
+    Lanza ValueError si el rango no es válido, se traslapa con otro periodo cerrado,
+    todavía tiene turnos abiertos o sus registros cambian mientras se cierra.
+    """
+    from .exportar import construir_excel_asistencia, construir_excel_nomina
+
+    if fecha_fin < fecha_inicio:
+        raise ValueError("La fecha final no puede ser anterior a la inicial.")
+    if fecha_fin >= timezone.localdate():
+        raise ValueError("Solo se pueden cerrar periodos que ya terminaron (hasta ayer).")
+
+    filtros = {'sucursal_id': sucursal.id, 'empleado_id': None, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    if periodos_traslapados(sucursal, fecha_inicio, fecha_fin).exists():
+        raise ValueError("El periodo se traslapa con otro periodo ya cerrado.")
+
+    # La foto (totales y los dos Excel) se arma fuera de la transacción: en SQLite una
+    # transacción que escribe bloquea a los kioscos, y armar los Excel puede tardar.
+    registros = filtrar_registros(
+        RegistroAsistencia.objects.select_related('empleado').order_by('-fecha_hora_entrada'), filtros
+    )
+    if registros.filter(fecha_hora_salida__isnull=True).exists():
+        raise ValueError("Hay turnos abiertos en el periodo; registra o corrige sus salidas antes de cerrarlo.")
+    firma = firma_registros(registros)
+
+    empleados = empleados_para_resumen(registros, filtros)
+    totales = calcular_horas(empleados, registros, fecha_inicio, fecha_fin)
+    tardes = dict(
+        registros.filter(llego_tarde=True).order_by().values('empleado_id')
+        .annotate(total=Count('id')).values_list('empleado_id', 'total')
+    )
+    for item in totales:
+        item['tardes'] = tardes.get(item['empleado_id'], 0)
+    excel_asistencia = construir_excel_asistencia(registros, empleados, filtros)
+    excel_nomina = construir_excel_nomina(registros, empleados, filtros)
+
+    with transaction.atomic():
+        # Primero el candado de la sucursal: dos cierres simultáneos se forman (en PostgreSQL;
+        # SQLite ya serializa las transacciones que escriben) y el segundo ve el traslape.
+        Sucursal.objects.select_for_update().get(pk=sucursal.pk)
+        if periodos_traslapados(sucursal, fecha_inicio, fecha_fin).exists():
+            raise ValueError("El periodo se traslapa con otro periodo ya cerrado.")
+        periodo = PeriodoCerrado.objects.create(
+            sucursal=sucursal,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            totales=totales,
+            excel_asistencia=excel_asistencia,
+            excel_nomina=excel_nomina,
+            cerrado_por=usuario,
+        )
+        # La firma se compara después del insert: en SQLite la transacción ya tiene el candado
+        # de escritura, así que nadie más puede confirmar un cambio entre la comparación y el
+        # commit. Si algún registro cambió mientras se armaba la foto, la foto ya no cuadra.
+        if firma_registros(registros) != firma:
+            raise ValueError("Los registros del periodo cambiaron mientras se cerraba; vuelve a intentarlo.")
+    return periodo
+
+
+def periodos_traslapados(sucursal, fecha_inicio, fecha_fin):
+    return PeriodoCerrado.objects.filter(sucursal=sucursal, fecha_inicio__lte=fecha_fin, fecha_fin__gte=fecha_inicio)
+
+
+def firma_registros(registros):
+    """
+    (id, modificado) de cada registro: cambia si alguno se crea, edita, mueve o elimina.
+    """
+    return set(registros.order_by().values_list('id', 'modificado'))
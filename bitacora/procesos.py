@@ -0,0 +1,13 @@
+"""
+Arranque de Django en los procesos hijos de las exportaciones en segundo plano.
+
+Este módulo no importa modelos a propósito: el pool ('spawn') lo carga en el proceso
+hijo antes de que Django esté configurado, y su inicializador es el que lo configura.
+"""
+import os
+
+
+def iniciar_django(modulo_settings):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', modulo_settings)
+    import django
+    django.setup()
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+from .models import Empleado, RegistroAsistencia, HorarioDia, RegistroEliminado
+from .cache import invalidar_cache_asistencia
+from .periodos import verificar_registro_editable
+
+# Cualquier escaneo, edición de horario o cambio de empleado vuelve viejos los reportes cacheados
+
+# Solo se invalida la sucursal afectada, así los reportes de las demás siguen en cache.
+# La invalidación espera al commit de la transacción en curso (ver invalidar_cache_asistencia).
+
+@receiver(post_save, sender=RegistroAsistencia)
+@receiver(post_delete, sender=RegistroAsistencia)
+def invalidar_reportes(sender, instance, **kwargs):
+    invalidar_cache_asistencia(instance.sucursal_id)
+
+
+@receiver(post_save, sender=Empleado)
+@receiver(post_delete, sender=Empleado)
+def invalidar_reportes_empleado(sender, instance, **kwargs):
+    # Un empleado puede cambiar de sucursal: invalidamos todas (las ediciones son raras)
+    invalidar_cache_asistencia()
+
+
+@receiver(post_save, sender=HorarioDia)
+@receiver(post_delete, sender=HorarioDia)
+def invalidar_reportes_horario(sender, instance, **kwargs):
+    sucursal_id = Empleado.objects.filter(id=instance.empleado_id).values_list('sucursal_id', flat=True).first()
+    invalidar_cache_asistencia(sucursal_id)
+
+
+@receiver(post_delete, sender=RegistroAsistencia)
+def registrar_lapida(sender, instance, **kwargs):
+    # La lápida permite que las exportaciones incrementales informen el borrado
+    RegistroEliminado.objects.create(
+        registro_id=instance.id,
+        empleado_id=instance.empleado_id,
+        sucursal_id=instance.sucursal_id,
+    )
+
+
+@receiver(pre_save, sender=RegistroAsistencia)
+@receiver(pre_delete, sender=RegistroAsistencia)
+def proteger_periodo_cerrado(sender, instance, **kwargs):
+    # Los números de un periodo cerrado (ya pagado) no deben cambiar
+    verificar_registro_editable(instance)
+
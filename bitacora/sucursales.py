@@ -0,0 +1,92 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+from .models import Sucursal
+
+# Cada sesión (panel o kiosko de escaneo) trabaja sobre una sola sucursal, guardada en la sesión.
+# Las vistas la leen de request.sucursal y filtran por ella antes que por cualquier otra cosa.
+# Las vistas async usan `await request.asucursal()` (igual que request.auser()), que la lee
+# con el ORM async y la deja en request.sucursal para las plantillas.
+
+CLAVE_SESION_SUCURSAL = 'sucursal_id'
+
+
+def obtener_sucursal(request):
+    """
+    Devuelve la sucursal de la sesión. Si no hay una (o ya no existe), usa la primera
+    y la deja guardada en la sesión.
+    """
+    sucursal_id = request.session.get(CLAVE_SESION_SUCURSAL)
+    sucursal = Sucursal.objects.filter(id=sucursal_id).first() if sucursal_id else None
+    if sucursal is None:
+        sucursal = Sucursal.objects.order_by('id').first()
+        if sucursal is None:
+            sucursal = Sucursal.objects.create(nombre='Principal')
+        request.session[CLAVE_SESION_SUCURSAL] = sucursal.id
+    return sucursal
+
+
+async def aobtener_sucursal(request):
+    """
+    Versión async de obtener_sucursal.
+    """
+    sucursal_id = await request.session.aget(CLAVE_SESION_SUCURSAL)
+    sucursal = await Sucursal.objects.filter(id=sucursal_id).afirst() if sucursal_id else None
+    if sucursal is None:
+        sucursal = await Sucursal.objects.order_by('id').afirst()
+        if sucursal is None:
+            sucursal = await Sucursal.objects.acreate(nombre='Principal')
+        await request.session.aset(CLAVE_SESION_SUCURSAL, sucursal.id)
+    return sucursal
+
+
+def asignar_sucursal(request, obtener, aobtener):
+    """
+    Deja en la petición request.sucursal (perezosa) y request.asucursal() (async).
+    """
+    async def asucursal():
+        request.sucursal = await aobtener()
+        return request.sucursal
+
+    request.sucursal = SimpleLazyObject(obtener)
+    request.asucursal = asucursal
+
+
+def cambiar_sucursal(request, sucursal):
+    request.session[CLAVE_SESION_SUCURSAL] = sucursal.id
+    request.sucursal = sucursal
+
+
+class SucursalMiddleware:
+    """
+    Agrega request.sucursal (perezosa: solo consulta la BD si la vista la usa) y
+    request.asucursal(). Va después de SessionMiddleware. Funciona con WSGI y con ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        asignar_sucursal(request, lambda: obtener_sucursal(request), lambda: aobtener_sucursal(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        asignar_sucursal(request, lambda: obtener_sucursal(request), lambda: aobtener_sucursal(request))
+        return await self.get_response(request)
+
+
+def sucursales(request):
+    """
+    Context processor: sucursal actual y lista de sucursales para el selector del menú.
+    """
+    if not getattr(request, 'user', None) or not request.user.is_authenticated:
+        return {}
+    return {
+        'sucursal_actual': request.sucursal,
+        'sucursales': SimpleLazyObject(lambda: list(Sucursal.objects.all())),
+    }
@@ -1,3 +1,1597 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+from io import StringIO
+import tempfile
+import threading
+import time as reloj
+import warnings
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from .cache import invalidar_cache_asistencia, obtener_o_calcular, obtener_version_asistencia
+from .escaneos import aplicar_escaneo, registrar_entrada
+from .analitica import calcular_puntualidad, calcular_series
+from .horarios import calcular_horas
+from .exportar import MODO_ASISTENCIA, MODO_NOMINA, obtener_excel
+from . import antirrebote, busqueda, diario, masivo, nomina, trabajos
+from .filtros import empleado_filtrado, empleados_para_resumen, filtrar_registros
+from .flujos import TAMANO_BLOQUE_ARCHIVO
+from .models import Ausencia, AvanceDiario, DispositivoKiosko, Empleado, HorarioDia, PeriodoCerrado, RegistroAsistencia, RegistroEliminado, Sucursal, TrabajoExportacion
+from .periodos import RegistroBloqueado, cerrar_periodo
+from .kiosko import emitir_token, revocar_dispositivo
+from .sucursales import CLAVE_SESION_SUCURSAL
 
-# Create your tests here.
+# Las pruebas corren con la base de datos configurada. Las que dependen de PostgreSQL
+# (savepoints dentro de una transacción, escrituras concurrentes, índices BRIN/parciales) se saltan en SQLite:
+#   DB_ENGINE=postgresql python manage.py test bitacora
+
+solo_postgresql = skipUnless(connection.vendor == 'postgresql', "Requiere DB_ENGINE=postgresql")
+
+
+def momento_local(dia, hora, minuto=0):
+    return datetime.combine(dia, time(hora, minuto), tzinfo=timezone.get_current_timezone())
+
+
+def crear_empleado(sucursal, nombre='Juan', hora_entrada=time(9), hora_salida=time(17)):
+    return Empleado.objects.create(
+        nombre=nombre, apellido='Prueba', sucursal=sucursal,
+        hora_entrada_supuesta=hora_entrada, hora_salida_supuesta=hora_salida,
+    )
+
+
+def crear_registro(empleado, dia, hora_entrada=9, hora_salida=17, **campos):
+    return RegistroAsistencia.objects.create(
+        empleado=empleado, sucursal=empleado.sucursal,
+        fecha_hora_entrada=momento_local(dia, hora_entrada),
+        fecha_hora_salida=momento_local(dia, hora_salida) if hora_salida is not None else None,
+        **campos,
+    )
+
+
+def crear_periodo_cerrado(sucursal, fecha_inicio, fecha_fin):
+    return PeriodoCerrado.objects.create(
+        sucursal=sucursal, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+        totales=[], excel_asistencia=b'', excel_nomina=b'',
+    )
+
+
+def cliente_del_panel(usuario, sucursal):
+    """
+    Cliente con sesión iniciada y la sucursal elegida en el panel.
+    """
+    cliente = Client()
+    cliente.force_login(usuario)
+    sesion = cliente.session
+    sesion[CLAVE_SESION_SUCURSAL] = sucursal.id
+    sesion.save()
+    return cliente
+
+
+def token_kiosko(sucursal, nombre='Caja 1'):
+    return emitir_token(DispositivoKiosko.objects.create(sucursal=sucursal, nombre=nombre))
+
+
+class DatosAsistencia:
+    """
+    Sucursal y empleado de prueba, con la cache limpia (versiones de reportes).
+    """
+    dia = date(2026, 3, 2)
+
+    def setUp(self):
+        cache.clear()
+        self.sucursal = Sucursal.objects.create(nombre='Pruebas')
+        self.empleado = crear_empleado(self.sucursal)
+
+
+# --- Entradas únicas por día (restricción empleado + fecha_jornada) ---
+
+class RegistrarEntradaTests(DatosAsistencia, TestCase):
+
+    def test_segunda_entrada_del_dia_devuelve_none(self):
+        primera = registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+        segunda = registrar_entrada(self.empleado, momento_local(self.dia, 9, 5), True)
+
+        self.assertIsNotNone(primera)
+        self.assertIsNone(segunda)
+        registro = RegistroAsistencia.objects.get(empleado=self.empleado)
+        self.assertEqual(registro.pk, primera.pk)
+        self.assertEqual(registro.fecha_jornada, self.dia)
+        self.assertFalse(registro.llego_tarde)
+
+    def test_entrada_invalida_la_cache_de_reportes_al_confirmar(self):
+        antes = obtener_version_asistencia(self.sucursal.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            registro = registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+            # Mientras la transacción no se confirma, los reportes siguen con la versión anterior
+            self.assertEqual(obtener_version_asistencia(self.sucursal.id), antes)
+        self.assertIsNotNone(registro)
+        self.assertNotEqual(obtener_version_asistencia(self.sucursal.id), antes)
+
+    def test_entrada_repetida_no_invalida_la_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+        antes = obtener_version_asistencia(self.sucursal.id)
+        with self.captureOnCommitCallbacks(execute=True) as pendientes:
+            self.assertIsNone(registrar_entrada(self.empleado, momento_local(self.dia, 10), False))
+        self.assertEqual(pendientes, [])
+        self.assertEqual(obtener_version_asistencia(self.sucursal.id), antes)
+
+    def test_entrada_en_periodo_cerrado_se_rechaza(self):
+        crear_periodo_cerrado(self.sucursal, self.dia, self.dia)
+        with self.assertRaises(RegistroBloqueado):
+            registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+        self.assertFalse(RegistroAsistencia.objects.exists())
+
+    @solo_postgresql
+    def test_entrada_repetida_no_aborta_la_transaccion(self):
+        # En PostgreSQL un error aborta la transacción entera; el savepoint de save() lo evita
+        with transaction.atomic():
+            registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+            self.assertIsNone(registrar_entrada(self.empleado, momento_local(self.dia, 10), False))
+            self.assertEqual(RegistroAsistencia.objects.filter(empleado=self.empleado).count(), 1)
+
+    def test_otro_error_de_integridad_no_se_confunde_con_entrada_repetida(self):
+        with mock.patch.object(RegistroAsistencia, 'save', side_effect=IntegrityError('otra restricción')):
+            with self.assertRaises(IntegrityError):
+                registrar_entrada(self.empleado, momento_local(self.dia, 9), False)
+
+
+class DuplicadosLegadosTests(DatosAsistencia, TestCase):
+    """
+    Entradas repetidas del mismo día que ya existían antes de la restricción: la migración
+    0013 les dejó fecha_jornada en nulo y así deben quedarse.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.original = crear_registro(self.empleado, self.dia, 9, 13)
+        self.duplicado = crear_registro(self.empleado, self.dia + timedelta(days=1), 15, None)
+        RegistroAsistencia.objects.filter(pk=self.duplicado.pk).update(
+            fecha_hora_entrada=momento_local(self.dia, 15), fecha_jornada=None,
+        )
+        self.duplicado.refresh_from_db()
+
+    def test_salida_del_kiosko_sobre_un_duplicado(self):
+        mensaje, es_error = aplicar_escaneo(self.empleado, 'salida', momento_local(self.dia, 19), 10)
+
+        self.assertFalse(es_error, mensaje)
+        self.duplicado.refresh_from_db()
+        self.assertEqual(self.duplicado.fecha_hora_salida, momento_local(self.dia, 19))
+        self.assertIsNone(self.duplicado.fecha_jornada)
+
+    def test_editar_un_duplicado_no_le_pone_fecha(self):
+        self.duplicado.notas = 'Revisado'
+        self.duplicado.save()
+        self.duplicado.refresh_from_db()
+        self.assertIsNone(self.duplicado.fecha_jornada)
+
+    def test_desplazar_duplicados_los_deja_sin_fecha(self):
+        resultado = masivo.desplazar_registros(self.sucursal.id, {self.original.id, self.duplicado.id}, 30, 'ambas')
+
+        self.assertEqual(resultado['procesados'], 2)
+        self.original.refresh_from_db()
+        self.duplicado.refresh_from_db()
+        self.assertEqual(self.original.fecha_jornada, self.dia)
+        self.assertIsNone(self.duplicado.fecha_jornada)
+        self.assertEqual(self.duplicado.fecha_hora_entrada, momento_local(self.dia, 15, 30))
+
+
+@solo_postgresql
+class EntradasConcurrentesTests(DatosAsistencia, TransactionTestCase):
+    """
+    Varios kioskos escanean el mismo gafete al mismo tiempo: solo una entrada se guarda.
+    """
+    hilos = 8
+
+    def test_solo_una_entrada_gana(self):
+        barrera = threading.Barrier(self.hilos)
+        resultados = []
+        errores = []
+
+        def escanear(minuto):
+            try:
+                barrera.wait()
+                resultados.append(registrar_entrada(self.empleado, momento_local(self.dia, 9, minuto), False))
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=escanear, args=(minuto,)) for minuto in range(self.hilos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        guardados = [registro for registro in resultados if registro is not None]
+        self.assertEqual(len(guardados), 1)
+        self.assertEqual(resultados.count(None), self.hilos - 1)
+        self.assertEqual(RegistroAsistencia.objects.get().pk, guardados[0].pk)
+
+
+# --- Migraciones 0013 (fecha_jornada) y 0014 (índices de PostgreSQL) ---
+
+class MigracionesFechaJornadaTests(TransactionTestCase):
+    antes = [('bitacora', '0012_periodocerrado')]
+    despues = [('bitacora', '0014_indices_postgresql')]
+
+    def migrar(self, destino):
+        executor = MigrationExecutor(connection)
+        executor.migrate(destino)
+        return executor.loader.project_state(destino).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('bitacora'))
+
+    def indices(self):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, RegistroAsistencia._meta.db_table))
+
+    def test_llenado_de_fecha_jornada_y_restriccion(self):
+        apps = self.migrar(self.antes)
+        Sucursal0012 = apps.get_model('bitacora', 'Sucursal')
+        Empleado0012 = apps.get_model('bitacora', 'Empleado')
+        Registro0012 = apps.get_model('bitacora', 'RegistroAsistencia')
+        sucursal = Sucursal0012.objects.create(nombre='Migración')
+        empleado = Empleado0012.objects.create(
+            nombre='Ana', apellido='Prueba', sucursal=sucursal,
+            hora_entrada_supuesta=time(9), hora_salida_supuesta=time(17),
+        )
+        dia = date(2026, 3, 2)
+        primera = Registro0012.objects.create(empleado=empleado, sucursal=sucursal, fecha_hora_entrada=momento_local(dia, 9))
+        repetida = Registro0012.objects.create(empleado=empleado, sucursal=sucursal, fecha_hora_entrada=momento_local(dia, 14))
+        # 23:30 hora local ya es el día siguiente en UTC: cuenta la fecha local
+        noche = Registro0012.objects.create(empleado=empleado, sucursal=sucursal, fecha_hora_entrada=momento_local(date(2026, 3, 3), 23, 30))
+
+        self.migrar(self.despues)
+
+        fechas = dict(RegistroAsistencia.objects.values_list('id', 'fecha_jornada'))
+        self.assertEqual(fechas[primera.id], dia)
+        self.assertIsNone(fechas[repetida.id])
+        self.assertEqual(fechas[noche.id], date(2026, 3, 3))
+        self.assertIn('asistencia_una_entrada_dia', self.indices())
+
+        self.migrar(self.antes)
+        self.assertNotIn('asistencia_una_entrada_dia', self.indices())
+        columnas = [columna.name for columna in connection.introspection.get_table_description(
+            connection.cursor(), RegistroAsistencia._meta.db_table)]
+        self.assertNotIn('fecha_jornada', columnas)
+
+    @solo_postgresql
+    def test_indices_de_postgresql(self):
+        self.migrar(self.despues)
+        self.assertTrue({'asistencia_entrada_brin', 'asistencia_tarde_idx'} <= self.indices())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'asistencia_tarde_idx'")
+            self.assertIn('WHERE llego_tarde', cursor.fetchone()[0])
+
+        self.migrar([('bitacora', '0013_fecha_jornada')])
+        self.assertFalse({'asistencia_entrada_brin', 'asistencia_tarde_idx'} & self.indices())
+
+
+# --- Aislamiento entre sucursales ---
+
+class AislamientoSucursalesTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.otra = Sucursal.objects.create(nombre='Otra')
+        self.ajeno = crear_empleado(self.otra, 'Ana')
+        self.registro = crear_registro(self.empleado, self.dia)
+        self.registro_ajeno = crear_registro(self.ajeno, self.dia)
+        self.admin = User.objects.create_user('admin', password='x')
+        self.panel = cliente_del_panel(self.admin, self.sucursal)
+
+    def filtros(self, sucursal, empleado_id=None):
+        return {'sucursal_id': sucursal.id, 'empleado_id': empleado_id, 'fecha_inicio': None, 'fecha_fin': None}
+
+    def test_filtros_no_cruzan_sucursales(self):
+        registros = RegistroAsistencia.objects.all()
+
+        self.assertEqual(list(filtrar_registros(registros, self.filtros(self.sucursal))), [self.registro])
+        # Filtrar por un empleado de otra sucursal no deja ver sus registros
+        self.assertFalse(filtrar_registros(registros, self.filtros(self.sucursal, self.ajeno.id)).exists())
+        self.assertFalse(empleado_filtrado(self.filtros(self.sucursal, self.ajeno.id)).exists())
+        self.assertFalse(empleados_para_resumen(registros, self.filtros(self.sucursal, self.ajeno.id)).exists())
+
+        filtros = self.filtros(self.sucursal)
+        self.assertEqual(list(empleados_para_resumen(filtrar_registros(registros, filtros), filtros)), [self.empleado])
+
+    def test_empleado_que_cambio_de_sucursal_sigue_en_el_resumen(self):
+        self.empleado.sucursal = self.otra
+        self.empleado.save()
+        filtros = self.filtros(self.sucursal)
+
+        self.assertEqual(list(empleados_para_resumen(filtrar_registros(RegistroAsistencia.objects.all(), filtros), filtros)), [self.empleado])
+
+    def test_panel_solo_muestra_la_sucursal_de_la_sesion(self):
+        empleados = self.panel.get(reverse('bitacora:panel_empleados')).context['empleados_activos']
+        self.assertEqual(list(empleados), [self.empleado])
+
+        reporte = self.panel.get(reverse('bitacora:reportes'))
+        self.assertEqual(reporte.context['registros'], [self.registro])
+        reporte = self.panel.get(reverse('bitacora:reportes'), {'empleado_id': self.ajeno.id})
+        self.assertEqual(reporte.context['registros'], [])
+        self.assertIsNone(reporte.context['empleado_filtrado'])
+
+    def test_cambiar_de_sucursal_no_reusa_la_cache_de_la_otra(self):
+        self.assertEqual(self.panel.get(reverse('bitacora:reportes')).context['registros'], [self.registro])
+
+        self.panel.post(reverse('bitacora:cambiar_sucursal'), {'sucursal_id': self.otra.id})
+
+        self.assertEqual(self.panel.get(reverse('bitacora:reportes')).context['registros'], [self.registro_ajeno])
+        self.assertEqual(list(self.panel.get(reverse('bitacora:panel_empleados')).context['empleados_activos']), [self.ajeno])
+
+    def test_no_se_modifican_datos_de_otra_sucursal(self):
+        for nombre, argumento in (
+            ('bitacora:desactivar_empleado', self.ajeno.id),
+            ('bitacora:editar_empleado', self.ajeno.id),
+            ('bitacora:eliminar_registro', self.registro_ajeno.id),
+        ):
+            self.assertEqual(self.panel.post(reverse(nombre, args=[argumento])).status_code, 404)
+        self.assertEqual(self.panel.get(reverse('bitacora:editar_empleado', args=[self.ajeno.id])).status_code, 404)
+
+        self.ajeno.refresh_from_db()
+        self.assertTrue(self.ajeno.is_active)
+        self.assertTrue(RegistroAsistencia.objects.filter(id=self.registro_ajeno.id).exists())
+
+    def test_sesion_sin_sucursal_usa_la_primera(self):
+        cliente = Client()
+        cliente.force_login(self.admin)
+
+        cliente.get(reverse('bitacora:panel_empleados'))
+
+        self.assertEqual(cliente.session[CLAVE_SESION_SUCURSAL], Sucursal.objects.order_by('id').first().id)
+
+
+# --- Búsqueda de empleados ---
+
+class BusquedaEmpleadosTests(TestCase):
+
+    def setUp(self):
+        sucursal = Sucursal.objects.create(nombre='Pruebas')
+        self.jose = Empleado.objects.create(
+            nombre='José', apellido='Núñez', puesto='Cajero', email='jose.nunez@ejemplo.mx', sucursal=sucursal,
+            hora_entrada_supuesta=time(9), hora_salida_supuesta=time(17),
+        )
+        self.ana = Empleado.objects.create(
+            nombre='Ana María', apellido='López', puesto='Gerente de piso', sucursal=sucursal,
+            hora_entrada_supuesta=time(9), hora_salida_supuesta=time(17),
+        )
+
+    def buscar(self, texto):
+        return set(busqueda.buscar_empleados(texto).values_list('id', flat=True))
+
+    def comprobar_busquedas(self):
+        # Sin acentos ni mayúsculas, por prefijo de palabra y con todos los términos
+        self.assertEqual(self.buscar('jose'), {self.jose.id})
+        self.assertEqual(self.buscar('NUÑ'), {self.jose.id})
+        self.assertEqual(self.buscar('maria lop'), {self.ana.id})
+        self.assertEqual(self.buscar('ana cajero'), set())
+        # El email se corta en palabras; un término a media palabra no coincide
+        self.assertEqual(self.buscar('ejemplo'), {self.jose.id})
+        self.assertEqual(self.buscar('uñez'), set())
+        self.assertEqual(self.buscar('piso'), {self.ana.id})
+        # Sin términos (solo puntuación) no se filtra
+        self.assertEqual(self.buscar(' .- '), {self.jose.id, self.ana.id})
+
+    @skipUnless(connection.vendor == 'sqlite', "El índice FTS5 solo existe en SQLite")
+    def test_indice_fts(self):
+        self.assertTrue(busqueda.fts_disponible())
+        self.comprobar_busquedas()
+        # Los triggers mantienen el índice al editar
+        self.ana.apellido = 'Pérez'
+        self.ana.save()
+        self.assertEqual(self.buscar('perez'), {self.ana.id})
+        self.assertEqual(self.buscar('lopez'), set())
+
+    def test_columna_normalizada(self):
+        self.assertEqual(self.jose.busqueda, 'jose nunez cajero jose nunez ejemplo mx')
+        with mock.patch.object(busqueda, 'fts_disponible', return_value=False):
+            self.comprobar_busquedas()
+
+
+# --- Cierre de periodos de pago ---
+
+class CierrePeriodoTests(DatosAsistencia, TestCase):
+    dia = date(2026, 3, 2)
+    fin = date(2026, 3, 8)
+
+    def setUp(self):
+        super().setUp()
+        self.registros = [
+            RegistroAsistencia.objects.create(
+                empleado=self.empleado, sucursal=self.sucursal,
+                fecha_hora_entrada=momento_local(self.dia + timedelta(days=d), 9, 20 if d == 1 else 0),
+                fecha_hora_salida=momento_local(self.dia + timedelta(days=d), 17),
+                llego_tarde=d == 1,
+            )
+            for d in range(3)
+        ]
+        # Fuera del periodo: sigue editable
+        self.libre = RegistroAsistencia.objects.create(
+            empleado=self.empleado, sucursal=self.sucursal,
+            fecha_hora_entrada=momento_local(self.fin + timedelta(days=1), 9),
+            fecha_hora_salida=momento_local(self.fin + timedelta(days=1), 17),
+        )
+
+    def filtros(self, **cambios):
+        return {'sucursal_id': self.sucursal.id, 'empleado_id': None, 'fecha_inicio': self.dia, 'fecha_fin': self.fin, **cambios}
+
+    def test_cierre_guarda_totales_y_excel(self):
+        periodo = cerrar_periodo(self.sucursal, self.dia, self.fin)
+
+        [total] = periodo.totales
+        self.assertEqual(total['empleado_id'], self.empleado.id)
+        self.assertEqual(total['dias'], 3)
+        self.assertEqual(total['segundos_reales'], 3 * 8 * 3600 - 20 * 60)
+        self.assertEqual(total['tardes'], 1)
+        self.assertTrue(bytes(periodo.excel_asistencia).startswith(b'PK'))
+        self.assertTrue(bytes(periodo.excel_nomina).startswith(b'PK'))
+
+    def test_registros_del_periodo_quedan_bloqueados(self):
+        cerrar_periodo(self.sucursal, self.dia, self.fin)
+        registro = self.registros[0]
+
+        registro.llego_tarde = True
+        with self.assertRaises(RegistroBloqueado):
+            registro.save()
+        # delete() corre en un atomic sin savepoint: el error marca la transacción de la prueba
+        with self.assertRaises(RegistroBloqueado), transaction.atomic():
+            registro.delete()
+        # Tampoco se puede mover un registro de fuera hacia dentro del periodo
+        self.libre.fecha_hora_entrada = momento_local(self.fin, 9)
+        with self.assertRaises(RegistroBloqueado):
+            self.libre.save()
+
+        self.libre.refresh_from_db()
+        self.libre.llego_tarde = True
+        self.libre.save()
+
+    def test_periodo_cerrado_por_otro_worker_bloquea_de_inmediato(self):
+        registro = self.registros[0]
+        registro.llego_tarde = True
+        registro.save()
+        # bulk_create no manda señales: así se ve en este proceso un cierre hecho en otro worker
+        PeriodoCerrado.objects.bulk_create([PeriodoCerrado(
+            sucursal=self.sucursal, fecha_inicio=self.dia, fecha_fin=self.fin,
+            totales=[], excel_asistencia=b'', excel_nomina=b'',
+        )])
+
+        registro.llego_tarde = False
+        with self.assertRaises(RegistroBloqueado):
+            registro.save()
+
+    def test_validaciones_del_cierre(self):
+        with self.assertRaisesMessage(ValueError, "ya terminaron"):
+            cerrar_periodo(self.sucursal, self.dia, timezone.localdate())
+
+        abierto = self.registros[2]
+        abierto.fecha_hora_salida = None
+        abierto.save()
+        with self.assertRaisesMessage(ValueError, "turnos abiertos"):
+            cerrar_periodo(self.sucursal, self.dia, self.fin)
+
+        abierto.fecha_hora_salida = momento_local(self.dia + timedelta(days=2), 17)
+        abierto.save()
+        cerrar_periodo(self.sucursal, self.dia, self.fin)
+        with self.assertRaisesMessage(ValueError, "se traslapa"):
+            cerrar_periodo(self.sucursal, self.fin, self.fin + timedelta(days=1))
+
+    def test_cambio_durante_el_cierre_lo_cancela(self):
+        from . import exportar
+        original = exportar.construir_excel_nomina
+
+        def construir_y_editar(*args, **kwargs):
+            # Una edición que llega mientras se arma la foto
+            RegistroAsistencia.objects.filter(pk=self.registros[0].pk).update(llego_tarde=True, modificado=timezone.now())
+            return original(*args, **kwargs)
+
+        with mock.patch.object(exportar, 'construir_excel_nomina', construir_y_editar):
+            with self.assertRaisesMessage(ValueError, "cambiaron mientras se cerraba"):
+                cerrar_periodo(self.sucursal, self.dia, self.fin)
+        self.assertFalse(PeriodoCerrado.objects.exists())
+
+    def test_borrado_durante_el_cierre_lo_cancela(self):
+        from . import exportar
+        original = exportar.construir_excel_asistencia
+
+        def construir_y_borrar(*args, **kwargs):
+            contenido = original(*args, **kwargs)
+            borrar = RegistroAsistencia.objects.filter(pk=self.registros[1].pk)
+            borrar._raw_delete(borrar.db)
+            return contenido
+
+        with mock.patch.object(exportar, 'construir_excel_asistencia', construir_y_borrar):
+            with self.assertRaisesMessage(ValueError, "cambiaron mientras se cerraba"):
+                cerrar_periodo(self.sucursal, self.dia, self.fin)
+
+    def test_reporte_y_excel_salen_de_la_foto(self):
+        periodo = cerrar_periodo(self.sucursal, self.dia, self.fin)
+        PeriodoCerrado.objects.filter(pk=periodo.pk).update(
+            totales=[{**periodo.totales[0], 'horas_str': 'de la foto'}],
+            excel_asistencia=b'foto-asistencia', excel_nomina=b'foto-nomina',
+        )
+
+        self.assertEqual(obtener_excel(self.filtros(), MODO_ASISTENCIA), b'foto-asistencia')
+        self.assertEqual(obtener_excel(self.filtros(), MODO_NOMINA), b'foto-nomina')
+        # Otro rango (o un solo empleado) se calcula con los registros
+        self.assertNotEqual(obtener_excel(self.filtros(fecha_fin=self.fin - timedelta(days=1))), b'foto-asistencia')
+        self.assertNotEqual(obtener_excel(self.filtros(empleado_id=self.empleado.id)), b'foto-asistencia')
+
+        User.objects.create_user('admin', password='x')
+        cliente = Client()
+        cliente.login(username='admin', password='x')
+        sesion = cliente.session
+        sesion[CLAVE_SESION_SUCURSAL] = self.sucursal.id
+        sesion.save()
+        respuesta = cliente.get('/panel/reportes/', {'fecha_inicio': self.dia.isoformat(), 'fecha_fin': self.fin.isoformat(), 'ver_horas': 'on'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['periodo_cerrado'].pk, periodo.pk)
+        self.assertEqual(respuesta.context['resumen_horas'][0]['horas_str'], 'de la foto')
+
+
+@solo_postgresql
+class CierresConcurrentesTests(DatosAsistencia, TransactionTestCase):
+
+    def test_dos_cierres_del_mismo_periodo(self):
+        RegistroAsistencia.objects.create(
+            empleado=self.empleado, sucursal=self.sucursal,
+            fecha_hora_entrada=momento_local(self.dia, 9), fecha_hora_salida=momento_local(self.dia, 17),
+        )
+        barrera = threading.Barrier(2)
+        resultados = []
+
+        def cerrar():
+            try:
+                barrera.wait()
+                resultados.append(cerrar_periodo(self.sucursal, self.dia, self.dia + timedelta(days=6)))
+            except ValueError as e:
+                resultados.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=cerrar) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(PeriodoCerrado.objects.count(), 1)
+        self.assertEqual(sum(isinstance(resultado, ValueError) for resultado in resultados), 1)
+
+
+class CierreSinTransaccionLargaTests(DatosAsistencia, TransactionTestCase):
+
+    def test_excel_se_arma_fuera_de_la_transaccion(self):
+        from . import exportar
+        original = exportar.construir_excel_asistencia
+        en_transaccion = []
+
+        def construir(*args, **kwargs):
+            en_transaccion.append(connection.in_atomic_block)
+            return original(*args, **kwargs)
+
+        RegistroAsistencia.objects.create(
+            empleado=self.empleado, sucursal=self.sucursal,
+            fecha_hora_entrada=momento_local(self.dia, 9), fecha_hora_salida=momento_local(self.dia, 17),
+        )
+        with mock.patch.object(exportar, 'construir_excel_asistencia', construir):
+            cerrar_periodo(self.sucursal, self.dia, self.dia)
+
+        self.assertEqual(en_transaccion, [False])
+        self.assertEqual(PeriodoCerrado.objects.count(), 1)
+
+
+# --- Acciones masivas ---
+
+class AccionesMasivasTests(DatosAsistencia, TestCase):
+    cerrado = date(2026, 3, 1)
+
+    def setUp(self):
+        super().setUp()
+        # Un registro por día del 1 al 4 de marzo, de 20:00 a 23:00; el día 1 queda en un periodo cerrado
+        self.registros = [
+            RegistroAsistencia.objects.create(
+                empleado=self.empleado, sucursal=self.sucursal,
+                fecha_hora_entrada=momento_local(self.cerrado + timedelta(days=d), 20),
+                fecha_hora_salida=momento_local(self.cerrado + timedelta(days=d), 23),
+                llego_tarde=True,
+            )
+            for d in range(4)
+        ]
+        crear_periodo_cerrado(self.sucursal, self.cerrado, self.cerrado)
+        self.ids = {registro.id for registro in self.registros}
+        self.otra = Sucursal.objects.create(nombre='Otra')
+        self.ajeno = RegistroAsistencia.objects.create(
+            empleado=crear_empleado(self.otra, 'Luis'), sucursal=self.otra,
+            fecha_hora_entrada=momento_local(self.dia, 9), fecha_hora_salida=momento_local(self.dia, 17),
+        )
+
+    def test_eliminar_omite_periodo_cerrado_y_deja_lapidas(self):
+        antes = obtener_version_asistencia(self.sucursal.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = masivo.eliminar_registros(self.sucursal.id, self.ids | {self.ajeno.id})
+
+        self.assertEqual((resultado['solicitados'], resultado['procesados'], resultado['omitidos']), (5, 3, 2))
+        self.assertEqual(set(RegistroAsistencia.objects.values_list('id', flat=True)), {self.registros[0].id, self.ajeno.id})
+        self.assertEqual(
+            set(RegistroEliminado.objects.values_list('registro_id', 'empleado_id', 'sucursal_id')),
+            {(registro.id, self.empleado.id, self.sucursal.id) for registro in self.registros[1:]},
+        )
+        self.assertNotEqual(obtener_version_asistencia(self.sucursal.id), antes)
+
+    def test_desplazar_dias_seguidos_pasando_la_medianoche(self):
+        # 20:00 + 5h = 01:00 del día siguiente: cada registro pasa al día que ocupaba el siguiente
+        resultado = masivo.desplazar_registros(self.sucursal.id, self.ids, 5 * 60, 'ambas')
+
+        self.assertEqual(resultado['procesados'], 3)
+        for registro in self.registros[1:]:
+            registro.refresh_from_db()
+            entrada = timezone.localtime(registro.fecha_hora_entrada)
+            self.assertEqual(entrada.time(), time(1))
+            self.assertEqual(registro.fecha_jornada, entrada.date())
+            self.assertEqual(timezone.localtime(registro.fecha_hora_salida).time(), time(4))
+        self.registros[0].refresh_from_db()
+        self.assertEqual(timezone.localtime(self.registros[0].fecha_hora_entrada).time(), time(20))
+
+    def test_desplazar_recalcula_llego_tarde(self):
+        # Entraban a las 20:00 con horario de 9:00 (tarde); a las 8:50 con tolerancia de 10 minutos ya no
+        resultado = masivo.desplazar_registros(self.sucursal.id, {self.registros[1].id}, -(11 * 60 + 10), 'entrada')
+
+        self.assertEqual(resultado['tardes_recalculados'], 1)
+        self.registros[1].refresh_from_db()
+        self.assertFalse(self.registros[1].llego_tarde)
+
+    def test_desplazar_con_horario_variable_y_dia_libre(self):
+        self.empleado.usa_horario_variable = True
+        self.empleado.save()
+        dia = timezone.localtime(self.registros[2].fecha_hora_entrada).date()
+        HorarioDia.objects.create(empleado=self.empleado, dia_semana=dia.weekday(), es_dia_libre=True)
+
+        masivo.desplazar_registros(self.sucursal.id, {self.registros[2].id}, 10, 'entrada')
+        self.registros[2].refresh_from_db()
+        self.assertFalse(self.registros[2].llego_tarde)
+
+    def test_desplazar_salida_no_toca_llego_tarde(self):
+        resultado = masivo.desplazar_registros(self.sucursal.id, self.ids, 30, 'salida')
+        self.assertEqual(resultado['tardes_recalculados'], 0)
+        self.assertTrue(all(RegistroAsistencia.objects.filter(id__in=self.ids).values_list('llego_tarde', flat=True)))
+
+    def test_desplazar_a_un_dia_ocupado_no_aplica_nada(self):
+        # Solo se mueve el día 2 a la 1:00 del día 3, que ya tiene entrada
+        with self.assertRaises(masivo.AccionInvalida):
+            masivo.desplazar_registros(self.sucursal.id, {self.registros[1].id}, 5 * 60, 'ambas')
+        self.registros[1].refresh_from_db()
+        self.assertEqual(timezone.localtime(self.registros[1].fecha_hora_entrada).time(), time(20))
+        self.assertEqual(self.registros[1].fecha_jornada, self.cerrado + timedelta(days=1))
+
+    def test_desplazar_no_mete_registros_a_un_periodo_cerrado(self):
+        madrugada = RegistroAsistencia.objects.create(
+            empleado=crear_empleado(self.sucursal, 'Ana'), sucursal=self.sucursal,
+            fecha_hora_entrada=momento_local(self.cerrado + timedelta(days=1), 6),
+            fecha_hora_salida=momento_local(self.cerrado + timedelta(days=1), 8),
+        )
+        # 6:00 - 7h = 23:00 del día cerrado
+        resultado = masivo.desplazar_registros(self.sucursal.id, {madrugada.id}, -7 * 60, 'ambas')
+        self.assertEqual(resultado['procesados'], 0)
+        madrugada.refresh_from_db()
+        self.assertEqual(madrugada.fecha_jornada, self.cerrado + timedelta(days=1))
+
+    def test_desplazar_no_deja_la_salida_antes_de_la_entrada(self):
+        resultado = masivo.desplazar_registros(self.sucursal.id, self.ids, 4 * 60, 'entrada')
+        self.assertEqual(resultado['procesados'], 0)
+
+    def test_marcar_tarde_invierte_fuera_del_periodo_cerrado(self):
+        RegistroAsistencia.objects.filter(pk=self.registros[1].pk).update(llego_tarde=False)
+        resultado = masivo.marcar_tarde(self.sucursal.id, self.ids, masivo.INVERTIR)
+
+        self.assertEqual(resultado['procesados'], 3)
+        tardes = dict(RegistroAsistencia.objects.values_list('id', 'llego_tarde'))
+        self.assertTrue(tardes[self.registros[0].id])
+        self.assertTrue(tardes[self.registros[1].id])
+        self.assertFalse(tardes[self.registros[2].id])
+
+    def test_marcar_tarde_pide_un_valor_explicito(self):
+        for valor in (None, 1, 0, 'true', 'x'):
+            with self.subTest(valor=valor), self.assertRaises(masivo.AccionInvalida):
+                masivo.marcar_tarde(self.sucursal.id, self.ids, valor)
+
+        resultado = masivo.marcar_tarde(self.sucursal.id, self.ids, False)
+        self.assertEqual(resultado['procesados'], 3)
+        self.assertFalse(RegistroAsistencia.objects.filter(id__in=self.ids, llego_tarde=False).filter(id=self.registros[0].id).exists())
+
+    def test_vista_rechaza_marcar_tarde_sin_valor(self):
+        cliente = cliente_del_panel(User.objects.create_user('admin', password='x'), self.sucursal)
+        url = reverse('bitacora:acciones_registros')
+
+        for datos in ({}, {'llego_tarde': None}, {'llego_tarde': 1}):
+            with self.subTest(datos=datos):
+                respuesta = cliente.post(url, {'accion': 'marcar_tarde', 'ids': sorted(self.ids), **datos}, content_type='application/json')
+                self.assertEqual(respuesta.status_code, 400)
+        respuesta = cliente.post(url, {'accion': 'marcar_tarde', 'ids': sorted(self.ids), 'llego_tarde': 'invertir'}, content_type='application/json')
+        self.assertEqual(respuesta.json()['procesados'], 3)
+
+    def test_cambiar_estado_solo_de_la_sucursal(self):
+        ajeno = self.ajeno.empleado
+        resultado = masivo.cambiar_estado_empleados(self.sucursal.id, {self.empleado.id, ajeno.id}, False)
+
+        self.assertEqual((resultado['procesados'], resultado['omitidos']), (1, 1))
+        self.empleado.refresh_from_db()
+        ajeno.refresh_from_db()
+        self.assertFalse(self.empleado.is_active)
+        self.assertTrue(ajeno.is_active)
+
+    def test_peticiones_invalidas(self):
+        for cuerpo in (b'no es json', b'[]', b'{"accion": "borrar", "ids": [1]}', b'{"accion": "eliminar", "ids": []}',
+                       b'{"accion": "eliminar", "ids": ["x"]}', b'{"accion": "eliminar", "ids": [-1]}'):
+            with self.subTest(cuerpo=cuerpo), self.assertRaises(masivo.AccionInvalida):
+                masivo.leer_peticion(cuerpo, masivo.ACCIONES_REGISTROS)
+        with self.assertRaises(masivo.AccionInvalida):
+            masivo.desplazar_registros(self.sucursal.id, self.ids, 0, 'ambas')
+        with self.assertRaises(masivo.AccionInvalida):
+            masivo.desplazar_registros(self.sucursal.id, self.ids, 15, 'otra')
+
+
+# --- Descargas en streaming con ASGI ---
+
+class DescargasAsgiTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        RegistroAsistencia.objects.create(
+            empleado=self.empleado, sucursal=self.sucursal,
+            fecha_hora_entrada=momento_local(self.dia, 9), fecha_hora_salida=momento_local(self.dia, 17),
+        )
+        # La exportación de cambios deja fuera los últimos segundos (CAMBIOS_MARGEN_SEGUNDOS)
+        RegistroAsistencia.objects.update(modificado=timezone.now() - timedelta(hours=1))
+        self.usuario = User.objects.create_user('admin', password='x')
+        cliente = cliente_del_panel(self.usuario, self.sucursal)
+        self.cliente = Client()
+        self.cliente_async = AsyncClient()
+        self.cliente.cookies = self.cliente_async.cookies = cliente.cookies
+
+    async def descargar(self, url, **parametros):
+        # Django avisa (RuntimeWarning/Warning) si tiene que leer un iterador síncrono completo
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            respuesta = await self.cliente_async.get(url, parametros)
+            self.assertTrue(respuesta.is_async)
+            contenido = b''.join([parte async for parte in respuesta.streaming_content])
+        return respuesta, contenido
+
+    def descargar_wsgi(self, url, **parametros):
+        respuesta = self.cliente.get(url, parametros)
+        self.assertFalse(respuesta.is_async)
+        return b''.join(respuesta.streaming_content)
+
+    async def test_cambios_jsonl_y_csv_en_streaming_asincrono(self):
+        for formato in ('jsonl', 'csv'):
+            with self.subTest(formato=formato):
+                respuesta, contenido = await self.descargar('/panel/reportes/cambios/', formato=formato)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertEqual(contenido, await sync_to_async(self.descargar_wsgi)('/panel/reportes/cambios/', formato=formato))
+                self.assertIn(b'Juan', contenido)
+
+    async def test_descarga_de_exportacion_por_bloques(self):
+        datos = os.urandom(3 * TAMANO_BLOQUE_ARCHIVO + 10)
+        with tempfile.TemporaryDirectory() as directorio, self.settings(EXPORTACIONES_DIR=directorio):
+            with open(os.path.join(directorio, 'reporte.xlsx'), 'wb') as archivo:
+                archivo.write(datos)
+            trabajo = await TrabajoExportacion.objects.acreate(
+                usuario=self.usuario, estado=TrabajoExportacion.TERMINADO, archivo='reporte.xlsx',
+                parametros={'modo': MODO_ASISTENCIA},
+            )
+            respuesta, contenido = await self.descargar(f'/panel/reportes/exportar/trabajos/{trabajo.id}/descargar/')
+            await sync_to_async(respuesta.close)()
+
+        self.assertEqual(contenido, datos)
+        self.assertEqual(int(respuesta['Content-Length']), len(datos))
+        self.assertIn('reporte_asistencia.xlsx', respuesta['Content-Disposition'])
+
+
+# --- Exportación incremental (marca de agua y lápidas) ---
+
+class CambiosIncrementalesTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = cliente_del_panel(User.objects.create_user('admin', password='x'), self.sucursal)
+        self.ahora = timezone.now()
+
+    def registro(self, dia, modificado):
+        registro = crear_registro(self.empleado, dia)
+        RegistroAsistencia.objects.filter(pk=registro.pk).update(modificado=modificado)
+        return registro
+
+    def exportar(self, desde=None):
+        parametros = {'formato': 'jsonl'}
+        if desde:
+            parametros['desde'] = desde.isoformat()
+        respuesta = self.cliente.get(reverse('bitacora:exportar_cambios'), parametros)
+        lineas = [json.loads(linea) for linea in b''.join(respuesta.streaming_content).decode().splitlines()]
+        return [(linea['operacion'], linea['id']) for linea in lineas], datetime.fromisoformat(respuesta['X-Marca-Agua'])
+
+    def test_marca_de_agua_deja_fuera_lo_reciente(self):
+        viejo = self.registro(self.dia, self.ahora - timedelta(hours=2))
+        reciente = self.registro(self.dia + timedelta(days=1), self.ahora)
+
+        filas, marca = self.exportar()
+
+        self.assertEqual(filas, [('upsert', viejo.id)])
+        self.assertLess(marca, reciente.modificado)
+        # Lo que quedó fuera por el margen entra en la siguiente exportación
+        with mock.patch.object(timezone, 'now', return_value=self.ahora + timedelta(minutes=1)):
+            filas, _ = self.exportar(marca)
+        self.assertIn(('upsert', reciente.id), filas)
+
+    def test_solape_recupera_confirmaciones_tardias(self):
+        marca = self.ahora - timedelta(hours=1)
+        self.registro(self.dia, marca - timedelta(hours=1))
+        # Guardado antes de la marca pero confirmado después (transacción larga): cae en el solape
+        tardio = self.registro(self.dia + timedelta(days=1), marca - timedelta(minutes=5))
+        nuevo = self.registro(self.dia + timedelta(days=2), marca + timedelta(minutes=5))
+
+        with self.settings(CAMBIOS_SOLAPE_SEGUNDOS=15 * 60):
+            filas, siguiente = self.exportar(marca)
+        self.assertEqual(filas, [('upsert', tardio.id), ('upsert', nuevo.id)])
+        self.assertGreater(siguiente, marca)
+
+        with self.settings(CAMBIOS_SOLAPE_SEGUNDOS=0):
+            filas, _ = self.exportar(marca)
+        self.assertEqual(filas, [('upsert', nuevo.id)])
+
+    def test_lapidas_de_eliminaciones(self):
+        marca = self.ahora - timedelta(hours=1)
+        borrado = self.registro(self.dia, marca - timedelta(hours=2))
+        borrado_id = borrado.id
+        borrado.delete()
+        crear_registro(crear_empleado(Sucursal.objects.create(nombre='Otra'), 'Luis'), self.dia).delete()
+        RegistroEliminado.objects.update(eliminado=self.ahora - timedelta(minutes=30))
+
+        filas, _ = self.exportar(marca)
+
+        # La lápida de la otra sucursal no sale
+        self.assertEqual(filas, [('delete', borrado_id)])
+
+
+# --- Horas programadas vs. reales ---
+
+class CalcularHorasTests(DatosAsistencia, TestCase):
+    # Lunes 2 de marzo de 2026: el empleado de DatosAsistencia trabaja de lunes a viernes, 9 a 17
+    def setUp(self):
+        super().setUp()
+        for d in range(5):
+            crear_registro(self.empleado, self.dia + timedelta(days=d))
+
+    def horas(self, fecha_inicio=None, fecha_fin=None):
+        empleados = Empleado.objects.filter(sucursal=self.sucursal)
+        registros = RegistroAsistencia.objects.filter(sucursal=self.sucursal)
+        return {fila['nombre']: fila for fila in calcular_horas(empleados, registros, fecha_inicio, fecha_fin)}
+
+    def test_sin_rango_cada_empleado_empieza_en_su_primera_entrada(self):
+        nuevo = crear_empleado(self.sucursal, 'Nuevo')
+        crear_registro(nuevo, self.dia + timedelta(days=4))
+
+        horas = self.horas()
+        self.assertEqual(horas['Nuevo Prueba']['segundos_programados'], 8 * 3600)
+        self.assertEqual(horas['Nuevo Prueba']['segundos_faltantes'], 0)
+        self.assertEqual(horas['Juan Prueba']['segundos_programados'], 5 * 8 * 3600)
+
+    def test_con_rango_no_cuenta_dias_antes_de_la_primera_entrada_ni_fines_de_semana(self):
+        # Dos semanas antes de la primera entrada y el fin de semana del 7 y 8 de marzo
+        horas = self.horas(self.dia - timedelta(days=14), self.dia + timedelta(days=6))
+
+        fila = horas['Juan Prueba']
+        self.assertEqual(fila['dias'], 5)
+        self.assertEqual(fila['segundos_programados'], 5 * 8 * 3600)
+        self.assertEqual((fila['segundos_faltantes'], fila['segundos_extra']), (0, 0))
+
+    def test_empleado_sin_entradas_no_aparece(self):
+        crear_empleado(self.sucursal, 'Nunca')
+        self.assertNotIn('Nunca Prueba', self.horas(self.dia, self.dia + timedelta(days=6)))
+
+    def test_horario_general_sin_dias_de_descanso(self):
+        with self.settings(HORARIO_GENERAL_DIAS_DESCANSO=()):
+            fila = self.horas(self.dia, self.dia + timedelta(days=6))['Juan Prueba']
+        self.assertEqual(fila['segundos_programados'], 7 * 8 * 3600)
+        self.assertEqual(fila['segundos_faltantes'], 2 * 8 * 3600)
+
+    def test_horario_variable_usa_sus_dias_libres(self):
+        self.empleado.usa_horario_variable = True
+        self.empleado.save()
+        # Descansa el miércoles (y aun así vino) y trabaja el sábado; el domingo no tiene
+        # horario propio: usa el general, que lo descansa
+        HorarioDia.objects.create(empleado=self.empleado, dia_semana=2, es_dia_libre=True)
+        HorarioDia.objects.create(empleado=self.empleado, dia_semana=5, hora_entrada=time(9), hora_salida=time(13))
+        fila = self.horas(self.dia, self.dia + timedelta(days=6))['Juan Prueba']
+        self.assertEqual(fila['segundos_programados'], 4 * 8 * 3600 + 4 * 3600)
+        self.assertEqual(fila['segundos_extra'], 8 * 3600)
+        self.assertEqual(fila['segundos_faltantes'], 4 * 3600)
+
+
+# --- Proceso nocturno (procesar_jornadas) ---
+
+class ProcesarJornadasTests(DatosAsistencia, TestCase):
+
+    def procesar(self, *args):
+        salida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('procesar_jornadas', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_cierra_turno_olvidado_a_su_salida_programada(self):
+        olvidado = crear_registro(self.empleado, self.dia, hora_salida=None)
+
+        self.procesar('--fecha', f'{self.dia:%Y-%m-%d}')
+
+        olvidado.refresh_from_db()
+        self.assertEqual(olvidado.fecha_hora_salida, momento_local(self.dia, 17))
+        self.assertTrue(olvidado.requiere_revision)
+        self.assertIn("Salida cerrada automáticamente", olvidado.notas)
+
+    def test_solo_marcar_no_cierra(self):
+        olvidado = crear_registro(self.empleado, self.dia, hora_salida=None)
+
+        self.procesar('--fecha', f'{self.dia:%Y-%m-%d}', '--solo-marcar')
+
+        olvidado.refresh_from_db()
+        self.assertIsNone(olvidado.fecha_hora_salida)
+        self.assertTrue(olvidado.requiere_revision)
+
+    def test_no_toca_turnos_de_periodos_cerrados(self):
+        cerrado = crear_registro(self.empleado, self.dia, hora_salida=None)
+        crear_periodo_cerrado(self.sucursal, self.dia, self.dia)
+        otra = Sucursal.objects.create(nombre='Otra')
+        ajeno = crear_registro(crear_empleado(otra, 'Luis'), self.dia, hora_salida=None)
+
+        for opciones in (['--solo-marcar'], []):
+            self.procesar('--fecha', f'{self.dia:%Y-%m-%d}', *opciones)
+
+        cerrado.refresh_from_db()
+        self.assertIsNone(cerrado.fecha_hora_salida)
+        self.assertFalse(cerrado.requiere_revision)
+        # El periodo cerrado es de otra sucursal: el turno de Luis sí se cierra
+        ajeno.refresh_from_db()
+        self.assertEqual(ajeno.fecha_hora_salida, momento_local(self.dia, 17))
+
+    def test_ausencias_solo_en_dias_laborables(self):
+        presente = crear_empleado(self.sucursal, 'Ana')
+        crear_registro(presente, self.dia)
+        libre = crear_empleado(self.sucursal, 'Eva')
+        libre.usa_horario_variable = True
+        libre.save()
+        HorarioDia.objects.create(empleado=libre, dia_semana=self.dia.weekday(), es_dia_libre=True)
+        baja = crear_empleado(self.sucursal, 'Luis')
+        baja.is_active = False
+        baja.save()
+
+        for _ in range(2):
+            self.procesar('--fecha', f'{self.dia:%Y-%m-%d}')
+        # Sábado y domingo son descanso del horario general
+        for dia in (self.dia + timedelta(days=5), self.dia + timedelta(days=6)):
+            self.procesar('--fecha', f'{dia:%Y-%m-%d}')
+
+        self.assertEqual(list(Ausencia.objects.values_list('empleado_id', 'fecha')), [(self.empleado.id, self.dia)])
+
+    def test_fecha_invalida(self):
+        with self.assertRaisesMessage(CommandError, "AAAA-MM-DD"):
+            self.procesar('--fecha', '02/03/2026')
+
+
+# --- Cache de reportes ---
+
+class CacheReportesTests(DatosAsistencia, TestCase):
+
+    def test_guarda_y_devuelve_el_resultado_mientras_no_cambie_la_version(self):
+        calcular = mock.Mock(return_value={'filas': [1, 2, 3]})
+        primero = obtener_o_calcular('prueba', (1,), calcular, sucursal_id=self.sucursal.id)
+        segundo = obtener_o_calcular('prueba', (1,), calcular, sucursal_id=self.sucursal.id)
+
+        self.assertEqual(primero, segundo)
+        self.assertEqual(calcular.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar_cache_asistencia(self.sucursal.id)
+        obtener_o_calcular('prueba', (1,), calcular, sucursal_id=self.sucursal.id)
+        self.assertEqual(calcular.call_count, 2)
+
+    def test_no_guarda_resultados_demasiado_grandes(self):
+        calcular = mock.Mock(return_value=b'x' * 2048)
+        with self.settings(REPORTES_CACHE_MAX_BYTES=1024):
+            obtener_o_calcular('prueba', (), calcular, sucursal_id=self.sucursal.id)
+            self.assertEqual(obtener_o_calcular('prueba', (), calcular, sucursal_id=self.sucursal.id), b'x' * 2048)
+        self.assertEqual(calcular.call_count, 2)
+
+
+# --- Reporte de puntualidad (agregados en SQL) ---
+
+class PuntualidadTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Juan: horario fijo de 9:00. Ana: horario variable, lunes 10:00 y martes libre.
+        self.ana = crear_empleado(self.sucursal, 'Ana')
+        self.ana.usa_horario_variable = True
+        self.ana.save()
+        HorarioDia.objects.create(empleado=self.ana, dia_semana=0, hora_entrada=time(10), hora_salida=time(18))
+        HorarioDia.objects.create(empleado=self.ana, dia_semana=1, es_dia_libre=True)
+
+        martes, lunes_siguiente = self.dia + timedelta(days=1), self.dia + timedelta(days=7)
+        for empleado, dia, hora, minuto, tarde in (
+            (self.empleado, self.dia, 9, 20, True),
+            (self.empleado, martes, 9, 0, False),
+            (self.empleado, lunes_siguiente, 9, 10, True),
+            (self.ana, self.dia, 10, 30, True),
+            # Día libre: cuenta como retardo, pero sin hora esperada no entra al promedio
+            (self.ana, martes, 8, 0, True),
+        ):
+            RegistroAsistencia.objects.create(
+                empleado=empleado, sucursal=self.sucursal,
+                fecha_hora_entrada=momento_local(dia, hora, minuto), llego_tarde=tarde,
+            )
+
+    def calcular(self):
+        return calcular_puntualidad(RegistroAsistencia.objects.filter(sucursal=self.sucursal))
+
+    def resumen(self, filas, clave):
+        return {fila[clave]: (fila['total'], fila['tardes'], fila['porcentaje_tarde'], fila['promedio_minutos_tarde']) for fila in filas}
+
+    def test_agregados_por_empleado_dia_y_semana(self):
+        puntualidad = self.calcular()
+
+        self.assertEqual(self.resumen(puntualidad['por_empleado'], 'empleado__nombre'), {
+            'Ana': (2, 2, 100.0, 30.0),
+            'Juan': (3, 2, 66.7, 15.0),
+        })
+        self.assertEqual(self.resumen(puntualidad['por_dia'], 'dia'), {
+            'Lunes': (3, 3, 100.0, 20.0),
+            'Martes': (2, 1, 50.0, None),
+        })
+        self.assertEqual(self.resumen(puntualidad['por_semana'], 'semana'), {
+            self.dia: (4, 3, 75.0, 25.0),
+            self.dia + timedelta(days=7): (1, 1, 100.0, 10.0),
+        })
+        self.assertEqual((puntualidad['total'], puntualidad['tardes'], puntualidad['porcentaje_tarde']), (5, 4, 80.0))
+
+    def test_sin_registros(self):
+        puntualidad = calcular_puntualidad(RegistroAsistencia.objects.none())
+
+        self.assertEqual(puntualidad['por_empleado'], [])
+        self.assertEqual((puntualidad['total'], puntualidad['tardes'], puntualidad['porcentaje_tarde']), (0, 0, 0))
+
+    def test_vista_usa_la_cache_hasta_que_cambian_los_registros(self):
+        panel = cliente_del_panel(User.objects.create_user('admin', password='x'), self.sucursal)
+        url = reverse('bitacora:puntualidad')
+
+        with mock.patch('bitacora.analitica.calcular_puntualidad', wraps=calcular_puntualidad) as calcular:
+            self.assertEqual(panel.get(url).context['puntualidad']['total'], 5)
+            self.assertEqual(panel.get(url).context['puntualidad']['total'], 5)
+            self.assertEqual(calcular.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                crear_registro(crear_empleado(self.sucursal, 'Eva'), self.dia)
+            self.assertEqual(panel.get(url).context['puntualidad']['total'], 6)
+            self.assertEqual(calcular.call_count, 2)
+
+
+# --- Series de tiempo para gráficas ---
+
+class SeriesAsistenciaTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        ana = crear_empleado(self.sucursal, 'Ana')
+        crear_registro(self.empleado, self.dia, llego_tarde=True)
+        crear_registro(ana, self.dia, 10, 14)
+        # Turno abierto: cuenta como entrada, pero no suma horas
+        crear_registro(self.empleado, self.dia + timedelta(days=1), hora_salida=None)
+        crear_registro(self.empleado, date(2026, 4, 1), 9, 13)
+        self.panel = cliente_del_panel(User.objects.create_user('admin', password='x'), self.sucursal)
+        self.url = reverse('bitacora:series_asistencia')
+
+    def series(self, periodo):
+        return calcular_series(RegistroAsistencia.objects.filter(sucursal=self.sucursal), periodo)
+
+    def test_series_por_dia_semana_y_mes(self):
+        self.assertEqual(self.series('dia'), {
+            'periodos': ['2026-03-02', '2026-03-03', '2026-04-01'],
+            'entradas': [2, 1, 1],
+            'tardes': [1, 0, 0],
+            'horas': [12.0, 0, 4.0],
+            'presentes': [2, 1, 1],
+        })
+        semanas = self.series('semana')
+        self.assertEqual(semanas['periodos'], ['2026-03-02', '2026-03-30'])
+        self.assertEqual(semanas['entradas'], [3, 1])
+        self.assertEqual(semanas['presentes'], [2, 1])
+        meses = self.series('mes')
+        self.assertEqual(meses['periodos'], ['2026-03-01', '2026-04-01'])
+        self.assertEqual(meses['horas'], [12.0, 4.0])
+
+    def test_etag_responde_304_hasta_que_cambian_los_registros(self):
+        primera = self.panel.get(self.url, {'periodo': 'semana'})
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(json.loads(primera.content)['periodo'], 'semana')
+        etag = primera['ETag']
+
+        self.assertEqual(self.panel.get(self.url, {'periodo': 'semana'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Otro periodo u otros filtros son otra respuesta
+        self.assertEqual(self.panel.get(self.url, {'periodo': 'mes'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.panel.get(self.url, {'periodo': 'semana', 'fecha_inicio': '2026-03-03'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_registro(self.empleado, self.dia + timedelta(days=2))
+        nueva = self.panel.get(self.url, {'periodo': 'semana'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(nueva.status_code, 200)
+        self.assertNotEqual(nueva['ETag'], etag)
+        self.assertEqual(json.loads(nueva.content)['entradas'], [4, 1])
+
+    def test_periodo_invalido_usa_dia_y_comprime_con_gzip(self):
+        # gzip_page no comprime respuestas de menos de 200 bytes
+        for dias in range(5, 20):
+            crear_registro(self.empleado, self.dia + timedelta(days=dias))
+
+        respuesta = self.panel.get(self.url, {'periodo': 'anio'}, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(respuesta.content))['periodo'], 'dia')
+
+    def test_requiere_sesion(self):
+        self.assertEqual(Client().get(self.url).status_code, 302)
+
+
+# --- Diario de escaneos ---
+
+class DiarioEscaneosTests(DatosAsistencia, TestCase):
+    # Un pid que no existe (más alto que pid_max) y uno que siempre está vivo
+    PID_MUERTO = 4194305
+    PID_VIVO = 1
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+        ajustes = self.settings(ESCANEOS_DIARIO_DIR=self.directorio, ESCANEOS_DIARIO_LOTE=2)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(self.olvidar_archivo_activo)
+
+    def olvidar_archivo_activo(self):
+        # Como si el proceso muriera: el archivo activo queda en disco sin rotar
+        if diario._archivo is not None:
+            diario._archivo.close()
+        diario._archivo = diario._ruta_activa = diario._pid_archivo = None
+
+    def escaneo(self, accion, hora, minuto=0, empleado=None):
+        return json.dumps({
+            'codigo': str((empleado or self.empleado).codigo_qr_unico), 'accion': accion,
+            'sucursal_id': self.sucursal.id, 'momento': momento_local(self.dia, hora, minuto).isoformat(),
+        }) + '\n'
+
+    def escribir(self, nombre, *lineas):
+        with open(os.path.join(self.directorio, nombre), 'w', encoding='utf-8') as archivo:
+            archivo.write(''.join(lineas))
+
+    def archivos(self):
+        return sorted(os.listdir(self.directorio))
+
+    def rechazados(self):
+        ruta = os.path.join(self.directorio, diario.ARCHIVO_RECHAZADOS)
+        if not os.path.exists(ruta):
+            return []
+        with open(ruta, encoding='utf-8') as archivo:
+            return [json.loads(linea) for linea in archivo]
+
+    def test_anotar_hace_fsync_y_se_reaplica_tras_un_reinicio(self):
+        with mock.patch('bitacora.diario.os.fsync', wraps=os.fsync) as fsync:
+            diario.anotar_escaneo(self.empleado.codigo_qr_unico, 'entrada', self.sucursal.id, momento_local(self.dia, 9))
+        self.assertIn(mock.call(diario._archivo.fileno()), fsync.call_args_list)
+        diario.anotar_escaneo(self.empleado.codigo_qr_unico, 'salida', self.sucursal.id, momento_local(self.dia, 17))
+        self.olvidar_archivo_activo()
+
+        self.assertEqual(diario.vaciar(margen=0), 2)
+        registro = RegistroAsistencia.objects.get(empleado=self.empleado)
+        self.assertEqual((registro.fecha_hora_entrada, registro.fecha_hora_salida), (momento_local(self.dia, 9), momento_local(self.dia, 17)))
+        self.assertNotIn(f'diario-{os.getpid()}', ' '.join(self.archivos()))
+        self.assertFalse(AvanceDiario.objects.exists())
+
+    def test_archivo_de_un_proceso_muerto_se_aplica_y_se_borra(self):
+        # La última línea quedó a medio escribir: nunca se confirmó al kiosko
+        self.escribir(f'diario-{self.PID_MUERTO}-abc.jsonl', self.escaneo('entrada', 9), '{"codigo": "a')
+
+        self.assertEqual(diario.vaciar(margen=0), 1)
+        self.assertTrue(RegistroAsistencia.objects.filter(empleado=self.empleado).exists())
+        self.assertNotIn(f'diario-{self.PID_MUERTO}-abc.jsonl', self.archivos())
+        self.assertEqual(self.rechazados(), [])
+
+    def test_archivo_de_otro_proceso_vivo_se_aplica_sin_borrarlo_ni_repetirlo(self):
+        self.escribir(f'diario-{self.PID_VIVO}-abc.jsonl', self.escaneo('entrada', 9))
+
+        self.assertEqual(diario.vaciar(margen=0), 1)
+        self.assertIn(f'diario-{self.PID_VIVO}-abc.jsonl', self.archivos())
+        self.assertEqual(AvanceDiario.objects.get(archivo='abc').lineas_aplicadas, 1)
+        self.assertEqual(diario.vaciar(margen=0), 0)
+        self.assertEqual(RegistroAsistencia.objects.count(), 1)
+
+    def test_mezcla_los_archivos_en_orden_de_hora(self):
+        # La salida quedó en el archivo de un worker y la entrada en el de otro
+        self.escribir(f'diario-{self.PID_MUERTO}-aaa.pendiente', self.escaneo('salida', 17))
+        self.escribir(f'diario-{self.PID_MUERTO}-bbb.pendiente', self.escaneo('entrada', 9))
+
+        self.assertEqual(diario.vaciar(margen=0), 2)
+        registro = RegistroAsistencia.objects.get(empleado=self.empleado)
+        self.assertEqual(registro.fecha_hora_salida, momento_local(self.dia, 17))
+        self.assertEqual(self.rechazados(), [])
+        self.assertNotIn('aaa', ' '.join(self.archivos()))
+
+    def test_escaneos_que_fallan_van_a_rechazados_y_el_diario_sigue(self):
+        otro = crear_empleado(self.sucursal, 'Ana')
+        original = diario.aplicar_escaneo
+
+        def falla_con_ana(empleado, *args):
+            if empleado.pk == otro.pk:
+                raise ValueError("falla")
+            return original(empleado, *args)
+
+        self.escribir(
+            f'diario-{self.PID_MUERTO}-abc.pendiente',
+            'no es json\n', self.escaneo('entrada', 8, empleado=otro), self.escaneo('entrada', 9),
+            self.escaneo('salida', 10, empleado=crear_empleado(self.sucursal, 'Sin entrada')),
+        )
+        with mock.patch('bitacora.diario.aplicar_escaneo', side_effect=falla_con_ana):
+            self.assertEqual(diario.vaciar(margen=0), 4)
+
+        self.assertTrue(RegistroAsistencia.objects.filter(empleado=self.empleado).exists())
+        self.assertEqual([rechazado['linea'] for rechazado in self.rechazados()], [1, 2, 4])
+        self.assertIn('falla', self.rechazados()[1]['motivo'])
+        self.assertIn('No se encontró un registro de entrada', self.rechazados()[2]['motivo'])
+        self.assertNotIn('diario-', ' '.join(self.archivos()))
+
+    def test_bd_no_disponible_deja_el_lote_para_el_siguiente_ciclo(self):
+        self.escribir(f'diario-{self.PID_MUERTO}-abc.pendiente', self.escaneo('entrada', 9))
+        with mock.patch('bitacora.diario.aplicar_escaneo', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                diario.vaciar(margen=0)
+        self.assertIn(f'diario-{self.PID_MUERTO}-abc.pendiente', self.archivos())
+        self.assertFalse(AvanceDiario.objects.exists())
+
+        self.assertEqual(diario.vaciar(margen=0), 1)
+        self.assertTrue(RegistroAsistencia.objects.filter(empleado=self.empleado).exists())
+
+    def test_escaneos_recientes_esperan_al_siguiente_ciclo(self):
+        reciente = json.dumps({
+            'codigo': str(self.empleado.codigo_qr_unico), 'accion': 'salida',
+            'sucursal_id': self.sucursal.id, 'momento': timezone.localtime().isoformat(),
+        }) + '\n'
+        self.escribir(f'diario-{self.PID_MUERTO}-abc.pendiente', self.escaneo('entrada', 9), reciente)
+
+        self.assertEqual(diario.vaciar(margen=60), 1)
+        self.assertEqual(AvanceDiario.objects.get(archivo='abc').lineas_aplicadas, 1)
+        self.assertIn(f'diario-{self.PID_MUERTO}-abc.pendiente', self.archivos())
+
+
+# --- Antirrebote y límite de escaneos del kiosko ---
+
+class AntirreboteTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        antirrebote.cache_escaneos.clear()
+        self.cliente = Client(HTTP_AUTHORIZATION=f"Bearer {token_kiosko(self.sucursal)}")
+        # Reloj fijo a media ventana (20 s con 10 escaneos a 30 por minuto) para que no cambie durante la prueba
+        reloj_fijo = mock.patch.object(antirrebote, 'time', mock.Mock(time=lambda: 1010.0, monotonic=reloj.monotonic))
+        reloj_fijo.start()
+        self.addCleanup(reloj_fijo.stop)
+
+    def escanear(self, empleado, accion='entrada'):
+        return self.cliente.get(reverse('bitacora:registrar_asistencia', args=[empleado.codigo_qr_unico, accion]))
+
+    def test_lectura_repetida_recibe_el_resultado_anterior(self):
+        primera = self.escanear(self.empleado)
+        segunda = self.escanear(self.empleado)
+
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(RegistroAsistencia.objects.count(), 1)
+        # Otra acción del mismo gafete sí se procesa
+        self.assertContains(self.escanear(self.empleado, 'salida'), 'Salida')
+
+    def test_limite_por_dispositivo_responde_429(self):
+        empleados = [crear_empleado(self.sucursal, nombre) for nombre in ('Ana', 'Eva', 'Luis')]
+        with self.settings(ESCANEOS_RAFAGA=2, ESCANEOS_POR_MINUTO=6):
+            respuestas = [self.escanear(empleado) for empleado in empleados]
+            # Otro dispositivo tiene su propio límite
+            otro = Client(HTTP_AUTHORIZATION=f"Bearer {token_kiosko(self.sucursal, 'Caja 2')}")
+            ajena = otro.get(reverse('bitacora:registrar_asistencia', args=[empleados[2].codigo_qr_unico, 'entrada']))
+
+        self.assertEqual([respuesta.status_code for respuesta in respuestas], [200, 200, 429])
+        # Ventanas de 20 s: a los 1010 s faltan 10 para la siguiente (1020)
+        self.assertEqual(respuestas[2]['Retry-After'], '10')
+        self.assertEqual(ajena.status_code, 200)
+        self.assertEqual(RegistroAsistencia.objects.filter(empleado=empleados[2]).count(), 1)
+
+    def test_conteo_atomico_entre_hilos(self):
+        barrera = threading.Barrier(8)
+        resultados = []
+
+        def consumir():
+            barrera.wait()
+            for _ in range(5):
+                resultados.append(antirrebote.consumir_ficha('kiosko:prueba')[0])
+
+        hilos = [threading.Thread(target=consumir) for _ in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(resultados.count(True), 10)
+
+
+# --- Tokens de los kioskos de escaneo ---
+
+class KioskoTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        antirrebote.cache_escaneos.clear()
+        self.dispositivo = DispositivoKiosko.objects.create(sucursal=self.sucursal, nombre='Caja 1')
+        self.cliente = Client(HTTP_AUTHORIZATION=f"Bearer {emitir_token(self.dispositivo)}")
+        self.admin = User.objects.create_user('admin', password='x')
+
+    def escanear(self, cliente, empleado):
+        return cliente.get(reverse('bitacora:registrar_asistencia', args=[empleado.codigo_qr_unico, 'entrada']))
+
+    def assertPideLogin(self, respuesta):
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertTrue(respuesta['Location'].startswith(f"{reverse(settings.LOGIN_URL)}?next="))
+
+    def test_token_solo_abre_el_escaneo(self):
+        self.assertEqual(self.escanear(self.cliente, self.empleado).status_code, 200)
+        self.assertEqual(RegistroAsistencia.objects.filter(empleado=self.empleado).count(), 1)
+
+        for nombre in ('bitacora:configuracion', 'bitacora:acciones_registros'):
+            self.assertPideLogin(self.cliente.get(reverse(nombre)))
+
+    def test_empleado_de_otra_sucursal_responde_403(self):
+        ajeno = crear_empleado(Sucursal.objects.create(nombre='Otra'), 'Ana')
+
+        self.assertEqual(self.escanear(self.cliente, ajeno).status_code, 403)
+        self.assertFalse(RegistroAsistencia.objects.filter(empleado=ajeno).exists())
+
+    def test_token_invalido_o_anterior_pide_login(self):
+        anterior = signing.dumps({'s': self.sucursal.id, 'd': 'Caja vieja'}, salt=settings.KIOSKO_TOKEN_SALT, compress=True)
+        for token in ('basura', anterior):
+            self.assertPideLogin(self.escanear(Client(HTTP_AUTHORIZATION=f"Bearer {token}"), self.empleado))
+        self.assertFalse(RegistroAsistencia.objects.exists())
+
+    def test_revocar_invalida_solo_ese_dispositivo(self):
+        otro = Client(HTTP_AUTHORIZATION=f"Bearer {token_kiosko(self.sucursal, 'Caja 2')}")
+        # Deja el dispositivo activo en cache antes de revocarlo
+        self.assertEqual(self.escanear(self.cliente, self.empleado).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            revocar_dispositivo(self.dispositivo)
+
+        self.assertPideLogin(self.escanear(self.cliente, crear_empleado(self.sucursal, 'Ana')))
+        self.assertEqual(self.escanear(otro, crear_empleado(self.sucursal, 'Eva')).status_code, 200)
+
+    def test_activar_muestra_el_token_una_vez(self):
+        panel = cliente_del_panel(self.admin, self.sucursal)
+
+        respuesta = panel.post(reverse('bitacora:activar_kiosko'), {'dispositivo': 'Tablet entrada'})
+
+        self.assertRedirects(respuesta, reverse('bitacora:token_kiosko'), fetch_redirect_response=False)
+        token = respuesta.cookies['kiosko'].value
+        dispositivo = DispositivoKiosko.objects.get(nombre='Tablet entrada')
+        self.assertEqual(dispositivo.sucursal, self.sucursal)
+        self.assertEqual(dispositivo.creado_por, self.admin)
+
+        pagina = panel.get(reverse('bitacora:token_kiosko'))
+        self.assertContains(pagina, token)
+        self.assertTrue(all(token not in str(mensaje) for mensaje in pagina.context['messages']))
+
+        segunda = panel.get(reverse('bitacora:token_kiosko'), follow=True)
+        self.assertRedirects(segunda, reverse('bitacora:configuracion'))
+        self.assertNotContains(segunda, token)
+
+    def test_revocar_desde_el_panel_solo_en_su_sucursal(self):
+        otra = Sucursal.objects.create(nombre='Otra')
+        ajeno = DispositivoKiosko.objects.create(sucursal=otra, nombre='Caja ajena')
+        panel = cliente_del_panel(self.admin, self.sucursal)
+
+        respuesta = panel.post(reverse('bitacora:revocar_kiosko', args=[ajeno.id]))
+        self.assertEqual(respuesta.status_code, 404)
+        ajeno.refresh_from_db()
+        self.assertIsNone(ajeno.revocado)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = panel.post(reverse('bitacora:revocar_kiosko', args=[self.dispositivo.id]))
+        self.assertRedirects(respuesta, reverse('bitacora:configuracion'), fetch_redirect_response=False)
+        self.dispositivo.refresh_from_db()
+        self.assertIsNotNone(self.dispositivo.revocado)
+        self.assertPideLogin(self.escanear(self.cliente, self.empleado))
+
+
+# --- Exportaciones en segundo plano ---
+
+class EjecutorEnLinea:
+    """
+    Corre cada trabajo en este proceso: la BD de pruebas no se ve desde los procesos hijos del pool.
+    """
+    def submit(self, funcion, *args):
+        futuro = Future()
+        futuro.set_result(funcion(*args))
+        return futuro
+
+
+class ExportacionesTests(DatosAsistencia, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        crear_registro(self.empleado, self.dia)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = self.settings(EXPORTACIONES_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        # En el proceso hijo cada trabajo cierra su conexión; aquí cerraría la de la prueba
+        conexiones = mock.patch.object(trabajos, 'close_old_connections')
+        conexiones.start()
+        self.addCleanup(conexiones.stop)
+        self.usuario = User.objects.create_user('admin', password='x')
+        self.cliente = cliente_del_panel(self.usuario, self.sucursal)
+
+    def encolar(self, ejecutor):
+        with mock.patch.object(trabajos, 'obtener_executor', return_value=ejecutor):
+            respuesta = self.cliente.post(reverse('bitacora:crear_exportacion') + f'?fecha_inicio={self.dia:%Y-%m-%d}')
+        self.assertEqual(respuesta.status_code, 202)
+        return respuesta.json()
+
+    def test_encolar_no_genera_el_archivo_en_la_peticion(self):
+        ejecutor = mock.Mock()
+        datos = self.encolar(ejecutor)
+
+        trabajo = TrabajoExportacion.objects.get()
+        ejecutor.submit.assert_called_once_with(trabajos.ejecutar_exportacion, trabajo.pk)
+        self.assertEqual((datos['id'], datos['estado']), (str(trabajo.pk), TrabajoExportacion.PENDIENTE))
+        self.assertIsNotNone(trabajo.expira)
+        self.assertEqual(self.cliente.get(datos['estado_url']).json()['progreso'], 0)
+
+    def test_estado_y_descarga_del_archivo(self):
+        datos = self.encolar(EjecutorEnLinea())
+
+        estado = self.cliente.get(datos['estado_url']).json()
+        self.assertEqual((estado['estado'], estado['progreso']), (TrabajoExportacion.TERMINADO, 100))
+        respuesta = self.cliente.get(estado['descarga_url'])
+        self.assertIn('reporte_asistencia.xlsx', respuesta['Content-Disposition'])
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'PK'))
+
+        # Los trabajos son de quien los pidió
+        otro = cliente_del_panel(User.objects.create_user('otro', password='x'), self.sucursal)
+        self.assertEqual(otro.get(datos['estado_url']).status_code, 404)
+        self.assertEqual(otro.get(estado['descarga_url']).status_code, 404)
+
+    def test_error_al_generar(self):
+        with mock.patch.object(trabajos, 'obtener_excel', side_effect=ValueError("sin memoria")), \
+                self.assertLogs('bitacora.trabajos', 'ERROR'):
+            datos = self.encolar(EjecutorEnLinea())
+
+        estado = self.cliente.get(datos['estado_url']).json()
+        self.assertEqual((estado['estado'], estado['mensaje']), (TrabajoExportacion.ERROR, "sin memoria"))
+
+    def test_proceso_hijo_muerto_marca_error_y_descarta_el_pool(self):
+        trabajo = TrabajoExportacion.objects.create(usuario=self.usuario, parametros={}, expira=trabajos.expiracion())
+        ejecutor = mock.Mock()
+        futuro = Future()
+        futuro.set_exception(BrokenProcessPool())
+
+        with mock.patch.object(trabajos, '_executor', ejecutor):
+            trabajos.revisar_proceso(futuro, ejecutor, trabajo.pk)
+            self.assertIsNone(trabajos._executor)
+
+        ejecutor.shutdown.assert_called_once()
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.ERROR)
+
+    def test_trabajo_perdido_se_reporta_como_error(self):
+        datos = self.encolar(mock.Mock())
+        TrabajoExportacion.objects.update(creado=timezone.now() - timedelta(hours=2))
+
+        estado = self.cliente.get(datos['estado_url']).json()
+        self.assertEqual(estado['estado'], TrabajoExportacion.ERROR)
+        self.assertIn("se interrumpió", estado['mensaje'])
+
+    def test_expiracion_borra_archivo_y_trabajo(self):
+        datos = self.encolar(EjecutorEnLinea())
+        trabajo = TrabajoExportacion.objects.get()
+        ruta = trabajos.ruta_archivo(trabajo.archivo)
+        self.assertTrue(os.path.exists(ruta))
+
+        self.assertEqual(trabajos.limpiar_exportaciones_vencidas(), 0)
+        TrabajoExportacion.objects.update(expira=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(trabajos.limpiar_exportaciones_vencidas(), 1)
+
+        self.assertFalse(os.path.exists(ruta))
+        self.assertEqual(self.cliente.get(datos['estado_url']).status_code, 404)
+
+
+# --- Libro de nómina ---
+
+class NominaParticionesTests(TestCase):
+
+    def particiones(self, empleados=3, registros=2):
+        entrada = datetime(2026, 3, 2, 15, tzinfo=dt_timezone.utc)
+        return [
+            (empleado_id, f"Empleado {empleado_id}", 'America/Mexico_City', [
+                (empleado_id * 100 + n, entrada + timedelta(days=n), entrada + timedelta(days=n, hours=8), n == 0)
+                for n in range(registros)
+            ])
+            for empleado_id in range(1, empleados + 1)
+        ]
+
+    def tearDown(self):
+        if nomina._pool is not None:
+            nomina._pool.shutdown()
+            nomina._pool = None
+
+    def test_periodo_chico_se_arma_en_linea(self):
+        avance = []
+        with mock.patch.object(nomina, '_obtener_pool') as obtener_pool:
+            hojas = nomina.procesar_particiones(self.particiones(), 4, 100, progreso=avance.append)
+        obtener_pool.assert_not_called()
+        self.assertEqual(avance, [1, 2, 3])
+        self.assertEqual([(hoja['dias'], hoja['tardes'], hoja['segundos']) for hoja in hojas], [(2, 1, 16 * 3600)] * 3)
+
+    def test_pool_da_lo_mismo_que_en_linea(self):
+        particiones = self.particiones()
+        self.assertEqual(
+            nomina.procesar_particiones(particiones, 2, 1),
+            nomina.procesar_particiones(particiones, 1, 1),
+        )
+
+    def test_hilos_concurrentes_crean_un_solo_pool(self):
+        def crear_lento(*args, **kwargs):
+            reloj.sleep(0.05)
+            return mock.Mock()
+
+        with mock.patch.object(nomina, 'ProcessPoolExecutor', side_effect=crear_lento) as crear:
+            barrera = threading.Barrier(4)
+
+            def obtener():
+                barrera.wait()
+                nomina._obtener_pool(2)
+
+            hilos = [threading.Thread(target=obtener) for _ in range(4)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            self.assertEqual(crear.call_count, 1)
+            nomina._pool = None
+
+    def test_pool_roto_se_apaga_y_se_descarta(self):
+        roto = mock.Mock()
+        roto.map.side_effect = BrokenProcessPool()
+        with mock.patch.object(nomina, '_obtener_pool', return_value=roto):
+            nomina._pool = roto
+            with self.assertRaises(BrokenProcessPool):
+                nomina.procesar_particiones(self.particiones(), 2, 1)
+        roto.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertIsNone(nomina._pool)
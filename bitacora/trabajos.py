@@ -0,0 +1,206 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import TrabajoExportacion
+from .exportar import obtener_excel, MODO_ASISTENCIA
+from .procesos import iniciar_django
+
+logger = logging.getLogger(__name__)
+
+# Pool de procesos compartido por el worker. Armar un Excel con openpyxl es trabajo de CPU:
+# en un hilo del worker ASGI competiría por el GIL con los escaneos del kiosko, así que cada
+# exportación corre en un proceso hijo ('spawn', con su propio Django y su propia conexión).
+# Es pequeño a propósito y se crea con la primera exportación: cada proceso carga Django y
+# openpyxl, y tampoco debe acaparar el escritor de SQLite que usan los escaneos.
+_executor = None
+# Las vistas corren en varios hilos: el candado evita que dos creen (o descarten) el pool a la vez
+_candado_executor = threading.Lock()
+
+
+def obtener_executor():
+    global _executor
+    with _candado_executor:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.EXPORTACIONES_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=iniciar_django,
+                initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+            )
+        return _executor
+
+
+def _descartar_executor(executor):
+    """
+    Apaga un pool roto (murió un proceso hijo) para que la siguiente exportación cree otro.
+    """
+    global _executor
+    with _candado_executor:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ruta_archivo(nombre):
+    return os.path.join(settings.EXPORTACIONES_DIR, nombre)
+
+
+def filtros_desde_parametros(parametros):
+    """
+    Reconstruye los filtros normalizados (con fechas) a partir de lo guardado en el trabajo.
+    """
+    return {
+        'sucursal_id': parametros.get('sucursal_id'),
+        'empleado_id': parametros.get('empleado_id'),
+        'fecha_inicio': date.fromisoformat(parametros['fecha_inicio']) if parametros.get('fecha_inicio') else None,
+        'fecha_fin': date.fromisoformat(parametros['fecha_fin']) if parametros.get('fecha_fin') else None,
+    }
+
+
+def parametros_desde_filtros(filtros):
+    return {
+        campo: valor.isoformat() if hasattr(valor, 'isoformat') else valor
+        for campo, valor in filtros.items()
+    }
+
+
+def encolar_exportacion(usuario, filtros, modo=MODO_ASISTENCIA):
+    """
+    Crea el trabajo y lo manda al pool. Regresa de inmediato.
+    """
+    limpiar_exportaciones_vencidas()
+    parametros = parametros_desde_filtros(filtros)
+    parametros['modo'] = modo
+    # Con expiración desde el principio: aunque el trabajo nunca termine, la limpieza lo borra
+    trabajo = TrabajoExportacion.objects.create(usuario=usuario, parametros=parametros, expira=expiracion())
+    executor = obtener_executor()
+    try:
+        futuro = executor.submit(ejecutar_exportacion, trabajo.pk)
+    except BrokenProcessPool:
+        # El pool se rompió con una exportación anterior: uno nuevo toma este trabajo
+        _descartar_executor(executor)
+        executor = obtener_executor()
+        futuro = executor.submit(ejecutar_exportacion, trabajo.pk)
+    futuro.add_done_callback(lambda futuro: revisar_proceso(futuro, executor, trabajo.pk))
+    return trabajo
+
+
+def revisar_proceso(futuro, executor, trabajo_id):
+    """
+    Si el proceso hijo murió a medio trabajo (memoria, señal), ejecutar_exportacion no alcanzó
+    a guardar el error: se marca aquí y se descarta el pool roto. Corre en el worker, en el
+    hilo que administra el pool.
+    """
+    if futuro.cancelled() or not isinstance(futuro.exception(), BrokenProcessPool):
+        return
+    _descartar_executor(executor)
+    try:
+        marcar_error(trabajo_id, "El proceso de la exportación terminó inesperadamente. Vuelve a generarla.")
+    finally:
+        close_old_connections()
+
+
+def ejecutar_exportacion(trabajo_id):
+    """
+    Genera el archivo de un trabajo. Corre en un proceso hijo del pool, con su propia conexión a la BD.
+    """
+    close_old_connections()
+    try:
+        trabajo = TrabajoExportacion.objects.get(pk=trabajo_id)
+        TrabajoExportacion.objects.filter(pk=trabajo_id).update(estado=TrabajoExportacion.PROCESANDO)
+        filtros = filtros_desde_parametros(trabajo.parametros)
+
+        ultimo_progreso = 0
+
+        def actualizar_progreso(porcentaje):
+            # Solo escribimos saltos de al menos 5% para no competir con los escaneos por la BD
+            nonlocal ultimo_progreso
+            if porcentaje >= ultimo_progreso + 5:
+                ultimo_progreso = porcentaje
+                TrabajoExportacion.objects.filter(pk=trabajo_id).update(progreso=porcentaje)
+
+        contenido = obtener_excel(filtros, trabajo.parametros.get('modo', MODO_ASISTENCIA), progreso=actualizar_progreso)
+
+        os.makedirs(settings.EXPORTACIONES_DIR, exist_ok=True)
+        nombre = f"{trabajo_id}.xlsx"
+        with open(ruta_archivo(nombre), 'wb') as archivo:
+            archivo.write(contenido)
+
+        ahora = timezone.now()
+        TrabajoExportacion.objects.filter(pk=trabajo_id).update(
+            estado=TrabajoExportacion.TERMINADO,
+            progreso=100,
+            archivo=nombre,
+            terminado=ahora,
+            expira=expiracion(ahora),
+        )
+    except Exception as e:
+        logger.exception("Error generando la exportación %s", trabajo_id)
+        marcar_error(trabajo_id, str(e))
+    finally:
+        close_old_connections()
+
+
+def marcar_error(trabajo_id, mensaje):
+    ahora = timezone.now()
+    TrabajoExportacion.objects.filter(pk=trabajo_id).update(
+        estado=TrabajoExportacion.ERROR,
+        mensaje_error=mensaje,
+        terminado=ahora,
+        expira=expiracion(ahora),
+    )
+
+
+def expiracion(desde=None):
+    return (desde or timezone.now()) + timedelta(hours=settings.EXPORTACIONES_EXPIRACION_HORAS)
+
+
+def trabajo_perdido(trabajo):
+    """
+    True si el trabajo sigue sin terminar después de EXPORTACIONES_LIMITE_MINUTOS.
+    """
+    return (
+        trabajo.estado in (TrabajoExportacion.PENDIENTE, TrabajoExportacion.PROCESANDO)
+        and trabajo.creado < timezone.now() - timedelta(minutes=settings.EXPORTACIONES_LIMITE_MINUTOS)
+    )
+
+
+def marcar_trabajos_perdidos():
+    """
+    Los trabajos corren en el pool del worker que los encoló: si ese worker se reinicia
+    (deploy, caída, max_requests) se quedan pendientes para siempre y el reporte los consultaría
+    sin fin. Los que pasan de EXPORTACIONES_LIMITE_MINUTOS sin terminar se marcan con error.
+    No se hace al arrancar un worker porque los demás pueden seguir generando los suyos.
+    """
+    ahora = timezone.now()
+    return TrabajoExportacion.objects.filter(
+        estado__in=(TrabajoExportacion.PENDIENTE, TrabajoExportacion.PROCESANDO),
+        creado__lt=ahora - timedelta(minutes=settings.EXPORTACIONES_LIMITE_MINUTOS),
+    ).update(
+        estado=TrabajoExportacion.ERROR,
+        mensaje_error="La exportación se interrumpió (el servidor se reinició). Vuelve a generarla.",
+        terminado=ahora,
+        expira=expiracion(ahora),
+    )
+
+
+def limpiar_exportaciones_vencidas():
+    """
+    Marca los trabajos perdidos y borra los archivos y trabajos cuya fecha de expiración ya pasó.
+    """
+    marcar_trabajos_perdidos()
+    vencidos = TrabajoExportacion.objects.filter(expira__lt=timezone.now())
+    for nombre in vencidos.exclude(archivo='').values_list('archivo', flat=True):
+        try:
+            os.remove(ruta_archivo(nombre))
+        except FileNotFoundError:
+            pass
+    eliminados, _ = vencidos.delete()
+    return eliminados
@@ -10,18 +10,32 @@ urlpatterns = [
 
     # --- Panel de Administración ---
     path('panel/empleados/', views.panel_empleados, name='panel_empleados'),
+    path('panel/empleados/buscar/', views.buscar_empleados_view, name='buscar_empleados'),
     path('panel/empleados/agregar/', views.agregar_empleado, name='agregar_empleado'),
     path('panel/empleados/desactivar/<int:empleado_id>/', views.desactivar_empleado, name='desactivar_empleado'),
     path('panel/empleados/reactivar/<int:empleado_id>/', views.reactivar_empleado, name='reactivar_empleado'),
     path('panel/empleados/qr/<uuid:codigo_empleado_uuid>/', views.generar_qr_empleado, name='generar_qr_empleado'),
     path('panel/empleados/marcar_asistencia/<int:empleado_id>/<str:accion>/', views.marcar_asistencia_panel, name='marcar_asistencia_panel'),
     path('panel/empleados/editar/<int:empleado_id>/', views.editar_empleado_view, name='editar_empleado'),
+    path('panel/empleados/acciones/', views.acciones_empleados_view, name='acciones_empleados'),
     
     path('panel/reportes/', views.reportes_view, name='reportes'),
+    path('panel/reportes/puntualidad/', views.puntualidad_view, name='puntualidad'),
+    path('panel/reportes/series/', views.series_asistencia_view, name='series_asistencia'),
     path('panel/reportes/exportar/', views.exportar_excel_view, name='exportar_excel'),
+    path('panel/reportes/exportar/trabajos/', views.crear_exportacion_view, name='crear_exportacion'),
+    path('panel/reportes/exportar/trabajos/<uuid:trabajo_id>/', views.estado_exportacion_view, name='estado_exportacion'),
+    path('panel/reportes/exportar/trabajos/<uuid:trabajo_id>/descargar/', views.descargar_exportacion_view, name='descargar_exportacion'),
+    path('panel/reportes/cambios/', views.exportar_cambios_view, name='exportar_cambios'),
     path('panel/reportes/eliminar/<int:registro_id>/', views.eliminar_registro_asistencia, name='eliminar_registro'),
+    path('panel/reportes/cerrar/', views.cerrar_periodo_view, name='cerrar_periodo'),
+    path('panel/reportes/acciones/', views.acciones_registros_view, name='acciones_registros'),
     
     path('panel/configuracion/', views.configuracion_view, name='configuracion'),
+    path('panel/sucursal/', views.cambiar_sucursal_view, name='cambiar_sucursal'),
+    path('panel/configuracion/kiosko/', views.activar_kiosko_view, name='activar_kiosko'),
+    path('panel/configuracion/kiosko/token/', views.token_kiosko_view, name='token_kiosko'),
+    path('panel/configuracion/kiosko/<uuid:dispositivo_id>/revocar/', views.revocar_kiosko_view, name='revocar_kiosko'),
     # --- Nuevas rutas para gestionar administradores ---
     path('panel/configuracion/editar/<int:user_id>/', views.editar_admin_view, name='editar_admin'),
     path('panel/configuracion/eliminar/<int:user_id>/', views.eliminar_admin_view, name='eliminar_admin'),
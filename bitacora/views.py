@@ -1,41 +1,39 @@
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpRequest, JsonResponse
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.http import HttpResponse, HttpRequest, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
+from django.conf import settings
 from django.urls import reverse
-from django.views.decorators.http import require_POST
-from datetime import datetime, timedelta
-from .models import Empleado, RegistroAsistencia, Configuracion, HorarioDia
-from .forms import EmpleadoForm, ConfiguracionForm, AdminUpdateForm
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.cache import cache_control, never_cache
+from .models import DispositivoKiosko, Empleado, RegistroAsistencia, Sucursal, TrabajoExportacion
+from .forms import EmpleadoForm, ConfiguracionForm, AdminUpdateForm, CerrarPeriodoForm
+from .filtros import obtener_filtros_reporte, filtrar_registros, empleados_para_resumen, empleado_filtrado
+from .analitica import obtener_puntualidad, obtener_series, etiqueta_series, PERIODOS_SERIE
+from .horarios import calcular_horas
+from .exportar import obtener_excel, CONTENT_TYPE_XLSX, MODO_ASISTENCIA, MODO_NOMINA
+from .cache import obtener_o_calcular
+from .busqueda import buscar_empleados, paginar
+from .sucursales import cambiar_sucursal
+from .trabajos import encolar_exportacion, ruta_archivo, trabajo_perdido, marcar_trabajos_perdidos
+from .flujos import contenido_streaming, respuesta_archivo
+from .escaneos import aaplicar_escaneo, aobtener_hora_entrada_esperada, aregistrar_entrada, calcular_llego_tarde
+from .kiosko import acceso_kiosko, emitir_token, revocar_dispositivo, COOKIE_KIOSKO
+from . import cambios, antirrebote, diario, periodos, masivo
 import qrcode
 import io
-from openpyxl import Workbook
+import hashlib
 from django.contrib.auth.models import User
 from django.contrib import messages
 from PIL import Image, ImageDraw, ImageFont
 
-# --- Función Auxiliar para obtener hora esperada ---
-def obtener_hora_entrada_esperada(empleado, fecha_dt):
-    """
-    Devuelve la hora de entrada supuesta para un empleado en una fecha dada.
-    Considera si tiene horario variable o fijo.
-    Retorna None si es día libre o no hay horario definido.
-    """
-    if not empleado.usa_horario_variable:
-        return empleado.hora_entrada_supuesta
-    
-    # 0=Lunes, 6=Domingo
-    dia_semana = fecha_dt.weekday()
-    try:
-        horario_dia = empleado.horarios_dias.get(dia_semana=dia_semana)
-        if horario_dia.es_dia_libre:
-            return None
-        return horario_dia.hora_entrada
-    except HorarioDia.DoesNotExist:
-        # Si no existe configuración específica para ese día, usamos la general como fallback
-        return empleado.hora_entrada_supuesta
+EMPLEADOS_POR_PAGINA_PANEL = 50
+CLAVE_SESION_TOKEN_KIOSKO = 'token_kiosko'
 
 # --- Vistas de Autenticación ---
 
@@ -70,18 +68,46 @@ def logout_view(request: HttpRequest) -> HttpResponse:
 
 @login_required
 def panel_empleados(request: HttpRequest) -> HttpResponse:
-    empleados_activos = Empleado.objects.filter(is_active=True).order_by('nombre')
-    empleados_inactivos = Empleado.objects.filter(is_active=False).order_by('nombre')
+    # Búsqueda y paginación del lado del servidor para no pintar toda la plantilla de golpe
+    q = request.GET.get('q', '').strip()
+    empleados = buscar_empleados(q, Empleado.objects.filter(sucursal_id=request.sucursal.id)).order_by('nombre', 'apellido', 'id')
+    empleados_activos = paginar(empleados.filter(is_active=True), request.GET.get('pagina_activos'), EMPLEADOS_POR_PAGINA_PANEL)
+    empleados_inactivos = paginar(empleados.filter(is_active=False), request.GET.get('pagina_inactivos'), EMPLEADOS_POR_PAGINA_PANEL)
     context = {
         'empleados_activos': empleados_activos,
         'empleados_inactivos': empleados_inactivos,
+        'q': q,
     }
     return render(request, 'bitacora/panel_empleados.html', context)
 
+@login_required
+def buscar_empleados_view(request: HttpRequest) -> JsonResponse:
+    """
+    API de búsqueda de empleados (typeahead). Parámetros: q, estado=activos|inactivos|todos, pagina.
+    """
+    empleados = buscar_empleados(request.GET.get('q', ''), Empleado.objects.filter(sucursal_id=request.sucursal.id))
+    estado = request.GET.get('estado', 'activos')
+    if estado == 'activos':
+        empleados = empleados.filter(is_active=True)
+    elif estado == 'inactivos':
+        empleados = empleados.filter(is_active=False)
+
+    pagina = paginar(
+        empleados.order_by('nombre', 'apellido', 'id').values('id', 'nombre', 'apellido', 'puesto', 'email', 'is_active'),
+        request.GET.get('pagina'),
+    )
+    return JsonResponse({
+        'resultados': list(pagina),
+        'pagina': pagina.number,
+        'paginas': pagina.paginator.num_pages,
+        'total': pagina.paginator.count,
+    })
+
 @login_required
 def agregar_empleado(request: HttpRequest) -> HttpResponse:
     if request.method == 'POST':
         form = EmpleadoForm(request.POST)
+        form.instance.sucursal_id = request.sucursal.id
         if form.is_valid():
             empleado_guardado = form.save()
             messages.success(request, f'¡Empleado "{empleado_guardado.nombre}" agregado con éxito!')
@@ -93,7 +119,7 @@ def agregar_empleado(request: HttpRequest) -> HttpResponse:
 
 @login_required
 def editar_empleado_view(request: HttpRequest, empleado_id: int) -> HttpResponse:
-    empleado = get_object_or_404(Empleado, id=empleado_id)
+    empleado = get_object_or_404(Empleado, id=empleado_id, sucursal_id=request.sucursal.id)
     
     if request.method == 'POST':
         form = EmpleadoForm(request.POST, instance=empleado)
@@ -114,7 +140,7 @@ def editar_empleado_view(request: HttpRequest, empleado_id: int) -> HttpResponse
 @login_required
 @require_POST
 def desactivar_empleado(request: HttpRequest, empleado_id: int) -> HttpResponse:
-    empleado = get_object_or_404(Empleado, id=empleado_id)
+    empleado = get_object_or_404(Empleado, id=empleado_id, sucursal_id=request.sucursal.id)
     empleado.is_active = False
     empleado.save()
     return redirect('bitacora:panel_empleados')
@@ -122,47 +148,50 @@ def desactivar_empleado(request: HttpRequest, empleado_id: int) -> HttpResponse:
 @login_required
 @require_POST
 def reactivar_empleado(request: HttpRequest, empleado_id: int) -> HttpResponse:
-    empleado = get_object_or_404(Empleado, id=empleado_id)
+    empleado = get_object_or_404(Empleado, id=empleado_id, sucursal_id=request.sucursal.id)
     empleado.is_active = True
     empleado.save()
     return redirect('bitacora:panel_empleados')
 
 @login_required
 @require_POST
-def marcar_asistencia_panel(request: HttpRequest, empleado_id: int, accion: str) -> JsonResponse:
-    empleado = get_object_or_404(Empleado, id=empleado_id)
+def acciones_empleados_view(request: HttpRequest) -> JsonResponse:
+    """
+    Activa o desactiva varios empleados de la sucursal en una sola petición.
+    JSON: {"accion": "activar" | "desactivar", "ids": [...]}
+    """
+    try:
+        accion, ids, _ = masivo.leer_peticion(request.body, masivo.ACCIONES_EMPLEADOS)
+    except masivo.AccionInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse(masivo.cambiar_estado_empleados(request.sucursal.id, ids, accion == 'activar'))
+
+@login_required
+@require_POST
+async def marcar_asistencia_panel(request: HttpRequest, empleado_id: int, accion: str) -> JsonResponse:
+    sucursal = await request.asucursal()
+    empleado = await aget_object_or_404(Empleado, id=empleado_id, sucursal_id=sucursal.id)
     ahora = timezone.localtime(timezone.now())
 
-    config = Configuracion.objects.first()
-    minutos_tolerancia = config.minutos_tolerancia_entrada if config else 0
-    
     if accion == 'entrada':
-        ya_existe_entrada = RegistroAsistencia.objects.filter(
-            empleado=empleado, 
-            fecha_hora_entrada__date=ahora.date()
-        ).exists()
-
-        if ya_existe_entrada:
-            return JsonResponse({'status': 'error', 'message': f"{empleado.nombre} ya tiene una entrada registrada hoy."})
-        
         # --- Lógica de Horario Variable ---
-        hora_entrada_meta = obtener_hora_entrada_esperada(empleado, ahora)
-        
-        llego_tarde = False
-        if hora_entrada_meta:
-            hora_limite = (datetime.combine(ahora.date(), hora_entrada_meta) + timezone.timedelta(minutes=minutos_tolerancia)).time()
-            llego_tarde = ahora.time() > hora_limite
+        hora_entrada_meta = await aobtener_hora_entrada_esperada(empleado, ahora)
+        llego_tarde = calcular_llego_tarde(hora_entrada_meta, ahora, sucursal.minutos_tolerancia_entrada)
         
-        RegistroAsistencia.objects.create(empleado=empleado, fecha_hora_entrada=ahora, llego_tarde=llego_tarde)
+        if await aregistrar_entrada(empleado, ahora, llego_tarde) is None:
+            return JsonResponse({'status': 'error', 'message': f"{empleado.nombre} ya tiene una entrada registrada hoy."})
         
         msg_extra = " (Llegó tarde)" if llego_tarde else ""
         return JsonResponse({'status': 'success', 'message': f"Entrada registrada para {empleado.nombre}.{msg_extra}"})
 
     elif accion == 'salida':
-        ultimo_registro = RegistroAsistencia.objects.filter(empleado=empleado, fecha_hora_salida__isnull=True).order_by('-fecha_hora_entrada').first()
+        ultimo_registro = await RegistroAsistencia.objects.filter(empleado=empleado, fecha_hora_salida__isnull=True).order_by('-fecha_hora_entrada').afirst()
         if ultimo_registro:
             ultimo_registro.fecha_hora_salida = ahora
-            ultimo_registro.save()
+            try:
+                await ultimo_registro.asave()
+            except periodos.RegistroBloqueado as e:
+                return JsonResponse({'status': 'error', 'message': str(e)})
             return JsonResponse({'status': 'success', 'message': f"Salida registrada para {empleado.nombre}."})
         else:
             return JsonResponse({'status': 'error', 'message': f"No se encontró un registro de entrada abierto para {empleado.nombre}."})
@@ -170,271 +199,451 @@ def marcar_asistencia_panel(request: HttpRequest, empleado_id: int, accion: str)
     return JsonResponse({'status': 'error', 'message': 'Acción no válida.'})
     
 @login_required
-def generar_qr_empleado(request: HttpRequest, codigo_empleado_uuid: str) -> HttpResponse:
+async def generar_qr_empleado(request: HttpRequest, codigo_empleado_uuid: str) -> HttpResponse:
     """
     Genera una imagen de código QR que incluye el nombre del empleado debajo.
     """
     try:
-        empleado = get_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid)
+        sucursal = await request.asucursal()
+        empleado = await aget_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid, sucursal_id=sucursal.id)
         nombre_completo = f"{empleado.nombre} {empleado.apellido}"
 
         url_path = reverse('bitacora:pagina_seleccion', args=[codigo_empleado_uuid])
         url_registro = request.build_absolute_uri(url_path)
 
-        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-        qr.add_data(url_registro)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-        # --- Lógica robusta para encontrar una fuente y componer la imagen ---
-        qr_width, qr_height = qr_img.size
-        padding = 20
-        font_size = 40
-        font = None
-
-        # Lista de fuentes a intentar, de más común a menos
-        font_names = ["arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf"]
-        for font_name in font_names:
-            try:
-                font = ImageFont.truetype(font_name, font_size)
-                break  # Si la encuentra, salimos del bucle
-            except IOError:
-                continue # Si no, probamos la siguiente
-
-        # Si no encontró ninguna, usar la fuente por defecto
-        if not font:
-            print("ADVERTENCIA: No se encontró ninguna fuente TrueType. Usando fuente por defecto.")
-            font = ImageFont.load_default()
-
-        # Medir el texto con la fuente que se haya cargado
-        temp_draw = ImageDraw.Draw(Image.new('RGB', (1,1)))
-        text_bbox = temp_draw.textbbox((0, 0), nombre_completo, font=font)
-        text_height = text_bbox[3] - text_bbox[1]
-        text_width = text_bbox[2] - text_bbox[0]
-
-        # Calcular el tamaño del lienzo final
-        canvas_height = qr_height + text_height + padding
-        new_img = Image.new('RGB', (qr_width, canvas_height), 'white')
-
-        # Pegar el QR en el nuevo lienzo
-        new_img.paste(qr_img, (0, 0))
-
-        # Dibujar el texto centrado debajo del QR
-        draw = ImageDraw.Draw(new_img)
-        text_x = (qr_width - text_width) / 2
-        text_y = qr_height + (padding / 2)
-        draw.text((text_x, text_y), nombre_completo, font=font, fill="black")
-
-        # Guardar la imagen final en un buffer de memoria
-        buffer = io.BytesIO()
-        new_img.save(buffer, "PNG")
-        buffer.seek(0)
-
-        return HttpResponse(buffer, content_type="image/png")
+        # Dibujar la imagen es puro CPU: se hace en el pool de hilos de asgiref, fuera del
+        # hilo de la petición, para no detener a los kioskos mientras se imprimen gafetes
+        imagen = await sync_to_async(dibujar_qr, thread_sensitive=False)(url_registro, nombre_completo)
+        return HttpResponse(imagen, content_type="image/png")
 
     except Exception as e:
         print(f"Error al generar QR con nombre: {e}")
         return HttpResponse(f"Error generando QR: {e}", status=500)
 
+def dibujar_qr(url_registro, nombre_completo):
+    """
+    PNG (bytes) con el código QR de `url_registro` y el nombre debajo.
+    """
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+    qr.add_data(url_registro)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    # --- Lógica robusta para encontrar una fuente y componer la imagen ---
+    qr_width, qr_height = qr_img.size
+    padding = 20
+    font_size = 40
+    font = None
+
+    # Lista de fuentes a intentar, de más común a menos
+    font_names = ["arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf"]
+    for font_name in font_names:
+        try:
+            font = ImageFont.truetype(font_name, font_size)
+            break  # Si la encuentra, salimos del bucle
+        except IOError:
+            continue # Si no, probamos la siguiente
+
+    # Si no encontró ninguna, usar la fuente por defecto
+    if not font:
+        print("ADVERTENCIA: No se encontró ninguna fuente TrueType. Usando fuente por defecto.")
+        font = ImageFont.load_default()
+
+    # Medir el texto con la fuente que se haya cargado
+    temp_draw = ImageDraw.Draw(Image.new('RGB', (1,1)))
+    text_bbox = temp_draw.textbbox((0, 0), nombre_completo, font=font)
+    text_height = text_bbox[3] - text_bbox[1]
+    text_width = text_bbox[2] - text_bbox[0]
+
+    # Calcular el tamaño del lienzo final
+    canvas_height = qr_height + text_height + padding
+    new_img = Image.new('RGB', (qr_width, canvas_height), 'white')
+
+    # Pegar el QR en el nuevo lienzo
+    new_img.paste(qr_img, (0, 0))
+
+    # Dibujar el texto centrado debajo del QR
+    draw = ImageDraw.Draw(new_img)
+    text_x = (qr_width - text_width) / 2
+    text_y = qr_height + (padding / 2)
+    draw.text((text_x, text_y), nombre_completo, font=font, fill="black")
+
+    # Guardar la imagen final en un buffer de memoria
+    buffer = io.BytesIO()
+    new_img.save(buffer, "PNG")
+    return buffer.getvalue()
+
 # --- Vistas de Flujo de Asistencia (QR) ---
 
-@login_required
-def pagina_seleccion_accion(request: HttpRequest, codigo_empleado_uuid: str) -> HttpResponse:
-    empleado = get_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid, is_active=True)
-    context = {'empleado': empleado}
-    return render(request, 'bitacora/pagina_seleccion.html', context)
+# Las vistas del kiosko son async: bajo ASGI (gunicorn con workers de uvicorn) cada escaneo
+# espera la BD y la cache sin ocupar un hilo, así que pocos procesos atienden muchos kioskos.
+# Bajo WSGI (runserver, gunicorn sync) Django las corre igual, en su propio event loop.
 
-@login_required
-def registrar_asistencia(request: HttpRequest, codigo_empleado_uuid: str, accion: str) -> HttpResponse:
-    empleado = get_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid)
-    ahora = timezone.localtime(timezone.now())
-    mensaje, es_error = "", False
+def contexto_otra_sucursal(sucursal, empleado):
+    """
+    Resultado del kiosko cuando se escanea el QR de un empleado de otra sucursal.
+    """
+    return {
+        'mensaje': f"Error: {empleado.nombre} no pertenece a la sucursal {sucursal.nombre}.",
+        'es_error': True,
+    }
 
-    config = Configuracion.objects.first()
-    minutos_tolerancia = config.minutos_tolerancia_entrada if config else 0
-    
-    if accion == 'entrada':
-        ya_existe_entrada = RegistroAsistencia.objects.filter(
-            empleado=empleado, 
-            fecha_hora_entrada__date=ahora.date()
-        ).exists()
-
-        if ya_existe_entrada:
-            mensaje = f"Error: {empleado.nombre} ya tiene una entrada registrada hoy."
-            es_error = True
-        else:
-            # --- Lógica de Horario Variable ---
-            hora_entrada_meta = obtener_hora_entrada_esperada(empleado, ahora)
-            llego_tarde = False
-            
-            if hora_entrada_meta:
-                hora_limite = (datetime.combine(ahora.date(), hora_entrada_meta) + timezone.timedelta(minutes=minutos_tolerancia)).time()
-                llego_tarde = ahora.time() > hora_limite
+async def arender(request, plantilla, context, status=200):
+    """
+    render() desde una vista async. Las plantillas extienden master.html y sus context processors
+    (usuario, mensajes, selector de sucursal) leen la sesión con el ORM síncrono, así que se pinta
+    en el hilo de la petición.
+    """
+    return await sync_to_async(render)(request, plantilla, context, status=status)
+
+@acceso_kiosko
+async def pagina_seleccion_accion(request: HttpRequest, codigo_empleado_uuid: str) -> HttpResponse:
+    empleado = await aget_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid, is_active=True)
+    # La sesión del kiosko está ligada a una sucursal: solo escanea a sus empleados
+    sucursal = await request.asucursal()
+    if empleado.sucursal_id != sucursal.id:
+        return await arender(request, 'bitacora/resultado_registro.html', contexto_otra_sucursal(sucursal, empleado), status=403)
+    context = {'empleado': empleado}
+    return await arender(request, 'bitacora/pagina_seleccion.html', context)
+
+@acceso_kiosko
+async def registrar_asistencia(request: HttpRequest, codigo_empleado_uuid: str, accion: str) -> HttpResponse:
+    # Las lecturas repetidas del mismo gafete en la ventana reciben el resultado anterior sin tocar la BD
+    cliente = antirrebote.identificar_cliente(request)
+    previo = await antirrebote.areclamar_escaneo(codigo_empleado_uuid, accion, cliente)
+    if previo is not None:
+        context, status = previo
+        return await arender(request, 'bitacora/resultado_registro.html', context, status=status)
+
+    permitido, espera = await sync_to_async(antirrebote.consumir_ficha)(cliente)
+    if not permitido:
+        await antirrebote.aliberar_escaneo(codigo_empleado_uuid, accion, cliente)
+        context = {'mensaje': f"Error: Demasiados escaneos desde este dispositivo. Intenta de nuevo en {espera} segundos.", 'es_error': True}
+        response = await arender(request, 'bitacora/resultado_registro.html', context, status=429)
+        response['Retry-After'] = str(espera)
+        return response
 
-            RegistroAsistencia.objects.create(empleado=empleado, fecha_hora_entrada=ahora, llego_tarde=llego_tarde)
-            mensaje = f"Entrada registrada para {empleado.nombre} a las {ahora.strftime('%H:%M:%S')}."
-            if llego_tarde:
-                mensaje += " (Llegó tarde)"
+    try:
+        context, status = await procesar_escaneo(request, codigo_empleado_uuid, accion)
+    except BaseException:
+        # También si el cliente cierra la conexión (CancelledError) a media petición
+        await antirrebote.aliberar_escaneo(codigo_empleado_uuid, accion, cliente)
+        raise
+    await antirrebote.arecordar_resultado(codigo_empleado_uuid, accion, cliente, (context, status))
+    return await arender(request, 'bitacora/resultado_registro.html', context, status=status)
+
+async def procesar_escaneo(request, codigo_empleado_uuid, accion):
+    """
+    Registra la entrada o salida del escaneo y devuelve (contexto del resultado, status HTTP).
+    Con el diario de escaneos activo solo se anota en el diario y se confirma al momento;
+    las reglas de entrada/salida se aplican después, al vaciar el diario.
+    """
+    empleado = await aget_object_or_404(Empleado, codigo_qr_unico=codigo_empleado_uuid)
+    sucursal = await request.asucursal()
+    if empleado.sucursal_id != sucursal.id:
+        return contexto_otra_sucursal(sucursal, empleado), 403
+    if accion not in ('entrada', 'salida'):
+        return {'mensaje': "Error: Acción no válida.", 'es_error': True}, 200
 
-    elif accion == 'salida':
-        ultimo_registro = RegistroAsistencia.objects.filter(empleado=empleado, fecha_hora_salida__isnull=True).order_by('-fecha_hora_entrada').first()
-        if ultimo_registro:
-            ultimo_registro.fecha_hora_salida = ahora
-            ultimo_registro.save()
-            mensaje = f"Salida registrada para {empleado.nombre} a las {ahora.strftime('%H:%M:%S')}."
-        else:
-            mensaje, es_error = f"Error: No se encontró un registro de entrada abierto para {empleado.nombre}.", True
-    else:
-        mensaje, es_error = "Error: Acción no válida.", True
-        
-    context = {'mensaje': mensaje, 'es_error': es_error}
-    return render(request, 'bitacora/resultado_registro.html', context)
+    ahora = timezone.localtime(timezone.now())
+    if settings.ESCANEOS_DIARIO:
+        # write + fsync: bloquea, así que va en el hilo de la petición
+        await sync_to_async(diario.anotar_escaneo)(codigo_empleado_uuid, accion, empleado.sucursal_id, ahora)
+        mensaje = f"{accion.capitalize()} recibida para {empleado.nombre} a las {ahora.strftime('%H:%M:%S')}."
+        return {'mensaje': mensaje, 'es_error': False}, 200
+
+    mensaje, es_error = await aaplicar_escaneo(empleado, accion, ahora, sucursal.minutos_tolerancia_entrada)
+    return {'mensaje': mensaje, 'es_error': es_error}, 200
 
 # --- Vistas de Reportes Actualizadas ---
 
 @login_required
 def reportes_view(request: HttpRequest) -> HttpResponse:
-    registros = RegistroAsistencia.objects.select_related('empleado').order_by('-fecha_hora_entrada')
-    
     # Filtros
-    empleado_id = request.GET.get('empleado_id')
-    fecha_inicio_str = request.GET.get('fecha_inicio')
-    fecha_fin_str = request.GET.get('fecha_fin')
+    filtros = obtener_filtros_reporte(request)
     ver_horas = request.GET.get('ver_horas') == 'on' # Toggle switch
-
-    if empleado_id:
-        registros = registros.filter(empleado_id=empleado_id)
-    
-    # Filtro por rango de fechas
-    if fecha_inicio_str:
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
-            registros = registros.filter(fecha_hora_entrada__date__gte=fecha_inicio)
-        except ValueError:
-            pass
-            
-    if fecha_fin_str:
-        try:
-            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
-            registros = registros.filter(fecha_hora_entrada__date__lte=fecha_fin)
-        except ValueError:
-            pass
-
-    # Lógica de Resumen de Horas (Solo si se activa)
-    resumen_horas = []
-    total_general_segundos = 0
-    
-    if ver_horas:
-        # Agrupamos en memoria (diccionario) para sumar horas
-        datos_empleados = {}
-        
-        for reg in registros:
-            # Solo calculamos si hay entrada Y salida
-            if reg.fecha_hora_entrada and reg.fecha_hora_salida:
-                duracion = reg.fecha_hora_salida - reg.fecha_hora_entrada
-                segundos = duracion.total_seconds()
-                
-                emp_id = reg.empleado.id
-                emp_nombre = f"{reg.empleado.nombre} {reg.empleado.apellido}"
-                
-                if emp_id not in datos_empleados:
-                    datos_empleados[emp_id] = {'nombre': emp_nombre, 'total_segundos': 0, 'dias_trabajados': 0}
-                
-                datos_empleados[emp_id]['total_segundos'] += segundos
-                datos_empleados[emp_id]['dias_trabajados'] += 1
-        
-        # Convertimos a lista para el template
-        for datos in datos_empleados.values():
-            seg = int(datos['total_segundos'])
-            horas = seg // 3600
-            minutos = (seg % 3600) // 60
-            
-            resumen_horas.append({
-                'nombre': datos['nombre'],
-                'horas_str': f"{horas}h {minutos}m",
-                'dias': datos['dias_trabajados'],
-                'promedio': round((horas + minutos/60) / datos['dias_trabajados'], 1) if datos['dias_trabajados'] > 0 else 0
-            })
-            total_general_segundos += seg
+    periodo = periodos.periodo_de_filtros(filtros, 'totales', 'cerrado_por')
+
+    def calcular_datos():
+        registros = RegistroAsistencia.objects.select_related('empleado').order_by('-fecha_hora_entrada')
+        registros = filtrar_registros(registros, filtros)
+
+        # Resumen de Horas programadas vs. reales (Solo si se activa)
+        resumen_horas = []
+        if ver_horas:
+            resumen_horas = calcular_horas(
+                empleados_para_resumen(registros, filtros), registros,
+                filtros['fecha_inicio'], filtros['fecha_fin'],
+            )
+        return {
+            'registros': list(registros),
+            'resumen_horas': resumen_horas,
+        }
+
+    if periodo and ver_horas:
+        # Periodo cerrado: el resumen sale tal cual de la foto del cierre
+        datos = {'registros': [], 'resumen_horas': periodos.totales_de(periodo, filtros['empleado_id'])}
+    else:
+        # Mientras no cambien los datos, recargar el mismo reporte cuesta una lectura de cache
+        datos = obtener_o_calcular(
+            'reportes',
+            (filtros['empleado_id'], filtros['fecha_inicio'], filtros['fecha_fin'], ver_horas),
+            calcular_datos,
+            sucursal_id=filtros['sucursal_id'],
+        )
 
     context = {
-        'registros': registros,
-        'todos_los_empleados': Empleado.objects.filter(is_active=True).order_by('nombre'),
+        **datos,
         'ver_horas': ver_horas,
-        'resumen_horas': resumen_horas,
+        'periodo_cerrado': periodo,
+        'registros_bloqueados': periodos.ids_bloqueados(datos['registros'], filtros['sucursal_id']),
+        'empleado_filtrado': empleado_filtrado(filtros).first() if filtros['empleado_id'] else None,
     }
     return render(request, 'bitacora/reportes.html', context)
 
+@login_required
+def puntualidad_view(request: HttpRequest) -> HttpResponse:
+    """
+    Reporte de puntualidad: porcentaje de retardos y minutos promedio de retraso
+    por empleado, por día de la semana y por semana. Se calcula en SQL y se cachea por filtros.
+    """
+    filtros = obtener_filtros_reporte(request)
+    registros = filtrar_registros(RegistroAsistencia.objects.all(), filtros)
+
+    context = {
+        'puntualidad': obtener_puntualidad(registros, filtros),
+        'empleado_filtrado': empleado_filtrado(filtros).first() if filtros['empleado_id'] else None,
+    }
+    return render(request, 'bitacora/puntualidad.html', context)
+
+def obtener_periodo_serie(request):
+    periodo = request.GET.get('periodo', 'dia')
+    return periodo if periodo in PERIODOS_SERIE else 'dia'
+
+def etag_series(request):
+    return hashlib.sha1(etiqueta_series(obtener_filtros_reporte(request), obtener_periodo_serie(request)).encode()).hexdigest()
+
+@login_required
+@gzip_page
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_series)
+def series_asistencia_view(request: HttpRequest) -> JsonResponse:
+    """
+    Series de tiempo para gráficas (entradas, retardos, horas y presentes) por día, semana o mes,
+    con los mismos filtros que los reportes. Responde 304 si los datos no cambiaron (ETag)
+    y va comprimida con gzip, así un tablero puede consultarla seguido sin costo.
+    """
+    filtros = obtener_filtros_reporte(request)
+    registros = filtrar_registros(RegistroAsistencia.objects.all(), filtros)
+    return JsonResponse(obtener_series(registros, filtros, obtener_periodo_serie(request)))
+
+def obtener_modo_exportacion(request):
+    return MODO_NOMINA if request.GET.get('modo') == MODO_NOMINA else MODO_ASISTENCIA
+
 @login_required
 def exportar_excel_view(request: HttpRequest) -> HttpResponse:
-    registros = RegistroAsistencia.objects.select_related('empleado').order_by('-fecha_hora_entrada')
-    
-    empleado_id = request.GET.get('empleado_id')
-    fecha_inicio_str = request.GET.get('fecha_inicio')
-    fecha_fin_str = request.GET.get('fecha_fin')
+    modo = obtener_modo_exportacion(request)
+    contenido = obtener_excel(obtener_filtros_reporte(request), modo)
 
-    if empleado_id:
-        registros = registros.filter(empleado_id=empleado_id)
-    
-    if fecha_inicio_str:
-        try:
-            fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
-            registros = registros.filter(fecha_hora_entrada__date__gte=fecha_inicio)
-        except ValueError: pass
-        
-    if fecha_fin_str:
-        try:
-            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
-            registros = registros.filter(fecha_hora_entrada__date__lte=fecha_fin)
-        except ValueError: pass
+    nombre_archivo = 'reporte_nomina.xlsx' if modo == MODO_NOMINA else 'reporte_asistencia.xlsx'
+    response = HttpResponse(contenido, content_type=CONTENT_TYPE_XLSX)
+    response['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
+    return response
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Reporte de Asistencia"
+@login_required
+@require_POST
+def crear_exportacion_view(request: HttpRequest) -> JsonResponse:
+    """
+    Encola la exportación a Excel con los filtros del query string y responde de inmediato.
+    El navegador consulta el estado hasta que el archivo esté listo para descargar.
+    """
+    trabajo = encolar_exportacion(request.user, obtener_filtros_reporte(request), obtener_modo_exportacion(request))
+    return JsonResponse({
+        'id': str(trabajo.id),
+        'estado': trabajo.estado,
+        'estado_url': reverse('bitacora:estado_exportacion', args=[trabajo.id]),
+    }, status=202)
 
-    headers = ["ID Registro", "Empleado", "Fecha Entrada", "Hora Entrada", "Fecha Salida", "Hora Salida", "Horas Trabajadas", "Llegó Tarde"]
-    ws.append(headers)
+@login_required
+def estado_exportacion_view(request: HttpRequest, trabajo_id) -> JsonResponse:
+    trabajo = get_object_or_404(TrabajoExportacion, id=trabajo_id, usuario=request.user)
+    if trabajo_perdido(trabajo):
+        # Su worker se reinició: se reporta como error para que el reporte deje de consultarlo
+        marcar_trabajos_perdidos()
+        trabajo.refresh_from_db()
+    datos = {
+        'id': str(trabajo.id),
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso,
+    }
+    if trabajo.estado == TrabajoExportacion.TERMINADO:
+        datos['descarga_url'] = reverse('bitacora:descargar_exportacion', args=[trabajo.id])
+    elif trabajo.estado == TrabajoExportacion.ERROR:
+        datos['mensaje'] = trabajo.mensaje_error
+    return JsonResponse(datos)
 
-    for registro in registros:
-        local_entrada = timezone.localtime(registro.fecha_hora_entrada)
-        fecha_salida, hora_salida, horas_trabajadas = '', '', ''
-        
-        if registro.fecha_hora_salida:
-            local_salida = timezone.localtime(registro.fecha_hora_salida)
-            fecha_salida = local_salida.strftime('%d/%m/%Y')
-            hora_salida = local_salida.strftime('%H:%M:%S')
-            
-            duracion = registro.fecha_hora_salida - registro.fecha_hora_entrada
-            segundos = duracion.total_seconds()
-            h = int(segundos // 3600)
-            m = int((segundos % 3600) // 60)
-            horas_trabajadas = f"{h}h {m}m"
-        
-        ws.append([
-            registro.id, str(registro.empleado),
-            local_entrada.strftime('%d/%m/%Y'), local_entrada.strftime('%H:%M:%S'),
-            fecha_salida, hora_salida,
-            horas_trabajadas,
-            "Sí" if registro.llego_tarde else "No"
-        ])
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=reporte_asistencia.xlsx'
-    wb.save(response)
+@login_required
+def descargar_exportacion_view(request: HttpRequest, trabajo_id) -> HttpResponse:
+    trabajo = get_object_or_404(TrabajoExportacion, id=trabajo_id, usuario=request.user, estado=TrabajoExportacion.TERMINADO)
+    try:
+        archivo = open(ruta_archivo(trabajo.archivo), 'rb')
+    except FileNotFoundError:
+        raise Http404("El archivo de la exportación ya expiró.")
+    nombre_archivo = 'reporte_nomina.xlsx' if trabajo.parametros.get('modo') == MODO_NOMINA else 'reporte_asistencia.xlsx'
+    return respuesta_archivo(request, archivo, as_attachment=True, filename=nombre_archivo, content_type=CONTENT_TYPE_XLSX)
+
+@login_required
+def exportar_cambios_view(request: HttpRequest) -> HttpResponse:
+    """
+    Exportación incremental: solo los registros creados/modificados y las eliminaciones
+    posteriores a la marca de agua `desde` (con un solape hacia atrás, ver cambios.py).
+    Sin `desde` se exporta todo. La siguiente marca de agua va en la cabecera X-Marca-Agua.
+    """
+    formato = request.GET.get('formato', 'jsonl')
+    if formato not in cambios.FORMATOS:
+        return JsonResponse({'status': 'error', 'message': f"Formato no válido. Usa: {', '.join(cambios.FORMATOS)}."}, status=400)
+
+    desde = request.GET.get('desde')
+    try:
+        desde = cambios.leer_marca_agua(desde) if desde else None
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    inicio, hasta, siguiente = cambios.calcular_ventana(desde)
+    filas = cambios.iterar_cambios(request.sucursal.id, inicio, hasta)
+
+    if formato == 'xlsx':
+        response = HttpResponse(cambios.excel_cambios(filas), content_type=CONTENT_TYPE_XLSX)
+    elif formato == 'csv':
+        response = StreamingHttpResponse(contenido_streaming(request, cambios.lineas_csv(filas)), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(contenido_streaming(request, cambios.lineas_jsonl(filas)), content_type='application/x-ndjson; charset=utf-8')
+
+    response['Content-Disposition'] = f'attachment; filename=cambios_asistencia.{formato}'
+    response['X-Marca-Agua'] = siguiente.isoformat()
     return response
 
 @login_required
 @require_POST
 def eliminar_registro_asistencia(request: HttpRequest, registro_id: int) -> HttpResponse:
-    registro = get_object_or_404(RegistroAsistencia, id=registro_id)
-    registro.delete()
+    registro = get_object_or_404(RegistroAsistencia, id=registro_id, sucursal_id=request.sucursal.id)
+    try:
+        registro.delete()
+    except periodos.RegistroBloqueado as e:
+        messages.error(request, str(e))
     return redirect('bitacora:reportes')
 
+@login_required
+@require_POST
+def acciones_registros_view(request: HttpRequest) -> JsonResponse:
+    """
+    Acciones masivas sobre registros de la sucursal, en una sola petición:
+    {"accion": "eliminar", "ids": [...]}
+    {"accion": "desplazar", "ids": [...], "minutos": -15, "campo": "entrada" | "salida" | "ambas"}
+    {"accion": "marcar_tarde", "ids": [...], "llego_tarde": true | false | "invertir"}
+    Responde con el resumen (solicitados, procesados y omitidos).
+    """
+    sucursal_id = request.sucursal.id
+    try:
+        accion, ids, datos = masivo.leer_peticion(request.body, masivo.ACCIONES_REGISTROS)
+        if accion == 'eliminar':
+            resultado = masivo.eliminar_registros(sucursal_id, ids)
+        elif accion == 'desplazar':
+            resultado = masivo.desplazar_registros(sucursal_id, ids, datos.get('minutos'), datos.get('campo', 'ambas'))
+        else:
+            resultado = masivo.marcar_tarde(sucursal_id, ids, datos.get('llego_tarde'))
+    except masivo.AccionInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse(resultado)
+
+@login_required
+@require_POST
+def cerrar_periodo_view(request: HttpRequest) -> HttpResponse:
+    """
+    Cierra el periodo de pago de la sucursal actual: guarda la foto de sus números y
+    bloquea sus registros. Regresa al reporte del periodo.
+    """
+    form = CerrarPeriodoForm(request.POST)
+    if not form.is_valid():
+        for errores in form.errors.values():
+            messages.error(request, errores[0])
+        return redirect('bitacora:reportes')
+
+    fecha_inicio, fecha_fin = form.cleaned_data['fecha_inicio'], form.cleaned_data['fecha_fin']
+    try:
+        periodos.cerrar_periodo(request.sucursal, fecha_inicio, fecha_fin, request.user)
+        messages.success(request, f'¡Periodo del {fecha_inicio:%d/%m/%Y} al {fecha_fin:%d/%m/%Y} cerrado! Sus registros ya no se pueden modificar.')
+    except ValueError as e:
+        messages.error(request, str(e))
+    return redirect(f"{reverse('bitacora:reportes')}?fecha_inicio={fecha_inicio:%Y-%m-%d}&fecha_fin={fecha_fin:%Y-%m-%d}")
+
 # --- Vistas de Configuración y Administración ---
 
+@login_required
+@require_POST
+def cambiar_sucursal_view(request: HttpRequest) -> HttpResponse:
+    """
+    Cambia la sucursal de la sesión (selector del menú lateral) y regresa a la página anterior.
+    """
+    sucursal = get_object_or_404(Sucursal, id=request.POST.get('sucursal_id'))
+    cambiar_sucursal(request, sucursal)
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('bitacora:panel_empleados')
+
+@login_required
+@require_POST
+def activar_kiosko_view(request: HttpRequest) -> HttpResponse:
+    """
+    Convierte este navegador en kiosko de escaneo de la sucursal actual: registra el dispositivo
+    y guarda su token firmado en una cookie de larga duración. El token se muestra una sola vez
+    (token_kiosko_view) para usarlo como 'Authorization: Bearer' en lectores que no manejan cookies.
+    """
+    nombre = request.POST.get('dispositivo', '').strip()[:50]
+    if not nombre:
+        messages.error(request, 'Escribe un nombre para identificar el dispositivo.')
+        return redirect('bitacora:configuracion')
+
+    dispositivo = DispositivoKiosko.objects.create(sucursal=request.sucursal, nombre=nombre, creado_por=request.user)
+    token = emitir_token(dispositivo)
+    request.session[CLAVE_SESION_TOKEN_KIOSKO] = {'token': token, 'dispositivo': nombre}
+    response = redirect('bitacora:token_kiosko')
+    response.set_cookie(
+        COOKIE_KIOSKO, token,
+        max_age=settings.KIOSKO_TOKEN_DIAS * 24 * 60 * 60,
+        httponly=True, samesite='Lax', secure=request.is_secure(),
+    )
+    return response
+
+@never_cache
+@login_required
+def token_kiosko_view(request: HttpRequest) -> HttpResponse:
+    """
+    Muestra el token del kiosko recién activado. Se saca de la sesión al mostrarlo:
+    recargar la página ya no lo enseña (ni queda en mensajes o en el historial).
+    """
+    datos = request.session.pop(CLAVE_SESION_TOKEN_KIOSKO, None)
+    if datos is None:
+        messages.error(request, 'El token del kiosko solo se muestra una vez. Si lo perdiste, revoca el dispositivo y actívalo de nuevo.')
+        return redirect('bitacora:configuracion')
+    return render(request, 'bitacora/kiosko_token.html', datos)
+
+@login_required
+@require_POST
+def revocar_kiosko_view(request: HttpRequest, dispositivo_id) -> HttpResponse:
+    """
+    Revoca un kiosko de la sucursal actual; los demás dispositivos siguen funcionando.
+    """
+    dispositivo = get_object_or_404(DispositivoKiosko, id=dispositivo_id, sucursal_id=request.sucursal.id, revocado__isnull=True)
+    revocar_dispositivo(dispositivo)
+    messages.success(request, f'El kiosko "{dispositivo.nombre}" fue revocado; su token ya no sirve.')
+    return redirect('bitacora:configuracion')
+
 @login_required
 def configuracion_view(request: HttpRequest) -> HttpResponse:
-    config, created = Configuracion.objects.get_or_create(id=1)
+    # La configuración de asistencia (tolerancia) es de la sucursal actual
+    config = get_object_or_404(Sucursal, id=request.sucursal.id)
     
     # Obtener todos los superusuarios (administradores)
     admins = User.objects.filter(is_superuser=True).order_by('username')
@@ -443,6 +652,11 @@ def configuracion_view(request: HttpRequest) -> HttpResponse:
         form = ConfiguracionForm(request.POST, instance=config)
         if form.is_valid():
             form.save()
+
+            nueva_sucursal = form.cleaned_data.get('nueva_sucursal')
+            if nueva_sucursal:
+                Sucursal.objects.create(nombre=nueva_sucursal, minutos_tolerancia_entrada=config.minutos_tolerancia_entrada)
+                messages.success(request, f'¡Sucursal "{nueva_sucursal}" creada! Cámbiala desde el menú para administrarla.')
             
             nuevo_usuario = form.cleaned_data.get('nuevo_admin_usuario')
             nuevo_password = form.cleaned_data.get('nuevo_admin_password')
@@ -453,7 +667,7 @@ def configuracion_view(request: HttpRequest) -> HttpResponse:
                 messages.success(request, f'¡Administrador "{nuevo_usuario}" creado con éxito!')
 
             # Evitar doble mensaje de éxito si solo se creó un usuario
-            if not (nuevo_usuario and nuevo_password):
+            if not (nuevo_usuario and nuevo_password) and not nueva_sucursal:
                  messages.success(request, '¡Configuración guardada correctamente!')
                  
             return redirect('bitacora:configuracion')
@@ -462,7 +676,8 @@ def configuracion_view(request: HttpRequest) -> HttpResponse:
 
     context = {
         'form': form,
-        'admins': admins  # Añadir lista de admins al contexto
+        'admins': admins,  # Añadir lista de admins al contexto
+        'dispositivos': DispositivoKiosko.objects.filter(sucursal_id=config.id, revocado__isnull=True),
     }
     return render(request, 'bitacora/configuracion.html', context)
 
@@ -3,31 +3,62 @@
 # Detener el script si hay errores
 set -e
 
+# Marca de tiempo de arranque (milisegundos) para medir cuánto tarda en estar listo
+INICIO_MS=$(date +%s%3N)
+
 echo "--- Iniciando configuración de MixteMiches ---"
 
 # 1. PERSISTENCIA DE BASE DE DATOS (Truco del enlace simbólico)
 # Si la carpeta de datos montada existe, enlazamos el db.sqlite3 de ahí
 # a la ubicación donde Django lo espera (/app/db.sqlite3).
-if [ -d "/app/data" ]; then
-    echo "Configurando persistencia de base de datos..."
+# Es idempotente: si el enlace ya apunta al volumen no se toca nada.
+# Con PostgreSQL (DB_ENGINE=postgresql) los datos viven en el servidor y este paso no aplica.
+if [ "${DB_ENGINE:-sqlite}" = "sqlite" ] && [ -d "/app/data" ]; then
     # Si no existe el archivo en el volumen, lo creamos vacío para poder enlazarlo
     if [ ! -f "/app/data/db.sqlite3" ]; then
         touch /app/data/db.sqlite3
     fi
-    # Creamos un enlace simbólico: Django escribe en /app/db.sqlite3 -> Realmente escribe en /app/data/db.sqlite3
-    ln -sf /app/data/db.sqlite3 /app/db.sqlite3
+    if [ "$(readlink /app/db.sqlite3 2>/dev/null)" != "/app/data/db.sqlite3" ]; then
+        echo "Configurando persistencia de base de datos..."
+        # Un archivo real en /app/db.sqlite3 (no enlace) quedaría oculto; lo quitamos antes de enlazar
+        rm -f /app/db.sqlite3
+        # Django escribe en /app/db.sqlite3 -> Realmente escribe en /app/data/db.sqlite3
+        ln -s /app/data/db.sqlite3 /app/db.sqlite3
+    fi
+fi
+
+# 1b. CACHE COMPARTIDA
+# Con varios workers la cache tiene que ser compartida (REDIS_URL): con LocMemCache cada proceso
+# tendría su propia versión de los reportes, su cache de periodos cerrados, sus sesiones y su
+# antirrebote, y un worker serviría datos que otro ya invalidó.
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ] && [ -z "${REDIS_URL}" ]; then
+    echo "ERROR: WEB_CONCURRENCY=${WEB_CONCURRENCY} requiere una cache compartida; define REDIS_URL." >&2
+    exit 1
 fi
 
-# 2. RECOLECCIÓN DE ARCHIVOS ESTÁTICOS
-# Nota: Asegúrate de tener STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') en tu settings.py
-echo "Recolectando archivos estáticos..."
-python manage.py collectstatic --noinput
+# 2. ARCHIVOS ESTÁTICOS
+# Ya se recolectan al construir la imagen (ver Dockerfile), no en cada arranque.
 
 # 3. MIGRACIONES DE BASE DE DATOS
-echo "Ejecutando migraciones..."
-python manage.py migrate
+# 'migrate --check' solo revisa el plan (sale con código distinto de 0 si hay pendientes),
+# así que en un reinicio normal nos ahorramos el 'migrate' completo.
+if python manage.py migrate --check > /dev/null 2>&1; then
+    echo "Base de datos al día, no hay migraciones pendientes."
+else
+    echo "Ejecutando migraciones..."
+    python manage.py migrate --noinput
+fi
+
+# 4. DIARIO DE ESCANEOS
+# Si quedaron escaneos confirmados al kiosko pero sin aplicar (apagado o caída), se aplican
+# antes de aceptar peticiones. Solo se arranca Django si hay archivos en el diario.
+if ls "${ESCANEOS_DIARIO_DIR:-/app/data/diario}"/diario-* > /dev/null 2>&1; then
+    echo "Aplicando escaneos pendientes del diario..."
+    python manage.py aplicar_diario
+fi
 
-echo "--- Configuración terminada. Iniciando Servidor ---"
+FIN_MS=$(date +%s%3N)
+echo "--- Configuración terminada en $((FIN_MS - INICIO_MS)) ms. Iniciando Servidor ---"
 
 # Ejecuta el comando pasado al contenedor (gunicorn)
-exec "$@"
\ No newline at end of file
+exec "$@"
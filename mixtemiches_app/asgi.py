@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mixtemiches_app.settings')
 
 application = get_asgi_application()
+
+# Igual que en wsgi.py: cada worker arranca el hilo aplicador del diario de escaneos.
+from bitacora import diario  # noqa: E402
+
+diario.iniciar()
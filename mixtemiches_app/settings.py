@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bitacora.sucursales.SucursalMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'bitacora.sucursales.sucursales',
             ],
         },
     },
@@ -74,13 +76,146 @@ WSGI_APPLICATION = 'mixtemiches_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite por defecto (un archivo, las escrituras van en fila). Con DB_ENGINE=postgresql se usa
+# PostgreSQL con un pool de conexiones de psycopg por proceso; los .iterator() de reportes y
+# exportaciones usan cursores del lado del servidor. Si hay un pgbouncer en modo transacción
+# enfrente, define DB_DISABLE_SERVER_SIDE_CURSORS=1.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'mixtemiches'),
+            'USER': os.environ.get('DB_USER', 'mixtemiches'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', '0') == '1',
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+                    'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                },
+            },
+            # La base de datos de pruebas se crea en el mismo servidor local
+            'TEST': {'NAME': os.environ.get('DB_TEST_NAME', 'test_mixtemiches')},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Por defecto vive en la memoria de cada proceso (LocMemCache). Con varios workers de gunicorn
+# hay que definir REDIS_URL (ej. redis://redis:6379/0) para que todos compartan la misma cache:
+# la versión de los reportes, los periodos cerrados, las sesiones y el antirrebote del kiosko,
+# que necesita add() e incr() atómicos entre procesos. El entrypoint no arranca con
+# WEB_CONCURRENCY>1 sin ella.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+def _cache(nombre, **opciones):
+    if REDIS_URL:
+        # MAX_ENTRIES/CULL_FREQUENCY no aplican: Redis desaloja según su maxmemory-policy
+        # (conviene allkeys-lru). Cada cache usa su propio prefijo en la misma base.
+        opciones.pop('OPTIONS', None)
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': nombre,
+            **opciones,
+        }
+    return {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'mixtemiches-{nombre}',
+        **opciones,
+    }
+
+CACHES = {
+    'default': _cache('default'),
+    # Resultados de reportes y archivos Excel ya generados. LocMemCache desaloja
+    # las entradas menos usadas (LRU) al llegar a MAX_ENTRIES; en Redis, su política de memoria.
+    'reportes': _cache(
+        'reportes',
+        TIMEOUT=int(os.environ.get('REPORTES_CACHE_TIMEOUT', 60 * 60)),
+        OPTIONS={'MAX_ENTRIES': int(os.environ.get('REPORTES_CACHE_MAX_ENTRIES', 100)), 'CULL_FREQUENCY': 4},
+    ),
+    # Antirrebote y límite de escaneos del kiosko (entradas pequeñas y de vida corta)
+    'escaneos': _cache('escaneos', OPTIONS={'MAX_ENTRIES': 5000}),
 }
 
+# Tamaño máximo (bytes) de un resultado individual guardado en la cache de reportes
+REPORTES_CACHE_MAX_BYTES = int(os.environ.get('REPORTES_CACHE_MAX_BYTES', 5 * 1024 * 1024))
+
+
+# Días de descanso (0=Lunes ... 6=Domingo) del horario general: esos días no se programan
+# horas ni se marcan ausencias. También aplica a los días que un horario variable no define;
+# quien trabaja en fin de semana lo configura en su horario variable. Vacío: 7 días laborables.
+HORARIO_GENERAL_DIAS_DESCANSO = tuple(
+    int(dia) for dia in os.environ.get('HORARIO_GENERAL_DIAS_DESCANSO', '5,6').split(',') if dia.strip()
+)
+
+# Exportaciones en segundo plano
+# Los archivos se guardan en data/ (el volumen persistente en Docker) y se borran al expirar.
+EXPORTACIONES_DIR = os.environ.get('EXPORTACIONES_DIR', str(BASE_DIR / 'data' / 'exportaciones'))
+# Procesos hijos por worker web que arman los Excel (cada uno carga Django y openpyxl)
+EXPORTACIONES_WORKERS = int(os.environ.get('EXPORTACIONES_WORKERS', 2))
+EXPORTACIONES_EXPIRACION_HORAS = int(os.environ.get('EXPORTACIONES_EXPIRACION_HORAS', 24))
+# Un trabajo sin terminar después de este tiempo se da por perdido (su worker se reinició)
+EXPORTACIONES_LIMITE_MINUTOS = int(os.environ.get('EXPORTACIONES_LIMITE_MINUTOS', 30))
+
+# Libro de nómina: las hojas por empleado se calculan en un pool de procesos solo cuando el
+# periodo tiene al menos NOMINA_MIN_REGISTROS_PARALELO registros. Por debajo (un mes de 200
+# empleados son unos 5,000) armarlas en línea es más rápido que arrancar el pool.
+NOMINA_PROCESOS = int(os.environ.get('NOMINA_PROCESOS', os.cpu_count() or 1))
+NOMINA_MIN_REGISTROS_PARALELO = int(os.environ.get('NOMINA_MIN_REGISTROS_PARALELO', 50000))
+
+# Exportación incremental: segundos que se dejan fuera de la ventana (escrituras recientes y
+# diferencias de reloj entre servidores; entran en la siguiente exportación). 'modificado' se
+# fija al guardar, no al confirmar: una transacción larga (un lote del diario, el proceso
+# nocturno) confirma filas con una hora ya anterior a la marca de agua. Por eso cada exportación
+# vuelve a leer CAMBIOS_SOLAPE_SEGUNDOS antes de la marca; lo que ya se envió se repite idéntico.
+CAMBIOS_MARGEN_SEGUNDOS = int(os.environ.get('CAMBIOS_MARGEN_SEGUNDOS', 5))
+CAMBIOS_SOLAPE_SEGUNDOS = int(os.environ.get('CAMBIOS_SOLAPE_SEGUNDOS', 15 * 60))
+
+# Escaneos del kiosko: las lecturas repetidas del mismo gafete dentro de la ventana reciben
+# el resultado anterior; cada dispositivo puede hacer ESCANEOS_RAFAGA escaneos por ventana, con
+# ventanas que dan ESCANEOS_POR_MINUTO en promedio (si se pasa recibe 429 con Retry-After).
+ESCANEOS_VENTANA_SEGUNDOS = int(os.environ.get('ESCANEOS_VENTANA_SEGUNDOS', 5))
+ESCANEOS_RAFAGA = int(os.environ.get('ESCANEOS_RAFAGA', 10))
+ESCANEOS_POR_MINUTO = int(os.environ.get('ESCANEOS_POR_MINUTO', 30))
+
+# Diario de escaneos: con ESCANEOS_DIARIO=1 cada escaneo se guarda (fsync) en un archivo local
+# y se confirma al kiosko de inmediato; un hilo lo aplica a la BD en lotes cada
+# ESCANEOS_DIARIO_INTERVALO segundos. Lo pendiente se reaplica al arrancar.
+ESCANEOS_DIARIO = os.environ.get('ESCANEOS_DIARIO', '0') == '1'
+ESCANEOS_DIARIO_DIR = os.environ.get('ESCANEOS_DIARIO_DIR', str(BASE_DIR / 'data' / 'diario'))
+ESCANEOS_DIARIO_LOTE = int(os.environ.get('ESCANEOS_DIARIO_LOTE', 200))
+ESCANEOS_DIARIO_INTERVALO = float(os.environ.get('ESCANEOS_DIARIO_INTERVALO', 0.5))
+# Los escaneos más recientes que esto esperan al siguiente ciclo: los archivos de todos los
+# workers se aplican en orden de hora y uno más viejo puede ir todavía camino al archivo de otro.
+ESCANEOS_DIARIO_MARGEN_SEGUNDOS = float(os.environ.get('ESCANEOS_DIARIO_MARGEN_SEGUNDOS', 2))
+
+
+# Sesiones del panel: cached_db lee la sesión de la cache y solo escribe en la BD al modificarla.
+# Se puede cambiar por signed_cookies con SESSION_ENGINE. Las vencidas se borran con limpiar_sesiones.
+# Con varios workers define REDIS_URL (ver CACHES) para que un logout se vea en todos.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Tokens de los kioskos de escaneo (firmados con SECRET_KEY, ver bitacora/kiosko.py).
+# Cada dispositivo se revoca desde Configuración; cambiar KIOSKO_TOKEN_SALT invalida todos los tokens emitidos.
+KIOSKO_TOKEN_SALT = os.environ.get('KIOSKO_TOKEN_SALT', 'bitacora.kiosko')
+KIOSKO_TOKEN_DIAS = int(os.environ.get('KIOSKO_TOKEN_DIAS', 365))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
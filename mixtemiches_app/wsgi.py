@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mixtemiches_app.settings')
 
 application = get_wsgi_application()
+
+# Con el diario de escaneos activo, cada worker arranca su hilo aplicador
+# (y de paso reaplica lo que haya quedado pendiente de un arranque anterior).
+from bitacora import diario  # noqa: E402
+
+diario.iniciar()